@@ -1,8 +1,25 @@
+import hashlib
+from collections import namedtuple
+
+import numpy as np
 from rapidfuzz import distance as fuzz_dist, process
-import nltk
-from nltk.tokenize import word_tokenize
 import string
 
+from cache import LRUCache
+
+
+remove_punct = str.maketrans('', '', string.punctuation)
+
+# nltk is imported on first tokenization, it is slow to import
+_word_tokenize = None
+
+
+def word_tokenize(sentence):
+    global _word_tokenize
+    if _word_tokenize is None:
+        from nltk.tokenize import word_tokenize as _word_tokenize
+    return _word_tokenize(sentence)
+
 
 def preprocess_text(sentence, level):
 
@@ -17,7 +34,6 @@ def preprocess_text(sentence, level):
       list: tokenized text
     """
     
-    remove_punct = str.maketrans('', '', string.punctuation)
     sentence = sentence.translate(remove_punct).lower()
 
     # Tokenize the sentence
@@ -28,6 +44,25 @@ def preprocess_text(sentence, level):
     return processed_words
 
 
+def as_tokens(sentence, level):
+
+    """
+    Accept either raw text or a reference that was already tokenized with
+    preprocess_text, so callers can precompute recurring references once.
+
+    Args:
+      sentence: targeted text or list of tokens
+      level: level to split the text, ex. word, phoneme, character
+
+    Return:
+      list: tokenized text
+    """
+
+    if isinstance(sentence, (list, tuple)):
+        return sentence
+    return preprocess_text(sentence, level)
+
+
 def word_level_alignment(reference_sentence, hypothesis_sentence):
 
     """
@@ -36,16 +71,16 @@ def word_level_alignment(reference_sentence, hypothesis_sentence):
     the transcription should be marked as Correct, Substituted, or Deleted.
 
     Args:
-      reference_sentence
-      hypothesis_sentence
+      reference_sentence: text, or word tokens from preprocess_text
+      hypothesis_sentence: text, or word tokens from preprocess_text
 
     Return:
       list[dict]: word-level features for each word in the reference sentence
     """
 
     # Tokenize sentences into words
-    ref_words = preprocess_text(reference_sentence, "word")
-    hyp_words = preprocess_text(hypothesis_sentence, "word")
+    ref_words = as_tokens(reference_sentence, "word")
+    hyp_words = as_tokens(hypothesis_sentence, "word")
     
     # Compute edit operations needed to transform hypothesis into reference at the word level
     edit_ops = fuzz_dist.Levenshtein.editops(ref_words, hyp_words)
@@ -104,7 +139,300 @@ def word_level_alignment(reference_sentence, hypothesis_sentence):
 
     return word_alignment_result
 
-def phoneme_level_alignment(reference_sentence, hypothesis_sentence):
+# Status codes returned by align_words_batch, index into WORD_STATUSES
+STATUS_CORRECT, STATUS_SUBSTITUTED, STATUS_DELETED, STATUS_PAD = 0, 1, 2, -1
+WORD_STATUSES = ("Correct", "Substituted", "Deleted")
+
+BatchWordAlignment = namedtuple('BatchWordAlignment', ['status', 'hypo_index', 'ref_lengths'])
+
+
+def _encode_batch(sequences, vocab, pad):
+
+    """ Integer-encode token sequences into a padded (len(sequences), max_len) array. """
+
+    lengths = np.array([len(tokens) for tokens in sequences], dtype=np.int64)
+    encoded = np.full((len(sequences), max(lengths.max(initial=0), 1)), pad, dtype=np.int64)
+    for k, tokens in enumerate(sequences):
+        encoded[k, :len(tokens)] = [vocab.setdefault(token, len(vocab)) for token in tokens]
+    return encoded, lengths
+
+
+def _shift_left(encoded, offsets, lengths, pad):
+
+    """ out[k, j] = encoded[k, offsets[k] + j] for j < lengths[k], pad elsewhere. """
+
+    columns = np.arange(encoded.shape[1])
+    source = np.minimum(offsets[:, None] + columns, encoded.shape[1] - 1)
+    shifted = np.take_along_axis(encoded, source, axis=1)
+    return np.where(columns < lengths[:, None], shifted, pad)
+
+
+def _strip_affixes(ref_ids, ref_lengths, hyp_ids, hyp_lengths):
+
+    """
+    Common prefix and suffix lengths of padded pairs, as removed by
+    rapidfuzz before aligning, and the remaining core of each sequence
+    shifted to the left.
+
+    Return:
+      (prefix, suffix, core_ref, core_ref_lengths, core_hyp, core_hyp_lengths)
+    """
+
+    # pads differ so they never match
+    width = min(ref_ids.shape[1], hyp_ids.shape[1])
+    prefix = np.cumprod(ref_ids[:, :width] == hyp_ids[:, :width], axis=1).sum(axis=1)
+    ref_reversed = _shift_left(ref_ids[:, ::-1], ref_ids.shape[1] - ref_lengths, ref_lengths, -1)
+    hyp_reversed = _shift_left(hyp_ids[:, ::-1], hyp_ids.shape[1] - hyp_lengths, hyp_lengths, -2)
+    suffix = np.cumprod(ref_reversed[:, :width] == hyp_reversed[:, :width], axis=1).sum(axis=1)
+    suffix = np.minimum(suffix, np.minimum(ref_lengths, hyp_lengths) - prefix)
+
+    core_ref_lengths = ref_lengths - prefix - suffix
+    core_hyp_lengths = hyp_lengths - prefix - suffix
+    core_ref = _shift_left(ref_ids, prefix, core_ref_lengths, -1)
+    core_hyp = _shift_left(hyp_ids, prefix, core_hyp_lengths, -2)
+    return prefix, suffix, core_ref, core_ref_lengths, core_hyp, core_hyp_lengths
+
+
+def _align_chunk(ref_ids, ref_lengths, hyp_ids, hyp_lengths):
+
+    """
+    Levenshtein alignment of a chunk of integer-encoded pairs. Mirrors
+    rapidfuzz's editops (common affix removal, then backtrace preferring
+    deletion, insertion, diagonal), so results match word_level_alignment.
+    """
+
+    n_pairs, max_ref = ref_ids.shape
+    rows = np.arange(n_pairs)
+
+    prefix, suffix, core_ref, core_ref_lengths, core_hyp, core_hyp_lengths = _strip_affixes(ref_ids, ref_lengths,
+                                                                                             hyp_ids, hyp_lengths)
+    n_ref, n_hyp = int(core_ref_lengths.max(initial=0)), int(core_hyp_lengths.max(initial=0))
+
+    # D[k, c, r]: distance between the first c core reference tokens and the
+    # first r core hypothesis tokens. Row c follows from row c - 1 with a
+    # running minimum for the insertions within the row.
+    hyp_range = np.arange(n_hyp + 1)
+    dist = np.empty((n_pairs, n_ref + 1, n_hyp + 1), dtype=np.int32)
+    dist[:, 0, :] = hyp_range
+    for c in range(1, n_ref + 1):
+        previous = dist[:, c - 1, :]
+        candidate = np.empty_like(previous)
+        candidate[:, 0] = c
+        candidate[:, 1:] = np.minimum(previous[:, 1:] + 1,
+                                      previous[:, :-1] + (core_ref[:, c - 1, None] != core_hyp[:, :n_hyp]))
+        dist[:, c, :] = np.minimum.accumulate(candidate - hyp_range, axis=1) + hyp_range
+
+    status = np.full((n_pairs, max_ref), STATUS_PAD, dtype=np.int8)
+    hypo_pos = np.full((n_pairs, max_ref), -1, dtype=np.int64)
+    valid = np.arange(max_ref) < ref_lengths[:, None]
+    status[valid] = STATUS_CORRECT
+
+    # prefix and suffix are equal runs
+    ref_positions = np.broadcast_to(np.arange(max_ref), (n_pairs, max_ref))
+    in_prefix = ref_positions < prefix[:, None]
+    in_suffix = valid & (ref_positions >= (ref_lengths - suffix)[:, None])
+    hypo_pos[in_prefix] = ref_positions[in_prefix]
+    hypo_pos[in_suffix] = (ref_positions + (hyp_lengths - ref_lengths)[:, None])[in_suffix]
+
+    leading_inserts = np.zeros(n_pairs, dtype=np.int64)
+    c = core_ref_lengths.copy()
+    r = core_hyp_lengths.copy()
+    while True:
+        active = (c > 0) & (r > 0)
+        if not active.any():
+            break
+        k, ck, rk = rows[active], c[active], r[active]
+
+        deleted = dist[k, ck, rk] - dist[k, ck - 1, rk] == 1
+        kd = k[deleted]
+        status[kd, ck[deleted] - 1 + prefix[kd]] = STATUS_DELETED
+        c[kd] -= 1
+
+        k, ck, rk = k[~deleted], ck[~deleted], rk[~deleted] - 1
+        r[k] = rk
+        inserted = (rk > 0) & (dist[k, ck, rk] - dist[k, ck - 1, rk] == -1)
+        leading_inserts[k[inserted & (ck == 0) & (prefix[k] == 0)]] += 1
+
+        k, ck, rk = k[~inserted], ck[~inserted] - 1, rk[~inserted]
+        c[k] = ck
+        ref_pos = ck + prefix[k]
+        substituted = core_ref[k, ck] != core_hyp[k, rk]
+        status[k, ref_pos] = np.where(substituted, STATUS_SUBSTITUTED, STATUS_CORRECT)
+        hypo_pos[k, ref_pos] = rk + prefix[k]
+
+    # whatever is left of the core reference was deleted, of the hypothesis inserted
+    core_positions = np.arange(max_ref)
+    remaining = valid & (core_positions >= prefix[:, None]) & (core_positions < (prefix + c)[:, None])
+    status[remaining] = STATUS_DELETED
+    leading_inserts += np.where(prefix == 0, r, 0)
+
+    aligned = (status == STATUS_CORRECT) | (status == STATUS_SUBSTITUTED)
+    hypo_index = np.where(aligned, hypo_pos - leading_inserts[:, None], -1)
+    return status, hypo_index
+
+
+def align_words_batch(references, hypotheses, chunk_size=4096):
+
+    """
+    Vectorized word_level_alignment over many reference/hypothesis pairs.
+    Tokens are integer-encoded against a shared vocabulary and aligned with
+    a NumPy Levenshtein DP over padded arrays. Pairs are sorted by length
+    and aligned chunk by chunk to limit padding and memory.
+
+    HypoIndex follows word_level_alignment, including its handling of
+    insertions before the first reference word.
+
+    Args:
+      references: list of reference texts or word tokens
+      hypotheses: list of hypothesis texts or word tokens
+      chunk_size: number of pairs aligned per DP call
+
+    Return:
+      BatchWordAlignment: status (n_pairs, max_ref_len) int8 codes from
+      WORD_STATUSES with STATUS_PAD past each reference, hypo_index of the
+      same shape with -1 for deleted and padded words, and ref_lengths
+    """
+
+    if len(references) != len(hypotheses):
+        raise ValueError("references and hypotheses must have the same length")
+
+    ref_tokens = [as_tokens(reference, "word") for reference in references]
+    hyp_tokens = [as_tokens(hypothesis, "word") for hypothesis in hypotheses]
+
+    vocab = {}
+    ref_ids, ref_lengths = _encode_batch(ref_tokens, vocab, -1)
+    hyp_ids, hyp_lengths = _encode_batch(hyp_tokens, vocab, -2)
+
+    status = np.full(ref_ids.shape, STATUS_PAD, dtype=np.int8)
+    hypo_index = np.full(ref_ids.shape, -1, dtype=np.int64)
+
+    order = np.lexsort((hyp_lengths, ref_lengths))
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        ref_width = max(ref_lengths[chunk].max(), 1)
+        hyp_width = max(hyp_lengths[chunk].max(), 1)
+        chunk_status, chunk_hypo = _align_chunk(ref_ids[chunk, :ref_width], ref_lengths[chunk],
+                                                hyp_ids[chunk, :hyp_width], hyp_lengths[chunk])
+        status[chunk, :ref_width] = chunk_status
+        hypo_index[chunk, :ref_width] = chunk_hypo
+
+    return BatchWordAlignment(status=status, hypo_index=hypo_index, ref_lengths=ref_lengths)
+
+
+# Per-word phoneme counts, columns of PhonemeAlignment.counts
+PHONEME_STATUSES = "CSDI"
+STATUS_CODES = np.frombuffer(PHONEME_STATUSES.encode('ascii'), dtype=np.uint8)
+
+PhonemeAlignment = namedtuple('PhonemeAlignment', ['ref_phoneme', 'hypo_phoneme', 'word_starts', 'word_ends',
+                                                   'counts', 'correct_rate'])
+
+
+def _aligned_phoneme_strings(ref_words, hyp_words, opcodes):
+
+    """
+    Walk the opcodes once and build the aligned reference, hypothesis and
+    status strings block by block ("*" marks a gap). Insertions before the
+    first reference phoneme are skipped without advancing the hypothesis
+    position, as in the original implementation.
+
+    Args:
+      ref_words, hyp_words: phoneme characters
+      opcodes: (tag, src_start, src_end, dest_start, dest_end) tuples
+
+    Return:
+      (ref_phoneme, hypo_phoneme, status_sequence): aligned strings of equal length
+    """
+
+    ref_blocks, hypo_blocks, status_blocks = [], [], []
+    emitted = 0
+    index = 0
+    for tag, src_start, src_end, dest_start, dest_end in opcodes:
+        if tag == 'equal' or tag == 'replace':
+            n = min(src_end - src_start, dest_end - dest_start)
+            ref_blocks.append(''.join(ref_words[src_start:src_start + n]))
+            hypo_blocks.append(''.join(hyp_words[index:index + n]))
+            status_blocks.append(("C" if tag == 'equal' else "S") * n)
+            index += n
+        elif tag == 'delete':
+            n = src_end - src_start
+            ref_blocks.append(''.join(ref_words[src_start:src_end]))
+            hypo_blocks.append("*" * n)
+            status_blocks.append("D" * n)
+        elif tag == 'insert':
+
+            if not emitted:
+                continue
+
+            n = dest_end - dest_start
+            ref_blocks.append("*" * n)
+            hypo_blocks.append(''.join(hyp_words[index:index + n]))
+            status_blocks.append("I" * n)
+            index += n
+        emitted += n
+
+    return ''.join(ref_blocks), ''.join(hypo_blocks), ''.join(status_blocks)
+
+
+def _phoneme_alignment_arrays(ref_phoneme, hypo_phoneme, status_sequence):
+
+    """
+    PhonemeAlignment of the aligned strings. Word offsets come from one scan
+    of the reference for spaces (a space in the last position belongs to the
+    last word) and the per-word C/S/D/I counts from one np.add.reduceat over
+    the status sequence into a preallocated array.
+    """
+
+    codes = np.frombuffer(ref_phoneme.encode('utf-32-le'), dtype=np.uint32)
+    spaces = np.flatnonzero(codes[:-1] == ord(" "))
+    if ref_phoneme:
+        word_starts, word_ends = np.concatenate(([0], spaces + 1)), np.append(spaces, len(codes))
+    else:
+        word_starts = word_ends = np.zeros(0, dtype=np.int64)
+    if (word_ends == word_starts).any():
+        raise ZeroDivisionError("empty word in the aligned phoneme reference")
+
+    counts = np.zeros((len(word_starts), len(PHONEME_STATUSES)), dtype=np.int64)
+    if ref_phoneme:
+        is_status = np.frombuffer(status_sequence.encode('ascii'), dtype=np.uint8)[:, None] == STATUS_CODES
+        # the spaces between words belong to no word
+        is_status[spaces] = False
+        np.add.reduceat(is_status, word_starts, axis=0, dtype=np.int64, out=counts)
+    return PhonemeAlignment(ref_phoneme=ref_phoneme,
+                            hypo_phoneme=hypo_phoneme,
+                            word_starts=word_starts,
+                            word_ends=word_ends,
+                            counts=counts,
+                            correct_rate=counts[:, 0] / (word_ends - word_starts)
+                            )
+
+
+def _phoneme_alignment_result(ref_phoneme, hypo_phoneme, status_sequence, as_arrays):
+
+    """
+    Per-word output of phoneme_level_alignment from the aligned strings, in
+    one pass over the words. A word ends at every space, except a space in
+    the last position, which belongs to the last word.
+    """
+
+    if as_arrays:
+        return _phoneme_alignment_arrays(ref_phoneme, hypo_phoneme, status_sequence)
+    if not ref_phoneme:
+        return []
+
+    words = []
+    start = 0
+    lengths = [len(part) for part in ref_phoneme[:-1].split(" ")]
+    lengths[-1] += 1
+    for length in lengths:
+        end = start + length
+        words.append({'ref_phoneme': ref_phoneme[start:end],
+                      'hypo_phoneme': hypo_phoneme[start:end],
+                      'phoneme_correct_rate': status_sequence.count("C", start, end) / length})
+        start = end + 1
+    return words
+
+
+def phoneme_level_alignment(reference_sentence, hypothesis_sentence, as_arrays=False):
 
     """
     Align ASR transcriptions with the reference text. Refer to Jiwer 
@@ -112,18 +440,25 @@ def phoneme_level_alignment(reference_sentence, hypothesis_sentence):
     the transcription is marked as Correct, Substituted, or Deleted.
     Return correctness rate on the phoneme level for each word.
 
+    The aligned strings are built once from opcode blocks and per-word
+    statistics are counted over word offsets, so the cost is linear in the
+    phrase length.
+
     Args:
-      reference_sentence
-      hypothesis_sentence
+      reference_sentence: phoneme text, or characters from preprocess_text
+      hypothesis_sentence: phoneme text, or characters from preprocess_text
+      as_arrays: return a PhonemeAlignment instead of a list of dicts
 
     Return:
-      list[dict]: phoneme-level features for each word in the reference sentence
+      list[dict]: phoneme-level features for each word in the reference sentence,
+      or PhonemeAlignment with the aligned strings, word offsets, per-word
+      C/S/D/I counts and correct rates
     """
 
 
     # Tokenize sentences into words
-    ref_words = preprocess_text(reference_sentence, "phoneme")
-    hyp_words = preprocess_text(hypothesis_sentence, "phoneme")
+    ref_words = as_tokens(reference_sentence, "phoneme")
+    hyp_words = as_tokens(hypothesis_sentence, "phoneme")
 
     # Compute edit operations needed to transform hypothesis into reference at the word level
     edit_ops = fuzz_dist.Levenshtein.editops(ref_words, hyp_words)
@@ -131,54 +466,358 @@ def phoneme_level_alignment(reference_sentence, hypothesis_sentence):
     # Generate opcodes from the edit operations
     opcodes = fuzz_dist.Opcodes.from_editops(edit_ops)
 
-    # Process each opcode 
-    ref_phoneme = ""
-    hypo_phoneme = ""
-    status_sequence = ""
-    index = 0
-    for op in opcodes:
-        if op.tag == 'equal':
-            for i in range(op.src_start, op.src_end):
-                ref_phoneme = ref_phoneme + ref_words[i]
-                hypo_phoneme = hypo_phoneme + hyp_words[index]
-                status_sequence = status_sequence + "C"
-                index += 1
-        elif op.tag == 'replace':
-            for i, j in zip(range(op.src_start, op.src_end), range(op.dest_start, op.dest_end)):
-                ref_phoneme = ref_phoneme + ref_words[i]
-                hypo_phoneme = hypo_phoneme + hyp_words[index]
-                status_sequence = status_sequence + "S"
-                index += 1
-        elif op.tag == 'delete':
-            for i in range(op.src_start, op.src_end):
-                ref_phoneme = ref_phoneme + ref_words[i]
-                hypo_phoneme = hypo_phoneme + "*"
-                status_sequence = status_sequence + "D"
-        elif op.tag == 'insert':
+    ref_phoneme, hypo_phoneme, status_sequence = _aligned_phoneme_strings(ref_words, hyp_words, opcodes.as_list())
+    return _phoneme_alignment_result(ref_phoneme, hypo_phoneme, status_sequence, as_arrays)
 
-            if not ref_phoneme:
-                continue
 
-            for j in range(op.dest_start, op.dest_end):
+# Phonetic features of the ARPABET symbols in arpabet_to_amirabet.json, used
+# to price substitutions between AMIRABET phonemes by phonetic similarity.
+# Vowels: (height, backness, rounded, diphthong); consonants: (place, manner, voiced)
+ARPABET_VOWELS = {'AA': ('low', 'back', 0, 0), 'AE': ('low', 'front', 0, 0), 'AH': ('mid', 'central', 0, 0),
+                  'AO': ('mid', 'back', 1, 0), 'AW': ('low', 'back', 1, 1), 'AY': ('low', 'front', 0, 1),
+                  'EH': ('mid', 'front', 0, 0), 'ER': ('mid', 'central', 0, 0), 'EY': ('mid', 'front', 0, 1),
+                  'IH': ('high', 'front', 0, 0), 'IY': ('high', 'front', 0, 0), 'OW': ('mid', 'back', 1, 1),
+                  'OY': ('mid', 'back', 1, 1), 'UH': ('high', 'back', 1, 0), 'UW': ('high', 'back', 1, 0)}
+ARPABET_CONSONANTS = {'B': ('bilabial', 'stop', 1), 'CH': ('postalveolar', 'affricate', 0), 'D': ('alveolar', 'stop', 1),
+                      'DH': ('dental', 'fricative', 1), 'F': ('labiodental', 'fricative', 0), 'G': ('velar', 'stop', 1),
+                      'HH': ('glottal', 'fricative', 0), 'JH': ('postalveolar', 'affricate', 1), 'K': ('velar', 'stop', 0),
+                      'L': ('alveolar', 'lateral', 1), 'M': ('bilabial', 'nasal', 1), 'N': ('alveolar', 'nasal', 1),
+                      'NG': ('velar', 'nasal', 1), 'P': ('bilabial', 'stop', 0), 'R': ('alveolar', 'approximant', 1),
+                      'S': ('alveolar', 'fricative', 0), 'SH': ('postalveolar', 'fricative', 0), 'T': ('alveolar', 'stop', 0),
+                      'TH': ('dental', 'fricative', 0), 'V': ('labiodental', 'fricative', 1), 'W': ('bilabial', 'approximant', 1),
+                      'Y': ('palatal', 'approximant', 1), 'Z': ('alveolar', 'fricative', 1), 'ZH': ('postalveolar', 'fricative', 1)}
 
-                ref_phoneme = ref_phoneme + "*"
-                hypo_phoneme = hypo_phoneme + hyp_words[index]
-                status_sequence = status_sequence + "I"
-                
-                index += 1
-    
-    phoneme_alignment_result = []
-    word_length, correctness = 0, 0
-    prev_i = 0
-    for i, (ref, hypo, status) in enumerate(zip(ref_phoneme, hypo_phoneme, status_sequence)):
-        if ref == " " or i == len(ref_phoneme) - 1:
-            if i == len(ref_phoneme) - 1:
-               i += 1
-            phoneme_alignment_result.append({'ref_phoneme': ref_phoneme[prev_i:i], 
-                                            'hypo_phoneme': hypo_phoneme[prev_i:i], 
-                                            'phoneme_correct_rate': status_sequence[prev_i:i].count("C")/(i-prev_i)}
-                                            )
-            prev_i = i+1
-            word_length, correctness = 0, 0
-
-    return phoneme_alignment_result
\ No newline at end of file
+# Costs are integers in units of 1 / COST_SCALE, so the DP and its backtrace compare exactly
+COST_SCALE = 100
+
+# Substitution matrix over an AMIRABET alphabet, with insertion and deletion
+# costs. symbols[i] is row/column i; the extra last row/column prices any
+# other character (ex. the space between words) and costs are in COST_SCALE units.
+PhonemeCosts = namedtuple('PhonemeCosts', ['symbols', 'substitution', 'insertion', 'deletion'])
+
+WeightedPhonemeAlignment = namedtuple('WeightedPhonemeAlignment', ['words', 'distance'])
+
+
+def _feature_cost(features_a, features_b, base, per_feature):
+    differing = sum(a != b for a, b in zip(features_a, features_b))
+    return min(1.0, base + per_feature * differing)
+
+
+def phoneme_costs(arpabet_to_amirabet, insertion=1.0, deletion=1.0):
+
+    """
+    Default PhonemeCosts over the AMIRABET inventory of the mapping.
+    Substituting close phonemes is cheap (ex. IH/IY, S/Z), vowels for
+    consonants and anything involving a word boundary costs 1, as much as
+    an insertion or a deletion.
+
+    Args:
+      arpabet_to_amirabet: dict ARPABET symbol -> AMIRABET character, ex. arpabet_to_amirabet.json
+      insertion, deletion: cost of inserting or deleting one phoneme
+
+    Return:
+      PhonemeCosts
+    """
+
+    arpabet = sorted(arpabet_to_amirabet)
+    symbols = ''.join(arpabet_to_amirabet[symbol] for symbol in arpabet)
+    costs = np.ones((len(symbols) + 1, len(symbols) + 1))
+    for i, a in enumerate(arpabet):
+        for j, b in enumerate(arpabet):
+            if a == b:
+                costs[i, j] = 0.0
+            elif a in ARPABET_VOWELS and b in ARPABET_VOWELS:
+                costs[i, j] = _feature_cost(ARPABET_VOWELS[a], ARPABET_VOWELS[b], 0.2, 0.2)
+            elif a in ARPABET_CONSONANTS and b in ARPABET_CONSONANTS:
+                costs[i, j] = _feature_cost(ARPABET_CONSONANTS[a], ARPABET_CONSONANTS[b], 0.2, 0.25)
+    return PhonemeCosts(symbols=symbols,
+                        substitution=np.rint(costs * COST_SCALE).astype(np.int32),
+                        insertion=int(round(insertion * COST_SCALE)),
+                        deletion=int(round(deletion * COST_SCALE))
+                        )
+
+
+# Backtrace moves of the weighted DP, and the opcode tags of its steps
+MOVE_DIAGONAL, MOVE_DELETE, MOVE_INSERT = 0, 1, 2
+STEP_TAGS = ('equal', 'replace', 'delete', 'insert')
+
+
+def _weighted_chunk(ref_ids, ref_lengths, hyp_ids, hyp_lengths, costs):
+
+    """
+    Weighted edit distance DP over a chunk of integer-encoded pairs, sorted
+    by reference length. Rows (reference positions) are computed one at a
+    time for every pair and hypothesis position at once; insertions within
+    a row are resolved with a running minimum, which is exact for a
+    constant insertion cost. Pairs drop out of the row loop once their
+    reference ends, and only one int8 move per cell is kept for the
+    backtrace.
+
+    Ties are broken as in rapidfuzz's editops (deletion first, then
+    insertion when it leaves a smaller distance than the diagonal), so
+    with unit costs the alignment is the same as phoneme_level_alignment.
+
+    Return:
+      (distances, moves): distance of every pair and the
+      (n_pairs, n_ref + 1, n_hyp + 1) moves array
+    """
+
+    n_pairs, n_ref = ref_ids.shape
+    n_hyp = hyp_ids.shape[1]
+    n_symbols = len(costs.symbols)
+    insertion, deletion = costs.insertion, costs.deletion
+    insert_ramp = insertion * np.arange(n_hyp + 1, dtype=np.int32)
+    hyp_symbols = np.minimum(hyp_ids, n_symbols)
+
+    moves = np.empty((n_pairs, n_ref + 1, n_hyp + 1), dtype=np.int8)
+    moves[:, 0, :] = MOVE_INSERT
+    moves[:, 1:, 0] = MOVE_DELETE
+    dist = np.broadcast_to(insert_ramp, (n_pairs, n_hyp + 1)).copy()
+    rows = np.arange(n_pairs)
+    distances = np.empty(n_pairs, dtype=np.int64)
+
+    first = 0
+    for c in range(1, n_ref + 1):
+        # pairs whose reference ended at c - 1 are final, the rest is a suffix of the chunk
+        active = int(np.searchsorted(ref_lengths, c))
+        distances[first:active] = dist[rows[first:active], hyp_lengths[first:active]]
+        first = active
+
+        previous = dist[first:]
+        ref_column = ref_ids[first:, c - 1, None]
+        substitution = np.where(ref_column == hyp_ids[first:], 0,
+                                costs.substitution[np.minimum(ref_column, n_symbols), hyp_symbols[first:]])
+        diagonal = previous[:, :-1] + substitution
+        up = previous + deletion
+
+        current = np.empty_like(previous)
+        current[:, 0] = up[:, 0]
+        np.minimum(diagonal, up[:, 1:], out=current[:, 1:])
+        current -= insert_ramp
+        np.minimum.accumulate(current, axis=1, out=current)
+        current += insert_ramp
+
+        inserted = current[:, 1:] == current[:, :-1] + insertion
+        inserted &= (current[:, 1:] != diagonal) | (current[:, :-1] < previous[:, :-1])
+        moves[first:, c, 1:] = np.where(current[:, 1:] == up[:, 1:], MOVE_DELETE,
+                                        np.where(inserted, MOVE_INSERT, MOVE_DIAGONAL))
+        dist[first:] = current
+
+    distances[first:] = dist[rows[first:], hyp_lengths[first:]]
+    return distances, moves
+
+
+def _weighted_backtrace(moves, ref_ids, ref_lengths, hyp_ids, hyp_lengths):
+
+    """
+    Follow the moves back from every pair's end cell at once.
+
+    Return:
+      (n_pairs, ref_len + hyp_len) int8 indices into STEP_TAGS, last step
+      first, -1 past the start of each alignment
+    """
+
+    n_pairs = len(ref_lengths)
+    steps = np.full((n_pairs, max(int((ref_lengths + hyp_lengths).max(initial=0)), 1)), -1, dtype=np.int8)
+    c, r = ref_lengths.copy(), hyp_lengths.copy()
+    rows = np.arange(n_pairs)
+    for step in range(steps.shape[1]):
+        active = (c > 0) | (r > 0)
+        if not active.any():
+            break
+        k = rows[active]
+        move = moves[k, c[k], r[k]]
+        diagonal = move == MOVE_DIAGONAL
+        c[k] -= move != MOVE_INSERT
+        r[k] -= move != MOVE_DELETE
+        steps[k, step] = move + 1
+        kd = k[diagonal]
+        steps[kd, step] = ref_ids[kd, c[kd]] != hyp_ids[kd, r[kd]]
+    return steps
+
+
+def _step_opcodes(steps, c, r):
+
+    """ Opcode blocks of one pair's steps (first step first), starting at reference c and hypothesis r. """
+
+    if not len(steps):
+        return []
+    starts = np.flatnonzero(np.diff(steps)) + 1
+    opcodes = []
+    for start, end, step in zip([0] + starts.tolist(), starts.tolist() + [len(steps)], steps[np.r_[0, starts]].tolist()):
+        tag = STEP_TAGS[step]
+        n_ref = 0 if tag == 'insert' else end - start
+        n_hyp = 0 if tag == 'delete' else end - start
+        opcodes.append((tag, c, c + n_ref, r, r + n_hyp))
+        c += n_ref
+        r += n_hyp
+    return opcodes
+
+
+def align_phonemes_weighted_batch(references, hypotheses, costs, max_cells=1 << 22):
+
+    """
+    Phoneme alignment with phonetically weighted costs, for many
+    reference/hypothesis pairs at once. Characters are integer-encoded
+    against costs.symbols, common prefixes and suffixes are removed as in
+    rapidfuzz and the rest is aligned by a vectorized NumPy DP; pairs are
+    sorted by length and aligned in chunks of at most max_cells DP cells.
+
+    Args:
+      references: list of phoneme texts or characters from preprocess_text
+      hypotheses: list of phoneme texts or characters from preprocess_text
+      costs: PhonemeCosts, ex. from phoneme_costs
+      max_cells: bound on n_pairs * (ref_len + 1) * (hyp_len + 1) per chunk
+
+    Return:
+      list[WeightedPhonemeAlignment]: per pair, the per-word dicts of
+      phoneme_level_alignment and the weighted distance of the phrase;
+      words is None for a pair whose reference has an empty word (ex. two
+      spaces in a row), where phoneme_level_alignment raises ZeroDivisionError
+    """
+
+    if len(references) != len(hypotheses):
+        raise ValueError("references and hypotheses must have the same length")
+
+    ref_tokens = [as_tokens(reference, "phoneme") for reference in references]
+    hyp_tokens = [as_tokens(hypothesis, "phoneme") for hypothesis in hypotheses]
+
+    # inventory symbols first, so their ids index the substitution matrix
+    vocab = {symbol: i for i, symbol in enumerate(costs.symbols)}
+    ref_ids, ref_lengths = _encode_batch(ref_tokens, vocab, -1)
+    hyp_ids, hyp_lengths = _encode_batch(hyp_tokens, vocab, -2)
+    prefix, suffix, core_ref, core_ref_lengths, core_hyp, core_hyp_lengths = _strip_affixes(ref_ids, ref_lengths,
+                                                                                             hyp_ids, hyp_lengths)
+
+    results = [None] * len(references)
+    order = np.lexsort((core_hyp_lengths, core_ref_lengths))
+    start = 0
+    while start < len(order):
+        # grow the chunk while its padded DP fits in max_cells, pairs are sorted by reference length
+        end = start + 1
+        hyp_width = core_hyp_lengths[order[start]]
+        while end < len(order):
+            hyp_width = max(hyp_width, core_hyp_lengths[order[end]])
+            if (end + 1 - start) * (core_ref_lengths[order[end]] + 1) * (hyp_width + 1) > max_cells:
+                break
+            end += 1
+        chunk = order[start:end]
+        ref_width = max(core_ref_lengths[chunk].max(), 1)
+        hyp_width = max(core_hyp_lengths[chunk].max(), 1)
+        chunk_ref, chunk_hyp = core_ref[chunk, :ref_width], core_hyp[chunk, :hyp_width]
+        distances, moves = _weighted_chunk(chunk_ref, core_ref_lengths[chunk], chunk_hyp, core_hyp_lengths[chunk], costs)
+        steps = _weighted_backtrace(moves, chunk_ref, core_ref_lengths[chunk], chunk_hyp, core_hyp_lengths[chunk])
+
+        for k, pair in enumerate(chunk):
+            p, n_ref, n_hyp = int(prefix[pair]), int(ref_lengths[pair]), int(hyp_lengths[pair])
+            core_steps = steps[k, :core_ref_lengths[pair] + core_hyp_lengths[pair]]
+            opcodes = ([('equal', 0, p, 0, p)] if p else []) + _step_opcodes(core_steps[core_steps >= 0][::-1], p, p)
+            if suffix[pair]:
+                opcodes.append(('equal', n_ref - int(suffix[pair]), n_ref, n_hyp - int(suffix[pair]), n_hyp))
+            strings = _aligned_phoneme_strings(ref_tokens[pair], hyp_tokens[pair], opcodes)
+            try:
+                words = _phoneme_alignment_result(*strings, as_arrays=False)
+            except ZeroDivisionError:
+                # an empty reference word has no correct rate, only this pair goes without words
+                words = None
+            results[pair] = WeightedPhonemeAlignment(words=words, distance=float(distances[k]) / COST_SCALE)
+        start = end
+    return results
+
+
+def weighted_phoneme_alignment(reference_sentence, hypothesis_sentence, costs):
+
+    """ align_phonemes_weighted_batch for a single pair. """
+
+    return align_phonemes_weighted_batch([reference_sentence], [hypothesis_sentence], costs)[0]
+
+
+# Bump when the output of word_level_alignment or phoneme_level_alignment
+# changes, so persisted alignment caches start over
+ALIGNMENT_VERSION = 1
+
+
+class FrozenDict(dict):
+
+    """ Read-only dict, so a cached alignment can be handed to every caller. """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("cached alignment results are read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze_alignment(alignment):
+
+    """ List of per-word dicts to a tuple of FrozenDict. """
+
+    return tuple(FrozenDict(entry) for entry in alignment)
+
+
+def alignment_key(level, ref_tokens, hyp_tokens):
+
+    """ Cache key of a pair of token sequences from preprocess_text. """
+
+    digest = hashlib.sha1(level.encode('utf-8'))
+    digest.update(b'\x1d')
+    digest.update('\x1f'.join(ref_tokens).encode('utf-8'))
+    digest.update(b'\x1e')
+    digest.update('\x1f'.join(hyp_tokens).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class AlignmentCache:
+
+    """
+    Memoized word_level_alignment and phoneme_level_alignment. Correct
+    readings of a phrase give the same transcript across students and
+    engines, so the same pairs are aligned over and over. Results are keyed
+    by a hash of the level and the normalized (reference, hypothesis) tokens
+    and returned as tuples of FrozenDict, shared by every caller. Pass a
+    path to keep them in a SQLite file between runs, shared by the worker
+    processes; writes are committed in batches.
+
+    Args:
+      maxsize: number of alignments kept in the in-memory LRU
+      path: optional SQLite file for the on-disk cache
+    """
+
+    def __init__(self, maxsize=20000, path=None):
+        self.cache = LRUCache(maxsize=maxsize, path=path, table=f'alignments_v{ALIGNMENT_VERSION}',
+                              decode=freeze_alignment, commit_every=1000)
+
+    def word_level_alignment(self, reference_sentence, hypothesis_sentence):
+
+        """ Same as word_level_alignment, as a tuple of read-only dicts. """
+
+        ref_words = as_tokens(reference_sentence, "word")
+        hyp_words = as_tokens(hypothesis_sentence, "word")
+        return self.cache.get_or_compute(alignment_key("word", ref_words, hyp_words),
+                                         lambda: freeze_alignment(word_level_alignment(ref_words, hyp_words)))
+
+    def phoneme_level_alignment(self, reference_sentence, hypothesis_sentence):
+
+        """ Same as phoneme_level_alignment, as a tuple of read-only dicts. """
+
+        ref_words = as_tokens(reference_sentence, "phoneme")
+        hyp_words = as_tokens(hypothesis_sentence, "phoneme")
+        return self.cache.get_or_compute(alignment_key("phoneme", ref_words, hyp_words),
+                                         lambda: freeze_alignment(phoneme_level_alignment(ref_words, hyp_words)))
+
+    def stats(self):
+        return self.cache.stats()
+
+    def reset_stats(self):
+        self.cache.reset_stats()
+
+    def flush(self):
+        self.cache.flush()
+
+    def close(self):
+        self.cache.close()
@@ -0,0 +1,244 @@
+import argparse
+
+import ast
+import json
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from alignment import preprocess_text
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+# Compact view of one ASR payload, indexed by HypoIndex:
+#   tokens: hypothesis words as produced by preprocess_text
+#   confidences: float64 array, one value per hypothesis token
+#   lapses: float64 array, one value per hypothesis token. Not the same quantity
+#     for every engine: Amazon's lapse values as given in the payload, the word
+#     duration (end_time - start_time) for Kaldi; a duration only where starts is set
+#   starts: float64 array of token start times, None when the engine has no timing
+ParsedASR = namedtuple('ParsedASR', ['tokens', 'confidences', 'lapses', 'starts'], defaults=(None,))
+
+
+class PayloadError(ValueError):
+
+    """
+    An ASR payload that could not be parsed; engine names the column it came
+    from and error_type the exception that made it fail, also when the
+    payload was parsed ahead of time by convert_asr_data.
+    """
+
+    def __init__(self, engine, message, error_type=None):
+        super().__init__(f"{engine} payload failed to parse: {message}")
+        self.engine = engine
+        self.error_type = error_type
+
+
+def decode_payload(payload):
+
+    """
+    Decode an ASR cell without executing it. JSON is tried first, Python
+    literal syntax (the format of asr_data.csv) second.
+
+    Args:
+      payload: raw text of an amazon_data/kaldi_data/kaldiNa_data cell
+
+    Return:
+      dict: decoded payload
+    """
+
+    try:
+        decoded = _json_loads(payload)
+    except ValueError:
+        decoded = ast.literal_eval(payload)
+    if not isinstance(decoded, dict):
+        raise ValueError(f"ASR payload must decode to a dict, got {type(decoded).__name__}")
+    return decoded
+
+
+def parse_amazon(payload):
+
+    """
+    Amazon schema: {'text': str, 'confidence': [[..., value]], 'lapse': [[..., value]]},
+    the last element of every confidence/lapse entry is the value.
+    """
+
+    return ParsedASR(tokens=preprocess_text(payload['text'], "word"),
+                     confidences=np.array([entry[-1] for entry in payload['confidence']], dtype=np.float64),
+                     lapses=np.array([entry[-1] for entry in payload['lapse']], dtype=np.float64)
+                     )
+
+
+def parse_kaldi(payload):
+
+    """
+    Kaldi / KaldiNA schema: {'text': str, 'transcription': [{'confidence', 'start_time', 'end_time', ...}]}.
+    """
+
+    transcription = payload['transcription']
+    return ParsedASR(tokens=preprocess_text(payload['text'], "word"),
+                     confidences=np.array([entry['confidence'] for entry in transcription], dtype=np.float64),
+                     lapses=np.array([entry['end_time'] - entry['start_time'] for entry in transcription], dtype=np.float64),
+                     starts=np.array([entry['start_time'] for entry in transcription], dtype=np.float64)
+                     )
+
+
+# ASR engines: name, asr_data column, feature prefix and payload parser
+ASR_ENGINES = [
+    ('Amazon', 'amazon_data', 'amazon', parse_amazon),
+    ('Kaldi', 'kaldi_data', 'kaldi', parse_kaldi),
+    ('KaldiNA', 'kaldiNa_data', 'kaldina', parse_kaldi),
+]
+
+PARSED_FIELDS = ParsedASR._fields
+
+
+def parse_row(row):
+
+    """
+    Parsed payloads of all engines for one asr_data row. Works on raw rows
+    from asr_data.csv and on rows of a file written by convert_asr_data.
+    A payload that cannot be parsed raises PayloadError with its engine.
+
+    Args:
+      row: a row of asr_data
+
+    Return:
+      dict: engine name -> ParsedASR
+    """
+
+    parsed = {}
+    for name, column, prefix, parser in ASR_ENGINES:
+        if prefix + '_tokens' in row:
+            error = row[prefix + '_error']
+            if error is not None:
+                # files converted before _error_type was kept start the error with it
+                error_type = row.get(prefix + '_error_type') or error.split(':', 1)[0]
+                raise PayloadError(name, error, error_type)
+            # files converted before the rename keep the lapses in {prefix}_durations
+            lapses = row[prefix + '_lapses'] if prefix + '_lapses' in row else row[prefix + '_durations']
+            parsed[name] = ParsedASR(tokens=list(row[prefix + '_tokens']),
+                                     confidences=np.asarray(row[prefix + '_confidences'], dtype=np.float64),
+                                     lapses=np.asarray(lapses, dtype=np.float64),
+                                     # files converted before start times were kept have no _starts column
+                                     starts=(np.asarray(row[prefix + '_starts'], dtype=np.float64)
+                                             if row.get(prefix + '_starts') is not None else None)
+                                     )
+        else:
+            try:
+                parsed[name] = parser(decode_payload(row[column]))
+            except Exception as exc:
+                raise PayloadError(name, f"{type(exc).__name__}: {exc}", type(exc).__name__) from exc
+    return parsed
+
+
+def convert_asr_data(df):
+
+    """
+    Replace the raw payload columns by pre-parsed list columns
+    ({prefix}_tokens, _confidences, _lapses, _starts) plus {prefix}_error and
+    {prefix}_error_type, which hold the parse error of rows that could not be
+    decoded and its exception type.
+
+    Args:
+      df: asr_data dataframe as read from asr_data.csv
+
+    Return:
+      pd.DataFrame: pre-parsed asr_data
+    """
+
+    df = df.copy()
+    for name, column, prefix, parser in ASR_ENGINES:
+        columns = {field: [] for field in PARSED_FIELDS}
+        errors, error_types = [], []
+        for payload in tqdm(df[column], desc=name):
+            try:
+                parsed = parser(decode_payload(payload))
+                error = error_type = None
+            except Exception as exc:
+                parsed = ParsedASR(tokens=None, confidences=None, lapses=None)
+                error, error_type = f"{type(exc).__name__}: {exc}", type(exc).__name__
+            for field in PARSED_FIELDS:
+                columns[field].append(parsed._asdict()[field])
+            errors.append(error)
+            error_types.append(error_type)
+
+        df = df.drop(columns=column)
+        for field in PARSED_FIELDS:
+            df[f'{prefix}_{field}'] = columns[field]
+        df[prefix + '_error'] = errors
+        df[prefix + '_error_type'] = error_types
+    return df
+
+
+def _normalize_errors(df):
+
+    """ Parquet nulls come back as NaN/None depending on the column type, use None. """
+
+    for name, column, prefix, parser in ASR_ENGINES:
+        for error_column in (prefix + '_error', prefix + '_error_type'):
+            if error_column in df:
+                df[error_column] = df[error_column].astype(object).where(df[error_column].notna(), None)
+    return df
+
+
+def load_asr_data(path):
+
+    """
+    Read asr_data from the original CSV or from a pre-parsed Parquet file.
+    """
+
+    if path.endswith('.parquet'):
+        return _normalize_errors(pd.read_parquet(path))
+    return pd.read_csv(path)
+
+
+def iter_asr_data(path, chunksize, columns=None):
+
+    """
+    Read asr_data in chunks of at most chunksize rows, from the original CSV
+    or from a pre-parsed Parquet file.
+
+    Args:
+      path: asr_data path
+      chunksize: rows per chunk
+      columns: optional subset of columns to read
+
+    Return:
+      iterator of pd.DataFrame
+    """
+
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield _normalize_errors(batch.to_pandas())
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns)
+
+
+def main(args):
+
+    asr_data_df = pd.read_csv(args.asr_data_path)
+    parsed_df = convert_asr_data(asr_data_df)
+    parsed_df.to_parquet(args.save_path, index=False)
+
+    for name, column, prefix, parser in ASR_ENGINES:
+        print(f"{name}: {parsed_df[prefix + '_error'].notna().sum()} payloads failed to parse")
+    print("Pre-parsed ASR data saved.")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Convert asr_data.csv into a pre-parsed Parquet file.')
+    parser.add_argument('--asr_data_path', type=str, default="asr_data.csv", help='path to asr dataset')
+    parser.add_argument('--save_path', type=str, default="asr_data.parquet", help='path to save the pre-parsed dataset')
+    args = parser.parse_args()
+
+    main(args)
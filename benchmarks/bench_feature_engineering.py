@@ -0,0 +1,116 @@
+"""
+Benchmark of model.feature_engineering against the original
+merge/apply implementation on synthetic word-level tables.
+
+Run from the repository root:
+    python -m benchmarks.bench_feature_engineering --rows 1000000 10000000
+"""
+import argparse
+
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from model import feature_engineering, iter_features
+
+POS_TAGS = ['NOUN_Sing', 'NOUN_Plur', 'VERB_Fin', 'VERB_Inf', 'DET', 'ADJ', 'ADP', 'PRON', 'PROPN', 'X', 'ADV', 'CCONJ']
+
+
+def legacy_feature_engineering(df):
+
+    """ feature_engineering before vectorization, kept for comparison. """
+
+    max_indices = df.groupby(['activityId', 'phraseIndex'])['word_index'].max().reset_index()
+    max_indices.rename(columns={'word_index': 'phrase_length'}, inplace=True)
+    df = pd.merge(df, max_indices, how='left', on=['activityId', 'phraseIndex'])
+    df['phrase_length'] = df['phrase_length'] + 1
+    df['word_index'] = (df['word_index']/ df['phrase_length'])
+    df['overall_correct_score'] = (df['amazon_correct'] + df['kaldi_correct'] + df['kaldina_correct']) / 3
+    df['overall_correct_score_confidence'] = (df['amazon_correct'] * df['amazon_confidence'] \
+                                            + df['kaldi_correct'] * df['kaldi_confidence'] \
+                                            + df['kaldina_correct'] * df['kaldina_confidence']) / 3
+    df['overall_substituted_score'] = (df['amazon_substituted'] + df['kaldi_substituted'] + df['kaldina_substituted']) / 3
+    df['overall_deleted_score'] = (df['amazon_deleted'] + df['kaldi_deleted'] + df['kaldina_deleted']) / 3
+    df['overall_lapse'] = (df['amazon_lapse'] + df['kaldi_lapse'] + df['kaldina_lapse']) / 3
+    df['pos_tags'] = df['pos_tags'].apply(lambda x: 1 if x in ['PROPN', 'X', 'NOUN_Plur', 'VERB_Fin'] else 0)
+    return df
+
+
+def make_processed_frame(n_rows, rng, words_per_phrase=8, phrases_per_activity=40):
+
+    """ Random table with the numeric columns of processed_data.csv, missing values already filled. """
+
+    position = np.arange(n_rows)
+    phrase = position // words_per_phrase
+    columns = {'activityId': pd.Series(phrase // phrases_per_activity).map('act{:07d}'.format),
+               'phraseIndex': phrase % phrases_per_activity,
+               'word_index': position % words_per_phrase,
+               'label': (rng.random(n_rows) < 0.9).astype(np.int64)}
+    for prefix in ('amazon', 'kaldi', 'kaldina'):
+        status = rng.choice(3, size=n_rows, p=[0.8, 0.12, 0.08])
+        columns[prefix + '_lapse'] = np.where(status < 2, rng.random(n_rows), 0.0)
+        columns[prefix + '_confidence'] = np.where(status < 2, rng.random(n_rows), 0.0)
+        columns[prefix + '_correct'] = (status == 0).astype(np.float64)
+        columns[prefix + '_substituted'] = (status == 1).astype(np.float64)
+        columns[prefix + '_deleted'] = (status == 2).astype(np.float64)
+    columns['phoneme_correct_rate'] = rng.random(n_rows)
+    columns['word_length'] = rng.integers(1, 12, n_rows)
+    columns['syllables_counts'] = rng.integers(1, 4, n_rows)
+    columns['pos_tags'] = np.asarray(POS_TAGS, dtype=object)[rng.integers(0, len(POS_TAGS), n_rows)]
+    columns['ortho_complexity'] = rng.integers(0, 3, n_rows)
+    return pd.DataFrame(columns)
+
+
+def check_equal(df):
+    legacy = legacy_feature_engineering(df)
+    new = feature_engineering(df)
+    assert list(legacy.columns) == list(new.columns)
+    for column in legacy.columns:
+        if legacy[column].dtype.kind == 'f' or new[column].dtype.kind == 'f':
+            np.testing.assert_allclose(new[column].to_numpy(np.float64), legacy[column].to_numpy(np.float64), rtol=1e-6)
+        else:
+            assert (new[column].to_numpy() == legacy[column].to_numpy()).all(), column
+
+
+def measure(function, df):
+    start = time.perf_counter()
+    function(df)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def main(args):
+
+    rng = np.random.default_rng(args.seed)
+    check_equal(make_processed_frame(100000, rng))
+
+    print(f"{'rows':>10}{'legacy s':>10}{'legacy MB':>11}{'new s':>8}{'new MB':>8}{'chunked s':>11}{'speedup':>9}")
+    for n_rows in args.rows:
+        df = make_processed_frame(n_rows, rng)
+        new, new_peak = measure(feature_engineering, df)
+        chunked, chunked_peak = measure(lambda frame: sum(len(chunk) for chunk in iter_features(
+            frame.iloc[start:start + args.chunksize] for start in range(0, len(frame), args.chunksize))), df)
+        if n_rows <= args.legacy_max_rows:
+            legacy, legacy_peak = measure(legacy_feature_engineering, df)
+            print(f"{n_rows:>10}{legacy:>10.2f}{legacy_peak:>11.0f}{new:>8.2f}{new_peak:>8.0f}{chunked:>11.2f}{legacy / new:>8.1f}x")
+        else:
+            print(f"{n_rows:>10}{'-':>10}{'-':>11}{new:>8.2f}{new_peak:>8.0f}{chunked:>11.2f}{'-':>9}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark feature_engineering.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000], help='table sizes')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='rows per chunk of the chunked run')
+    parser.add_argument('--legacy_max_rows', type=int, default=10000000, help='largest table the legacy version runs on')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,89 @@
+"""
+Import-time benchmark for the prep CLI and its worker processes. Each
+target runs in a fresh interpreter with -X importtime; the run fails when
+a target fails or exceeds its budget.
+
+Run from the repository root:
+    python -m benchmarks.bench_import --budget_ms 1500
+"""
+import argparse
+
+import subprocess
+import sys
+import time
+
+
+TARGETS = {
+    'import alignment': "import alignment",
+    'import lexical': "import lexical",
+    'import asr_parser': "import asr_parser",
+    'import data_prep': "import data_prep",
+    # what a worker does before its first shard, dictionaries included
+    'worker startup': ("import data_prep; data_prep._init_worker(None, {}, data_prep.dictionary_paths, "
+                       "data_prep.alignment_cache_args, data_prep.lattice_features)"),
+}
+
+
+def run_target(code):
+
+    """
+    Run code in a fresh interpreter.
+
+    Return:
+      (wall seconds, {module: cumulative import seconds})
+    """
+
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                               capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    imports = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports[name.strip()] = int(cumulative_us) / 1e6
+    return elapsed, imports
+
+
+def main(args):
+
+    baseline = min(run_target("pass")[0] for _ in range(args.repeat))
+    print(f"interpreter startup: {1000 * baseline:.0f} ms (subtracted below)")
+
+    over_budget = []
+    for name, code in TARGETS.items():
+        try:
+            runs = [run_target(code) for _ in range(args.repeat)]
+        except RuntimeError as exc:
+            # a target that no longer runs fails the check like one over budget
+            print(f"{name:<20} FAILED: {exc}")
+            over_budget.append(name)
+            continue
+        elapsed, imports = min(runs, key=lambda run: run[0])
+        elapsed_ms = 1000 * (elapsed - baseline)
+        status = "ok" if elapsed_ms <= args.budget_ms else "OVER BUDGET"
+        print(f"{name:<20}{elapsed_ms:8.0f} ms  {status}")
+        heaviest = sorted(imports.items(), key=lambda item: -item[1])[:args.top]
+        for module, seconds in heaviest:
+            print(f"    {module:<40}{1000 * seconds:8.0f} ms")
+        if elapsed_ms > args.budget_ms:
+            over_budget.append(name)
+
+    if over_budget:
+        print(f"failed or over the {args.budget_ms} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Measure import and worker startup time.')
+    parser.add_argument('--budget_ms', type=float, default=1500, help='budget per target, interpreter startup excluded')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per target, the fastest is reported')
+    parser.add_argument('--top', type=int, default=5, help='number of heaviest imports listed per target')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,151 @@
+"""
+Benchmark of the phrase lattice (lattice.py) on synthetic data: building
+it from the alignments of process_row, its vectorized cross-engine
+features against the same features computed word by word from the
+alignment dicts, and its binary form against pickled alignment dicts.
+
+Run from the repository root:
+    python -m benchmarks.bench_lattice --sessions 200
+"""
+import argparse
+
+import os
+import pickle
+import tempfile
+import timeit
+
+import numpy as np
+
+import data_prep
+from asr_parser import parse_row
+from lattice import CROSS_ENGINE_COLUMNS, PhraseLattice
+from synthetic_data import generate, write_dic
+
+
+def dict_cross_engine_features(ref_words, asr_outputs, word_alignments, phoneme_alignment):
+
+    """ PhraseLattice.cross_engine_features computed word by word from the alignment dicts, for comparison. """
+
+    engines = list(asr_outputs)
+    pairs = [(a, b) for i, a in enumerate(engines) for b in engines[i + 1:]]
+
+    inserted = {}
+    for engine in engines:
+        gaps = [0] * (len(ref_words) + 1)
+        previous = -1
+        for i, word_alignment in enumerate(word_alignments[engine]):
+            if word_alignment['HypoIndex'] is not None:
+                gaps[i] = word_alignment['HypoIndex'] - previous - 1
+                previous = word_alignment['HypoIndex']
+        gaps[-1] = max(len(asr_outputs[engine].tokens) - 1 - previous, 0)
+        inserted[engine] = gaps
+
+    def span(engine, i):
+        hypo_index = word_alignments[engine][i]['HypoIndex']
+        starts = asr_outputs[engine].starts
+        if hypo_index is None or starts is None:
+            return None
+        start = np.float32(starts[hypo_index])
+        return start, start + np.float32(asr_outputs[engine].lapses[hypo_index])
+
+    features = {column: [] for column in CROSS_ENGINE_COLUMNS}
+    for i in range(len(ref_words)):
+        agree = sum(word_alignments[a][i]['Hypothesis Word'] == word_alignments[b][i]['Hypothesis Word'] for a, b in pairs)
+        features['asr_agreement'].append(agree / max(len(pairs), 1))
+
+        overlaps = []
+        for a, b in pairs:
+            span_a, span_b = span(a, i), span(b, i)
+            if span_a is None or span_b is None:
+                continue
+            union = max(span_a[1], span_b[1]) - min(span_a[0], span_b[0])
+            overlap = min(span_a[1], span_b[1]) - max(span_a[0], span_b[0])
+            overlaps.append(max(overlap, 0) / union if union > 0 else 1)
+        features['timing_overlap'].append(sum(overlaps) / len(overlaps) if overlaps else np.nan)
+
+        features['inserted_before'].append(sum(inserted[engine][i] for engine in engines) / len(engines))
+        features['inserted_after'].append(sum(inserted[engine][i + 1] for engine in engines) / len(engines))
+        features['phoneme_inserted'].append(phoneme_alignment[i]['ref_phoneme'].count('*'))
+        features['phoneme_deleted'].append(phoneme_alignment[i]['hypo_phoneme'].count('*'))
+    return features
+
+
+def phrase_inputs(asr_data_df):
+
+    """ (activityId, phrase_index, ref_words, asr_outputs, word_alignments, phoneme_alignment) of every row process_row keeps. """
+
+    index = data_prep.build_story_index(asr_data_df)
+    inputs = []
+    for row in asr_data_df.to_dict('records'):
+        phrase = index.get(data_prep.story_key(row['story_text'], row['phrase_index']))
+        try:
+            asr_outputs = parse_row(row)
+        except Exception:
+            continue
+        if phrase is None:
+            continue
+        word_alignments = {engine: data_prep.alignment_cache.word_level_alignment(phrase.ref_words, asr_output.tokens)
+                           for engine, asr_output in asr_outputs.items()}
+        phoneme_alignment = data_prep.alignment_cache.phoneme_level_alignment(phrase.ref_phonemes, row['wav2vec_transcript_phonemes'])
+        # process_row drops phrases with fewer phoneme words than reference words
+        if len(phoneme_alignment) < len(phrase.ref_words):
+            continue
+        inputs.append((row['activityId'], row['phrase_index'], phrase.ref_words, asr_outputs, word_alignments, phoneme_alignment))
+    return inputs
+
+
+def check_equal(inputs, lattices):
+    for phrase, lattice in zip(inputs, lattices):
+        expected = dict_cross_engine_features(phrase[2], *phrase[3:])
+        features = lattice.cross_engine_features()
+        restored = PhraseLattice.from_bytes(lattice.to_bytes()).cross_engine_features()
+        for column in CROSS_ENGINE_COLUMNS:
+            np.testing.assert_allclose(features[column], np.array(expected[column], dtype=np.float64), rtol=1e-6, err_msg=column)
+            np.testing.assert_array_equal(restored[column], features[column], err_msg=column)
+
+
+def best_of(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main(args):
+
+    labels_df, asr_data_df, pronunciations = generate(n_sessions=args.sessions, mapping_path=args.mapping_path, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        dic_path = os.path.join(tmp, 'all_story_words.dic')
+        write_dic(pronunciations, dic_path)
+        data_prep.init_dictionaries(args.mapping_path, dic_path)
+
+    inputs = phrase_inputs(asr_data_df)
+    if not inputs:
+        print("No phrases to benchmark, try more --sessions.")
+        return
+    lattices = [PhraseLattice.build(*phrase) for phrase in inputs]
+    check_equal(inputs, lattices)
+    n_phrases, n_words = len(inputs), sum(len(phrase[2]) for phrase in inputs)
+    print(f"{n_phrases} phrases, {n_words} words")
+
+    records = [lattice.to_bytes() for lattice in lattices]
+    timings = {'build': best_of(lambda: [PhraseLattice.build(*phrase) for phrase in inputs], args.repeat),
+               'lattice features': best_of(lambda: [lattice.cross_engine_features() for lattice in lattices], args.repeat),
+               'dict features': best_of(lambda: [dict_cross_engine_features(phrase[2], *phrase[3:]) for phrase in inputs], args.repeat),
+               'to_bytes': best_of(lambda: [lattice.to_bytes() for lattice in lattices], args.repeat),
+               'from_bytes': best_of(lambda: [PhraseLattice.from_bytes(record) for record in records], args.repeat)}
+    for name, seconds in timings.items():
+        print(f"{name:18s}{1e6 * seconds / n_phrases:10.1f} us/phrase")
+
+    pickled = sum(len(pickle.dumps((phrase[4], phrase[5]))) for phrase in inputs)
+    print(f"{'lattice bytes':18s}{sum(map(len, records)) / n_phrases:10.1f} per phrase")
+    print(f"{'pickled dicts':18s}{pickled / n_phrases:10.1f} per phrase (word and phoneme alignments only)")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the phrase lattice.')
+    parser.add_argument('--sessions', type=int, default=200, help='synthetic sessions')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions, the best is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mapping_path', type=str, default="arpabet_to_amirabet.json", help='ARPABET to AMIRABET mapping')
+    args = parser.parse_args()
+
+    main(args)
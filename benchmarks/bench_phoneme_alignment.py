@@ -0,0 +1,132 @@
+"""
+Microbenchmark of phoneme_level_alignment against the original
+string-concatenation implementation, on phrases of realistic length, and
+of the weighted NumPy alignment (align_phonemes_weighted_batch) with the
+default phonetic costs.
+
+Run from the repository root:
+    python -m benchmarks.bench_phoneme_alignment --words 5 15 40 100
+"""
+import argparse
+
+import json
+import random
+import timeit
+
+from rapidfuzz import distance as fuzz_dist
+
+from alignment import align_phonemes_weighted_batch, as_tokens, phoneme_costs, phoneme_level_alignment
+
+
+def legacy_phoneme_level_alignment(reference_sentence, hypothesis_sentence):
+
+    """ phoneme_level_alignment before the single-pass rewrite, kept for comparison. """
+
+    ref_words = as_tokens(reference_sentence, "phoneme")
+    hyp_words = as_tokens(hypothesis_sentence, "phoneme")
+    edit_ops = fuzz_dist.Levenshtein.editops(ref_words, hyp_words)
+    opcodes = fuzz_dist.Opcodes.from_editops(edit_ops)
+
+    ref_phoneme = ""
+    hypo_phoneme = ""
+    status_sequence = ""
+    index = 0
+    for op in opcodes:
+        if op.tag == 'equal':
+            for i in range(op.src_start, op.src_end):
+                ref_phoneme = ref_phoneme + ref_words[i]
+                hypo_phoneme = hypo_phoneme + hyp_words[index]
+                status_sequence = status_sequence + "C"
+                index += 1
+        elif op.tag == 'replace':
+            for i, j in zip(range(op.src_start, op.src_end), range(op.dest_start, op.dest_end)):
+                ref_phoneme = ref_phoneme + ref_words[i]
+                hypo_phoneme = hypo_phoneme + hyp_words[index]
+                status_sequence = status_sequence + "S"
+                index += 1
+        elif op.tag == 'delete':
+            for i in range(op.src_start, op.src_end):
+                ref_phoneme = ref_phoneme + ref_words[i]
+                hypo_phoneme = hypo_phoneme + "*"
+                status_sequence = status_sequence + "D"
+        elif op.tag == 'insert':
+            if not ref_phoneme:
+                continue
+            for j in range(op.dest_start, op.dest_end):
+                ref_phoneme = ref_phoneme + "*"
+                hypo_phoneme = hypo_phoneme + hyp_words[index]
+                status_sequence = status_sequence + "I"
+                index += 1
+
+    phoneme_alignment_result = []
+    prev_i = 0
+    for i, (ref, hypo, status) in enumerate(zip(ref_phoneme, hypo_phoneme, status_sequence)):
+        if ref == " " or i == len(ref_phoneme) - 1:
+            if i == len(ref_phoneme) - 1:
+                i += 1
+            phoneme_alignment_result.append({'ref_phoneme': ref_phoneme[prev_i:i],
+                                             'hypo_phoneme': hypo_phoneme[prev_i:i],
+                                             'phoneme_correct_rate': status_sequence[prev_i:i].count("C")/(i-prev_i)}
+                                            )
+            prev_i = i+1
+
+    return phoneme_alignment_result
+
+
+def make_phrase_pair(n_words, alphabet, rng, error_rate=0.15):
+
+    """ Random AMIRABET reference phrase and a noisy reading of it. """
+
+    ref_words = [''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 7))) for _ in range(n_words)]
+    hyp_words = []
+    for word in ref_words:
+        chars = []
+        for ch in word:
+            draw = rng.random()
+            if draw < error_rate / 3:
+                continue
+            chars.append(rng.choice(alphabet) if draw < 2 * error_rate / 3 else ch)
+            if draw > 1 - error_rate / 3:
+                chars.append(rng.choice(alphabet))
+        hyp_words.append(''.join(chars))
+    return ' '.join(ref_words), ' '.join(hyp_words)
+
+
+def main(args):
+
+    with open(args.dictionary_path, 'r', encoding='utf-8') as file:
+        arpabet_to_amirabet = json.load(file)
+    alphabet = sorted(arpabet_to_amirabet.values())
+    costs = phoneme_costs(arpabet_to_amirabet)
+    rng = random.Random(args.seed)
+
+    print(f"{'words':>6}{'legacy us':>12}{'new us':>10}{'speedup':>9}{'weighted us':>13}")
+    for n_words in args.words:
+        # tokenized up front, as data_prep does through the story index
+        pairs = [tuple(as_tokens(text, "phoneme") for text in make_phrase_pair(n_words, alphabet, rng))
+                 for _ in range(args.pairs)]
+        for reference, hypothesis in pairs:
+            assert phoneme_level_alignment(reference, hypothesis) == legacy_phoneme_level_alignment(reference, hypothesis)
+
+        legacy = min(timeit.repeat(lambda: [legacy_phoneme_level_alignment(*pair) for pair in pairs],
+                                   number=1, repeat=args.repeat))
+        new = min(timeit.repeat(lambda: [phoneme_level_alignment(*pair) for pair in pairs],
+                                number=1, repeat=args.repeat))
+        references, hypotheses = zip(*pairs)
+        weighted = min(timeit.repeat(lambda: align_phonemes_weighted_batch(references, hypotheses, costs),
+                                     number=1, repeat=args.repeat))
+        print(f"{n_words:>6}{1e6 * legacy / len(pairs):>12.1f}{1e6 * new / len(pairs):>10.1f}{legacy / new:>8.2f}x"
+              f"{1e6 * weighted / len(pairs):>13.1f}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark phoneme_level_alignment.')
+    parser.add_argument('--words', type=int, nargs='+', default=[5, 15, 40, 100], help='phrase lengths in words')
+    parser.add_argument('--pairs', type=int, default=200, help='phrase pairs per length')
+    parser.add_argument('--repeat', type=int, default=20, help='timing repetitions, the best is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dictionary_path', type=str, default="arpabet_to_amirabet.json", help='ARPABET to AMIRABET mapping')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,124 @@
+"""
+Lookup speed and resident memory of the compiled, memory-mapped
+pronunciation dictionary against the in-memory dicts. Each variant is
+loaded in a fresh interpreter so RSS numbers are not mixed up.
+
+Run from the repository root:
+    python -m benchmarks.bench_pron_dict --dic_path all_story_words.dic
+Without the private dictionary, --synthetic N generates one with N words.
+"""
+import argparse
+
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from pron_dict import PronunciationDict, compile_dictionary, load_pronunciations, read_dic, to_amirabet
+
+
+VARIANTS = ['dict of ARPABET lists', 'dict of AMIRABET strings', 'compiled mmap']
+
+
+def rss_kb():
+
+    """ Resident set size of this process in kB (Linux). """
+
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def write_synthetic_dic(path, n_words, mapping_path, seed=0):
+    with open(mapping_path, 'r') as file:
+        arpabet = sorted(json.load(file))
+    rng = random.Random(seed)
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    with open(path, 'w') as file:
+        for k in range(n_words):
+            word = ''.join(rng.choice(letters) for _ in range(rng.randint(2, 10))) + str(k)
+            file.write(word + ' ' + ' '.join(rng.choice(arpabet) for _ in range(rng.randint(2, 9))) + '\n')
+
+
+def measure(variant, args):
+
+    """ Load one variant, then time lookups of a fixed sample of words. """
+
+    with open(args.sample_path, 'r') as file:
+        sample = file.read().split()
+    before = rss_kb()
+    if variant == 'dict of ARPABET lists':
+        with open(args.mapping_path, 'r') as file:
+            arpabet_to_amirabet = json.load(file)
+        word_to_arpabet = read_dic(args.dic_path)
+
+        def lookup(word):
+            # what convert_text_to_phonemes did per word before compilation
+            if word in word_to_arpabet:
+                return to_amirabet(word_to_arpabet[word], arpabet_to_amirabet)
+            return None
+    elif variant == 'dict of AMIRABET strings':
+        pronunciations = load_pronunciations(args.dic_path, args.mapping_path)
+        lookup = pronunciations.get
+    else:
+        pronunciations = PronunciationDict(args.compiled_path)
+        lookup = pronunciations.get
+    loaded = rss_kb()
+
+    seconds = min(timeit.repeat(lambda: [lookup(word) for word in sample], number=1, repeat=args.repeat))
+    # mmap pages only become resident once they are touched by lookups
+    return {'variant': variant, 'rss_kb': loaded - before, 'rss_after_kb': rss_kb() - before,
+            'lookup_ns': 1e9 * seconds / len(sample)}
+
+
+def main(args):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            args.dic_path = os.path.join(tmp, 'synthetic.dic')
+            write_synthetic_dic(args.dic_path, args.synthetic, args.mapping_path)
+        args.compiled_path = os.path.join(tmp, 'dictionary.ampd')
+        n_words = compile_dictionary(args.dic_path, args.mapping_path, args.compiled_path)
+        print(f"{n_words} words, compiled file {os.path.getsize(args.compiled_path) / 1024:.0f} kB")
+
+        # the lookup sample is prepared here so the measured processes only load the dictionary
+        rng = random.Random(0)
+        words = list(read_dic(args.dic_path))
+        sample = rng.sample(words, min(args.lookups, len(words))) + ['NOT_A_WORD_%d' % k for k in range(args.lookups // 10)]
+        args.sample_path = os.path.join(tmp, 'sample.txt')
+        with open(args.sample_path, 'w') as file:
+            file.write('\n'.join(sample))
+
+        print(f"{'variant':<28}{'load RSS kB':>12}{'after lookups kB':>17}{'lookup ns':>11}")
+        for variant in VARIANTS:
+            completed = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pron_dict', '--measure', variant,
+                                        '--dic_path', args.dic_path, '--mapping_path', args.mapping_path,
+                                        '--compiled_path', args.compiled_path, '--sample_path', args.sample_path,
+                                        '--repeat', str(args.repeat)],
+                                       capture_output=True, text=True, check=True)
+            result = json.loads(completed.stdout)
+            print(f"{variant:<28}{result['rss_kb']:>12}{result['rss_after_kb']:>17}{result['lookup_ns']:>11.0f}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the compiled pronunciation dictionary.')
+    parser.add_argument('--dic_path', type=str, default="all_story_words.dic", help='path to the ARPABET pronunciation dictionary')
+    parser.add_argument('--mapping_path', type=str, default="arpabet_to_amirabet.json", help='path to the ARPABET to AMIRABET mapping')
+    parser.add_argument('--synthetic', type=int, default=0, help='benchmark a generated dictionary with this many words')
+    parser.add_argument('--lookups', type=int, default=10000, help='number of words looked up')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions, the best is reported')
+    parser.add_argument('--measure', type=str, choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument('--compiled_path', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--sample_path', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args)))
+    else:
+        main(args)
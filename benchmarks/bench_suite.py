@@ -0,0 +1,164 @@
+"""
+End-to-end benchmark suite on synthetic data from synthetic_data.py:
+word_level_alignment, phoneme_level_alignment, get_lexical_features,
+data_generation and feature_engineering, each at several scales.
+
+Results can be saved as JSON and compared against an earlier run; cases
+slower than the baseline by more than --tolerance are listed as
+regressions and the exit status is 1.
+
+Run from the repository root:
+    python -m benchmarks.bench_suite --scales small medium --save_path bench.json
+    python -m benchmarks.bench_suite --scales small medium --compare bench.json
+"""
+import argparse
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+
+import data_prep
+import lexical
+from alignment import as_tokens, phoneme_level_alignment, preprocess_text, word_level_alignment
+from asr_parser import parse_row
+from model import feature_engineering
+from synthetic_data import generate, write_dic
+
+# synthetic_data.generate arguments of each scale
+SCALES = {'small': {'n_sessions': 20, 'n_stories': 5, 'vocabulary_size': 200},
+          'medium': {'n_sessions': 200, 'n_stories': 20, 'vocabulary_size': 1000},
+          'large': {'n_sessions': 2000, 'n_stories': 50, 'vocabulary_size': 3000}
+          }
+
+CASES = ['word_level_alignment', 'phoneme_level_alignment', 'get_lexical_features', 'data_generation', 'feature_engineering']
+
+
+def best_of(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def run_scale(scale, args):
+
+    """
+    Generate the scale's dataset and time every case on it.
+
+    Return:
+      list[dict]: one record per case, with the number of items processed,
+      the best time over the repetitions and the throughput
+    """
+
+    labels_df, asr_data_df, pronunciations = generate(**SCALES[scale], mapping_path=args.mapping_path, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        dic_path = os.path.join(tmp, 'all_story_words.dic')
+        write_dic(pronunciations, dic_path)
+        data_prep.init_dictionaries(args.mapping_path, dic_path)
+    # a fresh in-memory store, so lexical features are computed in this run
+    data_prep.init_lexical_store()
+
+    index = data_prep.build_story_index(asr_data_df)
+    data_prep.set_story_index(index)
+    rows = []
+    for row in asr_data_df.to_dict('records'):
+        phrase = index.get(data_prep.story_key(row['story_text'], row['phrase_index']))
+        try:
+            asr_outputs = parse_row(row)
+        except Exception:
+            continue
+        if phrase is not None:
+            rows.append((phrase, asr_outputs['Amazon'].tokens, as_tokens(row['wav2vec_transcript_phonemes'], "phoneme")))
+    words = sorted({word for story_text in asr_data_df['story_text'].unique() for word in preprocess_text(story_text, "word")})
+
+    word_records = data_prep.data_generation(asr_data_df, progress=False)
+    labels_df['expected_text'] = labels_df['expected_text'].str.translate(data_prep.remove_punct).str.lower()
+    processed_df = labels_df.merge(data_prep.word_frame(word_records), on=data_prep.LABEL_KEYS).fillna(0)
+
+    cases = {'word_level_alignment': (len(rows), lambda: [word_level_alignment(phrase.ref_words, tokens)
+                                                          for phrase, tokens, phonemes in rows]),
+             'phoneme_level_alignment': (len(rows), lambda: [phoneme_level_alignment(phrase.ref_phonemes, phonemes)
+                                                             for phrase, tokens, phonemes in rows]),
+             'get_lexical_features': (len(words), lambda: [lexical.get_lexical_features(word) for word in words]),
+             # a fresh alignment cache every repetition, so repeats do not time a warm cache
+             'data_generation': (len(asr_data_df), lambda: (data_prep.init_alignment_cache(),
+                                                            data_prep.data_generation(asr_data_df, progress=False))),
+             'feature_engineering': (len(processed_df), lambda: feature_engineering(processed_df))
+             }
+
+    records = []
+    for case in args.cases:
+        n_items, function = cases[case]
+        seconds = best_of(function, args.repeat)
+        records.append({'case': case,
+                        'scale': scale,
+                        'items': n_items,
+                        'seconds': seconds,
+                        'items_per_second': n_items / max(seconds, 1e-12)
+                        })
+        print(f"{case:26s}{scale:>8s}{n_items:>10}{seconds:>10.4f}{1e6 * seconds / max(n_items, 1):>12.1f}")
+    return records
+
+
+def compare(records, baseline_path, tolerance):
+
+    """ Print each case against the baseline run; return the cases slower by more than tolerance. """
+
+    with open(baseline_path, 'r') as file:
+        baseline = {(record['case'], record['scale']): record for record in json.load(file)['results']}
+
+    regressions = []
+    print(f"\n{'case':26s}{'scale':>8s}{'baseline s':>12s}{'now s':>10s}{'ratio':>8s}")
+    for record in records:
+        previous = baseline.get((record['case'], record['scale']))
+        if previous is None or previous['items'] != record['items']:
+            print(f"{record['case']:26s}{record['scale']:>8s}{'-':>12s}{record['seconds']:>10.4f}{'-':>8s}")
+            continue
+        ratio = record['seconds'] / max(previous['seconds'], 1e-12)
+        flag = '  REGRESSION' if ratio > 1 + tolerance else ''
+        print(f"{record['case']:26s}{record['scale']:>8s}{previous['seconds']:>12.4f}{record['seconds']:>10.4f}{ratio:>7.2f}x{flag}")
+        if flag:
+            regressions.append(record)
+    return regressions
+
+
+def main(args):
+
+    print(f"{'case':26s}{'scale':>8s}{'items':>10s}{'best s':>10s}{'us/item':>12s}")
+    records = []
+    for scale in args.scales:
+        records.extend(run_scale(scale, args))
+
+    if args.save_path:
+        with open(args.save_path, 'w') as file:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                       'python': sys.version.split()[0],
+                       'platform': platform.platform(),
+                       'repeat': args.repeat,
+                       'seed': args.seed,
+                       'results': records
+                       }, file, indent=2)
+        print(f"Results saved to {args.save_path}.")
+
+    if args.compare:
+        regressions = compare(records, args.compare, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic data.')
+    parser.add_argument('--scales', type=str, nargs='+', default=['small', 'medium'], choices=list(SCALES), help='dataset sizes')
+    parser.add_argument('--cases', type=str, nargs='+', default=CASES, choices=CASES, help='functions to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions, the best is reported')
+    parser.add_argument('--save_path', type=str, default=None, help='JSON file to save the results to')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown over the baseline reported as a regression')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mapping_path', type=str, default="arpabet_to_amirabet.json", help='ARPABET to AMIRABET mapping')
+    args = parser.parse_args()
+
+    main(args)
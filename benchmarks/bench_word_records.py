@@ -0,0 +1,128 @@
+"""
+Peak memory and time of data_generation with columnar WordRecords against
+the original one-dict-per-word path, from processing the rows to the
+dataframe handed to the labels join, on synthetic data.
+
+Run from the repository root:
+    python -m benchmarks.bench_word_records --sessions 500 2000
+"""
+import argparse
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import data_prep
+from asr_parser import ASR_ENGINES, parse_row
+from synthetic_data import generate, write_dic
+
+
+def legacy_engine_word_features(prefix, word_alignment, asr_output, scores):
+    if word_alignment['HypoIndex'] is None:
+        return {prefix + '_deleted': 1}
+
+    lapse, confidence = scores(asr_output, word_alignment['HypoIndex'])
+    return {prefix + '_lapse': lapse,
+            prefix + '_confidence': confidence,
+            prefix + '_correct': 1 if word_alignment['Status'] == 'Correct' else 0,
+            prefix + '_substituted': 1 if word_alignment['Status'] == 'Substituted' else 0
+            }
+
+
+def legacy_data_generation(df):
+
+    """ data_generation and word_frame before WordRecords, one feature dict per word, kept for comparison. """
+
+    results = []
+    for index, row in df.iterrows():
+        try:
+            phrase = data_prep.story_index[data_prep.story_key(row['story_text'], row['phrase_index'])]
+            asr_outputs = parse_row(row)
+            word_alignments = {engine: data_prep.alignment_cache.word_level_alignment(phrase.ref_words, asr_output.tokens)
+                               for engine, asr_output in asr_outputs.items()}
+            phoneme_alignments = data_prep.alignment_cache.phoneme_level_alignment(phrase.ref_phonemes, row['wav2vec_transcript_phonemes'])
+
+            word_result = {}
+            for engine, column, prefix, parser in ASR_ENGINES:
+                for i, word_alignment in enumerate(word_alignments[engine]):
+                    expected_text = word_alignment['Reference Word']
+                    if not expected_text: continue
+                    if i not in word_result:
+                        word_result[i] = {'activityId': row['activityId'],
+                                          'phraseIndex': row['phrase_index'],
+                                          'word_index': i,
+                                          'expected_text': expected_text
+                                          }
+                    word_result[i].update(legacy_engine_word_features(prefix, word_alignment, asr_outputs[engine],
+                                                                      data_prep.ENGINE_SCORES[engine]))
+                    word_result[i].update(phoneme_alignments[i])
+                    word_result[i].update(phrase.lexical[i])
+        except Exception:
+            continue
+        results.extend(word_result.values())
+
+    float_columns = [column for column in data_prep.OUTPUT_COLUMNS
+                     if column not in data_prep.OBJECT_COLUMNS + data_prep.INT_COLUMNS]
+    processed_df = pd.DataFrame(results, columns=data_prep.OUTPUT_COLUMNS)
+    processed_df[float_columns] = processed_df[float_columns].astype('float64')
+    processed_df['syllables_counts'] = processed_df['syllables_counts'].astype('Int64')
+    return processed_df
+
+
+def records_data_generation(df):
+    return data_prep.word_frame(data_prep.data_generation(df, progress=False))
+
+
+def measure(function, df):
+
+    """ Seconds and peak traced MB of function(df), with a fresh alignment cache so both paths align every row. """
+
+    data_prep.init_alignment_cache()
+    start = time.perf_counter()
+    function(df)
+    elapsed = time.perf_counter() - start
+
+    data_prep.init_alignment_cache()
+    tracemalloc.start()
+    result = function(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def main(args):
+
+    print(f"{'sessions':>9}{'words':>9}{'dicts s':>9}{'dicts MB':>10}{'records s':>11}{'records MB':>12}{'dict B/w':>10}{'rec B/w':>9}")
+    for n_sessions in args.sessions:
+        labels_df, asr_data_df, pronunciations = generate(n_sessions=n_sessions, mapping_path=args.mapping_path, seed=args.seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            dic_path = os.path.join(tmp, 'all_story_words.dic')
+            write_dic(pronunciations, dic_path)
+            data_prep.init_dictionaries(args.mapping_path, dic_path)
+        data_prep.init_lexical_store()
+        data_prep.set_story_index(data_prep.build_story_index(asr_data_df))
+
+        legacy_df, legacy, legacy_peak = measure(legacy_data_generation, asr_data_df)
+        records_df, new, new_peak = measure(records_data_generation, asr_data_df)
+
+        pd.testing.assert_frame_equal(records_df, legacy_df, check_dtype=False)
+        assert all(records_df[column].dtype == legacy_df[column].dtype
+                   for column in legacy_df.columns if legacy_df[column].dtype.kind == 'f')
+
+        n_words = len(records_df)
+        print(f"{n_sessions:>9}{n_words:>9}{legacy:>9.2f}{legacy_peak:>10.1f}{new:>11.2f}{new_peak:>12.1f}"
+              f"{legacy_peak * 2 ** 20 / max(n_words, 1):>10.0f}{new_peak * 2 ** 20 / max(n_words, 1):>9.0f}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark WordRecords against per-word dicts.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[500, 2000], help='synthetic sessions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mapping_path', type=str, default="arpabet_to_amirabet.json", help='ARPABET to AMIRABET mapping')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,150 @@
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+
+
+class LRUCache:
+
+    """
+    Bounded in-memory LRU cache with an optional SQLite file behind it, so
+    entries survive between runs and are shared by processes pointing at the
+    same file. Values must be JSON serializable.
+
+    The file is opened in WAL mode so readers never wait for a writer, and
+    writes are buffered in memory and written in one short transaction per
+    batch, so processes sharing the file hold its write lock only briefly.
+    A batch that still cannot be written (ex. "database is locked") is
+    skipped and counted in failed_writes; the values stay in memory.
+
+    Args:
+      maxsize: maximum number of entries kept in memory
+      path: optional SQLite file used as the persistent layer
+      table: table name inside the SQLite file
+      decode: optional function applied to values read back from the file
+      commit_every: writes to the file are committed in batches of this size,
+        flush() or close() commits the rest
+      timeout: seconds to wait for the file's lock
+    """
+
+    def __init__(self, maxsize=100000, path=None, table='cache', decode=None, commit_every=1, timeout=60):
+        self.maxsize = maxsize
+        self.path = path
+        self.table = table
+        self.decode = decode
+        self.commit_every = commit_every
+        self.timeout = timeout
+        self._pending = []
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.failed_writes = 0
+        self._entries = OrderedDict()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self):
+
+        """ Open the SQLite file lazily, once per process. """
+
+        if self.path is None:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT)')
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        conn = self._connection()
+        if conn is not None:
+            try:
+                row = conn.execute(f'SELECT value FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            except sqlite3.OperationalError:
+                row = None
+            if row is not None:
+                self.disk_hits += 1
+                value = json.loads(row[0])
+                if self.decode is not None:
+                    value = self.decode(value)
+                self._remember(key, value)
+                return value
+
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.path is not None:
+            self._pending.append((key, json.dumps(value)))
+            if len(self._pending) >= self.commit_every:
+                self.flush()
+
+    def flush(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        conn = self._connection()
+        try:
+            with conn:
+                conn.executemany(f'INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)', pending)
+        except sqlite3.OperationalError:
+            self.failed_writes += len(pending)
+
+    def get_or_compute(self, key, compute):
+
+        """
+        Return the cached value for key, calling compute() and storing its
+        result on a miss. Exceptions raised by compute() are not cached.
+        """
+
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'failed_writes': self.failed_writes,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'size': len(self._entries)
+                }
+
+    def reset_stats(self):
+        self.hits = self.disk_hits = self.misses = 0
+
+    def close(self):
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    # enough of the dict interface to stand in for a plain dict, ex. as a story index
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+
+_MISSING = object()
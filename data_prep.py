@@ -1,124 +1,756 @@
 import argparse
 
-import json
+import hashlib
+import os
 import string
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from lexical import get_lexical_features
-from alignment import word_level_alignment, phoneme_level_alignment
+from lexical import LEXICAL_FEATURES_VERSION, LexicalFeatureStore, get_phrase_lexical_features, phrase_pos_tags
+from alignment import AlignmentCache, preprocess_text
+from asr_parser import ASR_ENGINES, iter_asr_data, load_asr_data, parse_row
+from instrumentation import PipelineMetrics
+from lattice import CROSS_ENGINE_COLUMNS, PhraseLattice
+from pron_dict import PronunciationDict, dictionary_fingerprint, load_pronunciations
+from records import FLOAT, INT, OBJECT, WordRecords
+from feature_dataset import rewrite_buckets, write_parquet
+from manifest import Manifest, value_digest
 from tqdm import tqdm
 
-# import dictionaries
+# word -> AMIRABET pronunciation, loaded on first use or by init_dictionaries()
 json_file_path = 'arpabet_to_amirabet.json'
-with open(json_file_path, 'r') as file:
-    arpabet_to_amirabet = json.load(file)
+dic_file_path = 'all_story_words.dic'
+pronunciations = None
+dictionary_paths = (json_file_path, dic_file_path, None)
 
-word_to_arpabet = {}
-with open('all_story_words.dic', 'r') as file:
-    for line in file:
-        parts = line.strip().split()
-        word = parts[0]
-        phonemes = parts[1:]
-        word_to_arpabet[word] = phonemes
+
+def init_dictionaries(json_path=json_file_path, dic_path=dic_file_path, compiled_path=None):
+
+    """
+    Load the pronunciation dictionary. With compiled_path, the binary file
+    from pron_dict.py is memory-mapped; otherwise the .dic file is parsed and
+    converted to AMIRABET with the mapping. Called by get_pronunciations()
+    on first use, or explicitly with other paths.
+    """
+
+    global pronunciations, dictionary_paths
+    dictionary_paths = (json_path, dic_path, compiled_path)
+    if compiled_path:
+        pronunciations = PronunciationDict(compiled_path)
+    else:
+        pronunciations = load_pronunciations(dic_path, json_path)
+
+
+def get_pronunciations():
+    if pronunciations is None:
+        init_dictionaries()
+    return pronunciations
+
+
+# Bump when process_row output changes, so incremental builds start over
+PIPELINE_VERSION = 1
+
+
+def pipeline_version(n_buckets, phrase_pos=False, lattice=False):
+
+    """ Everything an incremental build's output depends on besides its input rows. """
+
+    json_path, dic_path, compiled_path = dictionary_paths
+    if isinstance(get_pronunciations(), PronunciationDict):
+        fingerprint = get_pronunciations().fingerprint
+    else:
+        fingerprint = dictionary_fingerprint(dic_path, json_path)
+    lexical_mode = 'phrase' if phrase_pos else 'word'
+    version = f"{PIPELINE_VERSION}-{LEXICAL_FEATURES_VERSION}-{lexical_mode}-{fingerprint.hex()}-{n_buckets}"
+    return version + '-lattice' if lattice else version
 
 
 remove_punct = str.maketrans('', '', string.punctuation)
 
+# lexical features are cached per word, see --lexical_cache
+lexical_store = LexicalFeatureStore()
+
+
+def init_lexical_store(cache_path=None):
+
+    """ Replace the process-wide lexical feature store. Also used as the worker initializer. """
+
+    global lexical_store
+    lexical_store = LexicalFeatureStore(path=cache_path)
+
+
+# (reference, hypothesis) alignments are memoized, see --alignment_cache
+ALIGNMENT_CACHE_SIZE = 20000
+alignment_cache = AlignmentCache(ALIGNMENT_CACHE_SIZE)
+alignment_cache_args = (None, ALIGNMENT_CACHE_SIZE)
+
+
+def init_alignment_cache(cache_path=None, maxsize=ALIGNMENT_CACHE_SIZE):
+
+    """ Replace the process-wide alignment cache. """
+
+    global alignment_cache, alignment_cache_args
+    alignment_cache = AlignmentCache(maxsize, cache_path)
+    alignment_cache_args = (cache_path, maxsize)
+
+
+def collect_cache_stats():
+
+    """
+    Move this process's lexical and alignment cache hits and misses into
+    metrics, so the parent sums them over the workers, and commit pending
+    alignment writes.
+    """
+
+    stats = lexical_store.stats()
+    metrics.count('lexical_cache_hits', stats['hits'])
+    metrics.count('lexical_cache_disk_hits', stats['disk_hits'])
+    metrics.count('lexical_cache_misses', stats['misses'])
+    lexical_store.reset_stats()
+
+    stats = alignment_cache.stats()
+    metrics.count('alignment_cache_hits', stats['hits'] + stats['disk_hits'])
+    metrics.count('alignment_cache_misses', stats['misses'])
+    alignment_cache.reset_stats()
+    alignment_cache.flush()
+
+
+# add the cross-engine features of the phrase lattice to every word, see --lattice_features
+lattice_features = False
+
+
+def set_lattice_features(enabled):
+
+    """ Turn the cross-engine features of process_row on or off for this process. """
+
+    global lattice_features
+    lattice_features = enabled
+
+
+# Reference-side data shared by every reading of the same story phrase
+StoryPhrase = namedtuple('StoryPhrase', ['ref_words', 'ref_phonemes', 'lexical'])
+
+story_index = {}
+
+
+def set_story_index(index):
+
+    """ Replace the process-wide story index built by build_story_index. """
+
+    global story_index
+    story_index = index
+
+
+def _init_worker(lexical_cache, index, paths, alignment_args, lattice):
+    if pronunciations is None or dictionary_paths != paths:
+        init_dictionaries(*paths)
+    init_lexical_store(lexical_cache)
+    init_alignment_cache(*alignment_args)
+    set_lattice_features(lattice)
+    set_story_index(index)
+
 def convert_text_to_phonemes(text):
     """ Convert text to phonemes using the dictionaries. """
+    word_to_amirabet = get_pronunciations()
     text = text.translate(remove_punct).upper()
     words = text.split()
     phoneme_text = []
     for word in words:
-        if word in word_to_arpabet:
-            arpabet_phonemes = word_to_arpabet[word]
-            amirabet_phonemes = [arpabet_to_amirabet[ph] for ph in arpabet_phonemes if ph in arpabet_to_amirabet]
-            phoneme_text.append(''.join(amirabet_phonemes))
+        amirabet_phonemes = word_to_amirabet.get(word)
+        if amirabet_phonemes is not None:
+            phoneme_text.append(amirabet_phonemes)
         else:
             phoneme_text.append('UNK')  # UNK for unknown words
     return ' '.join(phoneme_text)
 
 
-def data_generation(df):
-    results = []
-    for index, row in tqdm(df.iterrows()):
-        asr_outputs = {
-            'Amazon': row['amazon_data'],
-            'Kaldi': row['kaldi_data'],
-            'KaldiNA': row['kaldiNa_data'],
-        }
-        
-        story_text = row['story_text']
-        word_result = {}
+def story_key(story_text, phrase_index):
+
+    """ Key of a story phrase in the story index. """
+
+    return hashlib.sha1(str(story_text).encode('utf-8')).hexdigest(), phrase_index
+
+
+def build_story_phrase(story_text, pos_tags=None):
+
+    """
+    Precompute everything that only depends on the reference text.
+
+    Args:
+      story_text: text of one story phrase
+
+    Return:
+      StoryPhrase: tokenized reference words, characters of their AMIRABET
+      phoneme string and the lexical features of each reference word
+    """
+
+    ref_words = preprocess_text(story_text, "word")
+    phonemes = convert_text_to_phonemes(story_text)
+
+    return StoryPhrase(ref_words=ref_words,
+                       ref_phonemes=preprocess_text(phonemes, "phoneme"),
+                       lexical=(get_phrase_lexical_features(ref_words, pos_tags) if pos_tags is not None
+                                else [lexical_store.get(word) for word in ref_words])
+                       )
+
+
+def build_story_index(df, index=None, phrase_pos=False, spacy_processes=1):
+
+    """
+    Build the story index once before the main loop, so reference processing
+    scales with the number of unique phrases instead of the number of rows.
+    Phrases that fail to process are left out; their rows are dropped by
+    process_row as before.
+
+    Args:
+      df: asr_data dataframe, or a chunk of it
+      index: existing index to extend, ex. when reading asr_data in chunks
+      phrase_pos: tag POS over whole phrases in one batched spaCy pass
+        instead of one spaCy call per word
+      spacy_processes: spaCy worker processes for phrase_pos
+
+    Return:
+      dict: story_key -> StoryPhrase
+    """
+
+    if index is None:
+        index = {}
+    new_phrases = {}
+    for story_text, phrase_index in df[['story_text', 'phrase_index']].drop_duplicates().itertuples(index=False):
+        key = story_key(story_text, phrase_index)
+        if key not in index:
+            new_phrases[key] = story_text
+
+    pos_tags = {}
+    if phrase_pos and new_phrases:
+        phrase_words = {}
+        for story_text in new_phrases.values():
+            try:
+                phrase_words[story_text] = preprocess_text(story_text, "word")
+            except Exception:
+                continue
+        pos_tags = dict(zip(phrase_words, phrase_pos_tags(list(phrase_words.values()), n_process=spacy_processes)))
+
+    for key, story_text in new_phrases.items():
         try:
-            # apply word-level alignment to the three asr transcriptions
-            for key, asr_output in asr_outputs.items():
-
-                asr_output = eval(asr_output)
-                word_alignments = word_level_alignment(story_text, asr_output["text"])
-                phoneme_alignments = phoneme_level_alignment(\
-                                  convert_text_to_phonemes(story_text), \
-                                  row['wav2vec_transcript_phonemes']
-                              )
-
-                for i in range(len(word_alignments)):
-
-                    word_alignment = word_alignments[i]
-                    expected_text = word_alignment['Reference Word']
-
-                    if not expected_text: continue
-                    
-                    if i not in word_result: 
-                        word_result[i] = {'activityId': row['activityId'],
-                                          'phraseIndex': row['phrase_index'],
-                                          'word_index': i,
-                                          'expected_text': expected_text
-                                          }
-
-                    # word level alignment
-                    if key == 'Amazon':
-                        if word_alignment['HypoIndex'] is None:
-                            word_result[i]['amazon_deleted'] = 1 
-                        else:
-                            word_result[i]['amazon_lapse'] = asr_output['lapse'][word_alignment['HypoIndex']][-1]
-                            word_result[i]['amazon_confidence'] = asr_output['confidence'][word_alignment['HypoIndex']][-1]
-                            word_result[i]['amazon_correct'] = 1 if word_alignment['Status'] == 'Correct' else 0
-                            word_result[i]['amazon_substituted'] = 1 if word_alignment['Status'] == 'Substituted' else 0
-
-
-                    if key == 'Kaldi':
-                        if word_alignment['HypoIndex'] is None:
-                            word_result[i]['kaldi_deleted'] = 1
-                        else:
-                            word_result[i]['kaldi_lapse'] = asr_output['transcription'][word_alignment['HypoIndex']]['confidence']
-                            word_result[i]['kaldi_confidence'] = asr_output['transcription'][word_alignment['HypoIndex']]['end_time'] \
-                                                - asr_output['transcription'][word_alignment['HypoIndex']]['start_time']
-                            word_result[i]['kaldi_correct'] = 1 if word_alignment['Status'] == 'Correct' else 0
-                            word_result[i]['kaldi_substituted'] = 1 if word_alignment['Status'] == 'Substituted' else 0
-
-                    if key == 'KaldiNA':
-                        if word_alignment['HypoIndex'] is None:
-                            word_result[i]['kaldina_deleted'] = 1
-                        else:
-                            word_result[i]['kaldina_lapse'] = asr_output['transcription'][word_alignment['HypoIndex']]['confidence']
-                            word_result[i]['kaldina_confidence'] = asr_output['transcription'][word_alignment['HypoIndex']]['end_time'] \
-                                                - asr_output['transcription'][word_alignment['HypoIndex']]['start_time']
-                            word_result[i]['kaldina_correct'] = 1 if word_alignment['Status'] == 'Correct' else 0
-                            word_result[i]['kaldina_substituted'] = 1 if word_alignment['Status'] == 'Substituted' else 0
-                    
-                    # phoneme level alignment
-                    word_result[i].update(phoneme_alignments[i])
-
-                    # lexical features
-                    word_result[i].update(get_lexical_features(expected_text))
-        except:
-
-            # print(index, row['activityId'], row['phrase_index'])
+            index[key] = build_story_phrase(story_text, pos_tags.get(story_text))
+        except Exception:
+            metrics.count('story_phrases_failed')
+            continue
+    return index
+
+
+# stage timings, counters and dropped rows of this process, see instrumentation.py
+metrics = PipelineMetrics()
+
+
+def _amazon_scores(asr_output, hypo_index):
+    return asr_output.lapses[hypo_index], asr_output.confidences[hypo_index]
+
+
+def _kaldi_scores(asr_output, hypo_index):
+    # kaldi features historically store the confidence as lapse and the
+    # word duration (ParsedASR.lapses) as confidence, keep it for trained models
+    return asr_output.confidences[hypo_index], asr_output.lapses[hypo_index]
+
+
+ENGINE_SCORES = {'Amazon': _amazon_scores, 'Kaldi': _kaldi_scores, 'KaldiNA': _kaldi_scores}
+
+# Output layout of a word, used when chunks must share one schema
+LABEL_KEYS = ['activityId', 'phraseIndex', 'word_index']
+PHONEME_COLUMNS = ['ref_phoneme', 'hypo_phoneme', 'phoneme_correct_rate']
+LEXICAL_COLUMNS = ['word_length', 'syllables_counts', 'pos_tags', 'ortho_complexity']
+
+
+def engine_columns(prefix):
+    return [prefix + '_lapse', prefix + '_confidence', prefix + '_correct', prefix + '_substituted']
+
+
+OUTPUT_COLUMNS = (LABEL_KEYS + ['expected_text']
+                  + engine_columns('amazon') + PHONEME_COLUMNS + LEXICAL_COLUMNS
+                  + engine_columns('kaldi') + engine_columns('kaldina')
+                  + [prefix + '_deleted' for name, column, prefix, parser in ASR_ENGINES])
+
+
+def output_columns():
+
+    """ OUTPUT_COLUMNS, followed by CROSS_ENGINE_COLUMNS when lattice features are on. """
+
+    return OUTPUT_COLUMNS + CROSS_ENGINE_COLUMNS if lattice_features else OUTPUT_COLUMNS
+
+
+def engine_word_columns(prefix, word_alignments, asr_output, scores):
+
+    """
+    Word-level features of some reference words for one ASR engine, as
+    columns. Where the engine deleted the word only {prefix}_deleted is set,
+    elsewhere all but {prefix}_deleted; the rest is NaN.
+
+    Args:
+      prefix: feature prefix of the engine, ex. amazon
+      word_alignments: alignments of the words from word_level_alignment
+      asr_output: ParsedASR of the engine
+      scores: function returning (lapse, confidence) for hypothesis indices
+
+    Return:
+      dict: {prefix}_lapse/_confidence/_correct/_substituted/_deleted -> float64 array
+    """
+
+    n_words = len(word_alignments)
+    deleted = np.array([word_alignment['HypoIndex'] is None for word_alignment in word_alignments], dtype=bool)
+    hypo_index = np.array([word_alignment['HypoIndex'] for word_alignment in word_alignments
+                           if word_alignment['HypoIndex'] is not None], dtype=np.int64)
+    correct = np.array([word_alignment['Status'] == 'Correct' for word_alignment in word_alignments], dtype=np.float64)
+    substituted = np.array([word_alignment['Status'] == 'Substituted' for word_alignment in word_alignments], dtype=np.float64)
+
+    columns = {prefix + '_lapse': np.full(n_words, np.nan), prefix + '_confidence': np.full(n_words, np.nan)}
+    columns[prefix + '_lapse'][~deleted], columns[prefix + '_confidence'][~deleted] = scores(asr_output, hypo_index)
+    columns[prefix + '_correct'] = np.where(deleted, np.nan, correct)
+    columns[prefix + '_substituted'] = np.where(deleted, np.nan, substituted)
+    columns[prefix + '_deleted'] = np.where(deleted, 1.0, np.nan)
+    return columns
+
+
+# WordRecords kinds of the output columns, the others are FLOAT
+OBJECT_COLUMNS = ['activityId', 'expected_text', 'ref_phoneme', 'hypo_phoneme', 'pos_tags']
+INT_COLUMNS = ['phraseIndex', 'word_index', 'word_length', 'syllables_counts', 'ortho_complexity',
+               'phoneme_inserted', 'phoneme_deleted']
+
+
+def word_records(capacity=1024):
+
+    """ Empty WordRecords with the output_columns() layout, filled by process_row. """
+
+    return WordRecords({column: OBJECT if column in OBJECT_COLUMNS else INT if column in INT_COLUMNS else FLOAT
+                        for column in output_columns()}, capacity)
+
+
+def process_row(row, records):
+
+    """
+    Align the three ASR transcriptions and the wav2vec phonemes of one
+    asr_data row against its story text and attach lexical features.
+
+    The row runs through explicit stages, each exactly once: reference prep,
+    payload parsing, per-engine word alignment, one wav2vec phoneme alignment,
+    the lexical join and, with lattice features on, the phrase lattice and
+    its cross-engine features. Time per stage is accumulated in metrics; a row
+    that fails is counted there by stage, exception type and ASR engine.
+
+    Args:
+      row: a row of asr_data.csv
+      records: WordRecords from word_records, one record per reference word
+        is appended to it
+
+    Return:
+      int: number of records appended, or None if the row could not be processed
+    """
+
+    metrics.count('rows')
+    engine = None
+    try:
+        with metrics.stage('reference'):
+            story_text = row['story_text']
+            phrase = story_index.get(story_key(story_text, row['phrase_index']))
+            if phrase is None:
+                phrase = build_story_phrase(story_text)
 
+        with metrics.stage('parse'):
+            asr_outputs = parse_row(row)
+
+        # apply word-level alignment to the three asr transcriptions
+        with metrics.stage('word_alignment'):
+            word_alignments = {}
+            for engine, asr_output in asr_outputs.items():
+                word_alignments[engine] = alignment_cache.word_level_alignment(phrase.ref_words, asr_output.tokens)
+            engine = None
+
+        # phoneme level alignment does not depend on the engine
+        with metrics.stage('phoneme_alignment'):
+            phoneme_alignments = alignment_cache.phoneme_level_alignment(phrase.ref_phonemes, row['wav2vec_transcript_phonemes'])
+
+        with metrics.stage('lexical_join'):
+            # reference words with text, one record each
+            words = [i for i, word in enumerate(phrase.ref_words) if word]
+            columns = {'activityId': row['activityId'],
+                       'phraseIndex': row['phrase_index'],
+                       'word_index': words,
+                       'expected_text': [phrase.ref_words[i] for i in words]
+                       }
+            for engine, column, prefix, parser in ASR_ENGINES:
+                columns.update(engine_word_columns(prefix, [word_alignments[engine][i] for i in words],
+                                                   asr_outputs[engine], ENGINE_SCORES[engine]))
+            engine = None
+
+            # phoneme level alignment and lexical features
+            phoneme_words = [phoneme_alignments[i] for i in words]
+            lexical_words = [phrase.lexical[i] for i in words]
+            for name in PHONEME_COLUMNS:
+                columns[name] = [phoneme_word[name] for phoneme_word in phoneme_words]
+            for name in LEXICAL_COLUMNS:
+                columns[name] = [lexical_word[name] for lexical_word in lexical_words]
+
+        if lattice_features:
+            with metrics.stage('lattice'):
+                lattice = PhraseLattice.build(row['activityId'], row['phrase_index'], phrase.ref_words,
+                                              asr_outputs, word_alignments, phoneme_alignments)
+                for name, values in lattice.cross_engine_features().items():
+                    columns[name] = values[words]
+
+        records.append(len(words), columns)
+    except Exception as exc:
+        metrics.record_failure(exc, (row.get('activityId'), row.get('phrase_index')), engine)
+        return None
+
+    metrics.count('words', len(words))
+    return len(words)
+
+
+def data_generation(df, progress=True):
+
+    """ process_row over the rows of df, the records of the rows that could be processed. """
+
+    records = word_records(capacity=8 * len(df))
+    for index, row in tqdm(df.iterrows(), disable=not progress):
+        process_row(row, records)
+
+    collect_cache_stats()
+    return records
+
+
+def _process_shard(shard_df):
+
+    """
+    Worker entry point: process one shard, time it and return its records,
+    the number of records of each row (0 for a dropped row) and its metrics.
+    """
+
+    start = time.perf_counter()
+    metrics.reset()
+    records = word_records(capacity=8 * len(shard_df))
+    counts = np.array([process_row(row, records) or 0 for index, row in shard_df.iterrows()], dtype=np.int64)
+    collect_cache_stats()
+    return os.getpid(), len(shard_df), time.perf_counter() - start, (shard_df.index.to_numpy(), counts, records), metrics.snapshot()
+
+
+def shard_by_activity(df, n_shards):
+
+    """
+    Partition rows into shards so that every activityId lands in exactly one
+    shard. Sessions are assigned greedily to the currently smallest shard.
+
+    Args:
+      df: asr_data dataframe with a positional (0..n-1) index
+      n_shards: number of shards to build
+
+    Return:
+      list[pd.DataFrame]: non-empty shards, rows kept in their original order
+    """
+
+    groups = df.groupby('activityId', sort=False).indices
+    shards = [[] for _ in range(n_shards)]
+    sizes = [0] * n_shards
+    for positions in sorted(groups.values(), key=len, reverse=True):
+        smallest = sizes.index(min(sizes))
+        shards[smallest].extend(positions)
+        sizes[smallest] += len(positions)
+    return [df.iloc[sorted(positions)] for positions in shards if positions]
+
+
+def worker_pool(workers, lexical_cache=None, index=None):
+
+    """
+    Process pool for parallel_data_generation. Each worker loads the
+    dictionaries, its lexical feature store, its alignment cache and the
+    story index once, and takes over the lattice features setting.
+
+    Args:
+      workers: number of worker processes
+      lexical_cache: optional SQLite path for the workers' lexical feature stores
+      index: story index shared with every worker
+    """
+
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(lexical_cache, index, dictionary_paths, alignment_cache_args, lattice_features))
+
+
+def parallel_data_generation(df, executor, n_shards, worker_stats=None):
+
+    """
+    Multi-process version of data_generation. Rows are partitioned by
+    activityId, processed in a process pool and merged back in the original
+    row order, so the result is identical to the serial path.
+
+    Args:
+      df: asr_data dataframe
+      executor: pool from worker_pool
+      n_shards: number of shards the rows are split into
+      worker_stats: optional dict pid -> [rows, seconds] to accumulate into
+
+    Return:
+      WordRecords: word-level features, same as data_generation
+    """
+
+    df = df.reset_index(drop=True)
+    shards = shard_by_activity(df, n_shards)
+    if worker_stats is None:
+        worker_stats = {}
+
+    parts, positions = [], []
+    for pid, n_rows, elapsed, (rows, counts, records), worker_metrics in tqdm(executor.map(_process_shard, shards), total=len(shards)):
+        parts.append(records)
+        positions.append(np.repeat(rows, counts))
+        stats = worker_stats.setdefault(pid, [0, 0.0])
+        stats[0] += n_rows
+        stats[1] += elapsed
+        metrics.merge(worker_metrics)
+
+    # records of a row stay together, rows go back to the order of df
+    records = WordRecords.concat(parts, word_records().schema)
+    return records.take(np.argsort(np.concatenate(positions + [np.zeros(0, dtype=np.int64)]), kind='stable'))
+
+
+def print_worker_stats(worker_stats):
+    for pid, (n_rows, elapsed) in sorted(worker_stats.items()):
+        print(f"worker {pid}: {n_rows} rows in {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):.1f} rows/sec)")
+
+
+def print_lexical_stats(counters):
+    hits, disk_hits = counters.get('lexical_cache_hits', 0), counters.get('lexical_cache_disk_hits', 0)
+    print(f"lexical cache: {hits} hits, {disk_hits} disk hits, {counters.get('lexical_cache_misses', 0)} misses")
+
+
+def print_alignment_stats(counters):
+    hits, misses = counters.get('alignment_cache_hits', 0), counters.get('alignment_cache_misses', 0)
+    print(f"alignment cache: {hits} hits, {misses} misses ({100 * hits / max(hits + misses, 1):.1f}% hit rate)")
+
+
+def word_frame(records):
+
+    """ WordRecords to a dataframe with the fixed output_columns() layout. """
+
+    processed_df = records.to_frame(output_columns())
+    processed_df['syllables_counts'] = processed_df['syllables_counts'].astype('Int64')
+    return processed_df
+
+
+def _word_key_order():
+
+    """ Order in which process_row used to add the keys of a word's feature dict. """
+
+    order = LABEL_KEYS + ['expected_text']
+    for position, (name, column, prefix, parser) in enumerate(ASR_ENGINES):
+        order += engine_columns(prefix) + [prefix + '_deleted']
+        if position == 0:
+            order += PHONEME_COLUMNS + LEXICAL_COLUMNS
+    return order + (CROSS_ENGINE_COLUMNS if lattice_features else [])
+
+
+def dict_layout_frame(records):
+
+    """
+    WordRecords to a dataframe laid out like one built from per-word feature
+    dicts, the in-memory output before WordRecords: columns in order of first
+    appearance, engine columns only when some word has them, and engine flags
+    without missing values as int64.
+    """
+
+    processed_df = records.to_frame()
+    if not len(processed_df):
+        return processed_df
+
+    # engine columns are set where the engine did not delete the word, {prefix}_deleted where it did
+    present = {}
+    for name, column, prefix, parser in ASR_ENGINES:
+        deleted = processed_df[prefix + '_deleted'].notna().to_numpy()
+        present[prefix + '_deleted'] = deleted
+        present.update({engine_column: ~deleted for engine_column in engine_columns(prefix)})
+
+    key_order = _word_key_order()
+    first_word = {column: int(present[column].argmax()) if column in present else 0
+                  for column in key_order if column not in present or present[column].any()}
+    processed_df = processed_df[sorted(first_word, key=lambda column: (first_word[column], key_order.index(column)))]
+
+    for name, column, prefix, parser in ASR_ENGINES:
+        for flag in (prefix + '_correct', prefix + '_substituted', prefix + '_deleted'):
+            if flag in processed_df and processed_df[flag].notna().all():
+                processed_df[flag] = processed_df[flag].astype('int64')
+    # missing syllable counts made the column float
+    if processed_df['syllables_counts'].isna().any():
+        processed_df['syllables_counts'] = processed_df['syllables_counts'].astype('float64')
+    return processed_df
+
+
+def join_labels(processed_df, labels_df, labels_index):
+
+    """
+    Inner join of a chunk of word features with the labels, laid out like
+    labels_df.merge(processed_df, on=LABEL_KEYS) but in the chunk's row order.
+
+    Args:
+      processed_df: word features from word_frame
+      labels_df: labels dataframe, used for its column order
+      labels_index: labels_df indexed by LABEL_KEYS
+    """
+
+    joined = processed_df.join(labels_index, on=LABEL_KEYS, how='inner', lsuffix='_y', rsuffix='_x')
+    overlap = set(labels_df.columns) & set(processed_df.columns) - set(LABEL_KEYS)
+    columns = [column + '_x' if column in overlap else column for column in labels_df.columns]
+    columns += [column + '_y' if column in overlap else column for column in processed_df.columns if column not in LABEL_KEYS]
+    return joined[columns]
+
+
+def save_processed(processed_df, args, part=0):
+
+    """
+    Write processed rows to args.save_path as CSV or as a typed Parquet
+    dataset partitioned by activityId hash. Parts after the first are
+    appended, ex. one per chunk in streaming mode.
+    """
+
+    if args.output_format == 'parquet':
+        write_parquet(processed_df, args.save_path, args.buckets, part)
+    else:
+        processed_df.to_csv(args.save_path, mode='w' if part == 0 else 'a', header=part == 0, index=False)
+
+
+def run_streaming(args, labels_df):
+
+    """
+    Streaming mode: read asr_data in chunks, join each processed chunk with
+    the labels and append it to save_path right away. Memory stays flat in
+    the size of asr_data and the output written so far is usable if the job
+    dies. Rows come out in asr_data order rather than labels order.
+    """
+
+    index = {}
+    with metrics.stage('story_index'):
+        for chunk in iter_asr_data(args.asr_data_path, args.chunksize, columns=['story_text', 'phrase_index']):
+            build_story_index(chunk, index, args.phrase_pos, args.spacy_processes)
+    print(f"Story index: {len(index)} unique phrases")
+
+    labels_index = labels_df.set_index(LABEL_KEYS)
+    worker_stats = {}
+    executor = worker_pool(args.workers, args.lexical_cache, index) if args.workers > 1 else None
+    set_story_index(index)
+
+    n_rows, n_words = 0, 0
+    try:
+        for part, chunk in enumerate(iter_asr_data(args.asr_data_path, args.chunksize)):
+            if executor is not None:
+                records = parallel_data_generation(chunk, executor, args.workers * 4, worker_stats)
+            else:
+                records = data_generation(chunk, progress=False)
+
+            with metrics.stage('merge'):
+                processed_df = join_labels(word_frame(records), labels_df, labels_index)
+                save_processed(processed_df, args, part)
+            n_rows += len(chunk)
+            n_words += len(processed_df)
+            print(f"{n_rows} rows processed, {n_words} words written")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print_worker_stats(worker_stats)
+
+
+def process_frame(asr_data_df, labels_df, args):
+
+    """ Process an in-memory asr_data dataframe and join it with the labels. """
+
+    with metrics.stage('story_index'):
+        index = build_story_index(asr_data_df, phrase_pos=args.phrase_pos, spacy_processes=args.spacy_processes)
+    print(f"Story index: {len(index)} unique phrases")
+
+    if args.workers > 1:
+        worker_stats = {}
+        with worker_pool(args.workers, args.lexical_cache, index) as executor:
+            records = parallel_data_generation(asr_data_df, executor, args.workers * 4, worker_stats)
+        print_worker_stats(worker_stats)
+    else:
+        set_story_index(index)
+        records = data_generation(asr_data_df)
+    with metrics.stage('merge'):
+        processed_df = dict_layout_frame(records)
+        return labels_df.merge(processed_df , on=LABEL_KEYS)
+
+
+def phrase_digests(asr_data_df, labels_df):
+
+    """
+    Content hash of every (activityId, phrase_index): its asr_data row(s)
+    and its labels.
+
+    Return:
+      dict: (activityId, phrase_index) -> sha1 hex digest
+    """
+
+    digests = {}
+    activity_position = asr_data_df.columns.get_loc('activityId')
+    phrase_position = asr_data_df.columns.get_loc('phrase_index')
+    for values in asr_data_df.itertuples(index=False, name=None):
+        key = (str(values[activity_position]), int(values[phrase_position]))
+        digest = digests.setdefault(key, hashlib.sha1())
+        for value in values:
+            value_digest(digest, value)
+
+    for (activity_id, phrase_index), group in labels_df.groupby(['activityId', 'phraseIndex'], sort=False):
+        digest = digests.get((str(activity_id), int(phrase_index)))
+        if digest is None:
             continue
+        for values in group.itertuples(index=False, name=None):
+            for value in values:
+                value_digest(digest, value)
+
+    return {key: digest.hexdigest() for key, digest in digests.items()}
 
-        results.extend(list(word_result.values()))
 
-    return results
+MANIFEST_FILE = '_manifest.sqlite'
+
+
+def run_incremental(args, labels_df):
+
+    """
+    Incremental mode: compare the content hash of every phrase with the
+    manifest of the previous build and process only new or changed phrases.
+    Their buckets of the Parquet output are rewritten, the others are left
+    untouched. A new pipeline, lexical or dictionary version, or another
+    --buckets, rebuilds everything.
+    """
+
+    os.makedirs(args.save_path, exist_ok=True)
+    manifest = Manifest(os.path.join(args.save_path, MANIFEST_FILE))
+    version = pipeline_version(args.buckets, args.phrase_pos, args.lattice_features)
+
+    asr_data_df = load_asr_data(args.asr_data_path)
+    digests = phrase_digests(asr_data_df, labels_df)
+    previous = manifest.load(version)
+
+    changed = {key for key, digest in digests.items() if previous.get(key) != digest}
+    removed = set(previous) - set(digests)
+    print(f"Incremental build: {len(changed)} new or changed phrases, {len(removed)} removed, "
+          f"{len(digests) - len(changed)} up to date")
+
+    if previous and not changed and not removed:
+        manifest.close()
+        return
+
+    selected = [(str(activity_id), int(phrase_index)) in changed
+                for activity_id, phrase_index in zip(asr_data_df['activityId'], asr_data_df['phrase_index'])]
+    asr_data_df = asr_data_df[selected]
+    processed_df = process_frame(asr_data_df, labels_df, args) if len(asr_data_df) else None
+
+    manifest.invalidate()
+    with metrics.stage('merge'):
+        if previous:
+            rewrite_buckets(processed_df, args.save_path, args.buckets, changed | removed)
+        elif processed_df is not None:
+            write_parquet(processed_df, args.save_path, args.buckets)
+    manifest.save(version, digests)
+    manifest.close()
 
 
 def main(args):
@@ -126,13 +758,40 @@ def main(args):
     labels_df = pd.read_csv(args.label_path)
     labels_df.expected_text = labels_df.expected_text\
                       .apply(lambda x: x.translate(remove_punct).lower())
-    asr_data_df = pd.read_csv(args.asr_data_path)
     
     print("Data Preprocessing...")
 
-    processed_df = data_generation(asr_data_df)
-    processed_df = labels_df.merge(processed_df , on=['activityId', 'phraseIndex', 'word_index'])
-    processed_df.to_csv(args.save_path, index=False)
+    init_dictionaries(args.mapping_path, args.dic_path, args.pron_dict)
+    init_lexical_store(args.lexical_cache)
+    init_alignment_cache(args.alignment_cache, args.alignment_cache_size)
+    set_lattice_features(args.lattice_features)
+
+    if args.incremental:
+        run_incremental(args, labels_df)
+    elif args.chunksize:
+        run_streaming(args, labels_df)
+    else:
+        asr_data_df = load_asr_data(args.asr_data_path)
+        save_processed(process_frame(asr_data_df, labels_df, args), args)
+
+    collect_cache_stats()
+    print_lexical_stats(metrics.counters)
+    print_alignment_stats(metrics.counters)
+    alignment_cache.close()
+    if args.profile:
+        metrics.report()
+    else:
+        metrics.report_failures()
+
+    if args.report_path:
+        metrics.write_json(args.report_path, {'asr_data_path': args.asr_data_path,
+                                              'save_path': args.save_path,
+                                              'workers': args.workers,
+                                              'mode': 'incremental' if args.incremental else 'streaming' if args.chunksize else 'in-memory'})
+    if args.prometheus_path:
+        metrics.write_prometheus(args.prometheus_path)
+    if args.failures_path:
+        metrics.write_failures(args.failures_path)
 
     print("Processed dataset saved.")
 
@@ -140,8 +799,28 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Process some strings.')
     parser.add_argument('--label_path', type=str, default="labels.csv",help='path to label dataset')
-    parser.add_argument('--asr_data_path', type=str, default="asr_data.csv", help='path to label dataset')
-    parser.add_argument('--save_path', type=str, default="processed_data.csv", help='path to save the processed dataset')
+    parser.add_argument('--asr_data_path', type=str, default="asr_data.csv", help='path to asr dataset, the original CSV or a Parquet file from asr_parser.py')
+    parser.add_argument('--save_path', type=str, default="processed_data.csv", help='path to save the processed dataset, a directory for parquet output')
+    parser.add_argument('--output_format', type=str, default='csv', choices=['csv', 'parquet'], help='processed dataset format')
+    parser.add_argument('--buckets', type=int, default=16, help='number of activityId hash partitions of the parquet output')
+    parser.add_argument('--dic_path', type=str, default=dic_file_path, help='path to the ARPABET pronunciation dictionary')
+    parser.add_argument('--mapping_path', type=str, default=json_file_path, help='path to the ARPABET to AMIRABET mapping')
+    parser.add_argument('--pron_dict', type=str, default=None, help='compiled dictionary from pron_dict.py, replaces --dic_path and --mapping_path')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes, sessions are sharded by activityId')
+    parser.add_argument('--chunksize', type=int, default=0, help='stream asr_data in chunks of this many rows, appending to save_path after each chunk')
+    parser.add_argument('--incremental', action='store_true', help='only process phrases that are new or changed since the last build, parquet output only')
+    parser.add_argument('--phrase_pos', action='store_true', help='tag POS over whole story phrases in batches instead of word by word')
+    parser.add_argument('--spacy_processes', type=int, default=1, help='spaCy processes for --phrase_pos')
+    parser.add_argument('--lexical_cache', type=str, default=None, help='SQLite file to persist lexical features between runs')
+    parser.add_argument('--alignment_cache', type=str, default=None, help='SQLite file to persist word and phoneme alignments between runs, not shared with --lexical_cache')
+    parser.add_argument('--alignment_cache_size', type=int, default=ALIGNMENT_CACHE_SIZE, help='alignments kept in memory')
+    parser.add_argument('--lattice_features', action='store_true', help='add cross-engine features from a per-phrase lattice of all ASR alignments: ' + ', '.join(CROSS_ENGINE_COLUMNS))
+    parser.add_argument('--profile', action='store_true', help='print the time spent in each pipeline stage')
+    parser.add_argument('--report_path', type=str, default=None, help='JSON run report with stage timings, counters and dropped rows')
+    parser.add_argument('--prometheus_path', type=str, default=None, help='the same metrics in Prometheus text format')
+    parser.add_argument('--failures_path', type=str, default=None, help='CSV of sampled failing (activityId, phrase_index) keys and their errors')
     args = parser.parse_args()
+    if args.incremental and args.output_format != 'parquet':
+        parser.error('--incremental requires --output_format parquet')
 
     main(args)
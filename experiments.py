@@ -0,0 +1,267 @@
+import argparse
+
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_selection import SelectKBest, f_classif
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.model_selection import GroupKFold, ParameterGrid
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+from model import load_features
+
+# Parameters of the models in model.run_experiment, a sweep overrides them.
+# threshold turns probabilities into labels, epochs/batch_size only apply to the network.
+DEFAULT_PARAMS = {'rf': {'threshold': 0.5},
+                  'xgb': {'alpha': 0.5, 'threshold': 0.5},
+                  'nn': {'epochs': 20, 'batch_size': 256, 'threshold': 0.6}
+                  }
+MODEL_FAMILIES = list(DEFAULT_PARAMS)
+
+# training matrix of the worker processes, set once by _init_worker
+_data = {}
+
+
+def load_training_data(path, feature_cache=None):
+
+    """
+    Training matrix as in model.main, plus the activityId of every row for
+    grouping the folds.
+
+    Return:
+      tuple: X (float64 array), y (int array), groups, feature column names
+    """
+
+    data_df = load_features(path, feature_cache)
+    groups = data_df['activityId'].to_numpy()
+    data = data_df.select_dtypes(include='number')
+    X = data.drop('label', axis=1)
+    return X.to_numpy(dtype=np.float64), data['label'].to_numpy(), groups, list(X.columns)
+
+
+def expand_sweep(families, sweep):
+
+    """
+    One (family, params) configuration per point of each family's grid.
+
+    Args:
+      families: model families to run
+      sweep: dict family -> {param: [values]}, families without a grid run with DEFAULT_PARAMS
+
+    Return:
+      list of (family, params)
+    """
+
+    configurations = []
+    for family in families:
+        for point in ParameterGrid(sweep.get(family, {})):
+            configurations.append((family, {**DEFAULT_PARAMS[family], **point}))
+    return configurations
+
+
+def _init_worker(X, y, threads, k):
+    # pool workers only: libraries started after this respect the limit,
+    # threadpool_limits covers the rest and is all the serial path relies on
+    for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                     'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ[variable] = str(threads)
+    _data.update(X=X, y=y, threads=threads, k=k)
+
+
+def build_model(family, params, y_train, threads):
+    params = {name: value for name, value in params.items() if name not in ('threshold', 'epochs', 'batch_size')}
+    if family == 'rf':
+        return RandomForestClassifier(n_jobs=threads, **params)
+    if family == 'xgb':
+        import xgboost as xgb
+
+        counter = Counter(y_train)
+        return xgb.XGBClassifier(scale_pos_weight=counter[0] / counter[1], eval_metric='logloss', n_jobs=threads, **params)
+    raise ValueError(f"unknown model family {family}")
+
+
+def _fit_predict(family, params, X_train, y_train, X_test, threads):
+    if family == 'nn':
+        from keras.models import Sequential
+        from keras.layers import Dense
+
+        model_nn = Sequential([
+            Dense(128, activation='relu', input_shape=(X_train.shape[1],)),
+            Dense(64, activation='relu'),
+            Dense(1, activation='sigmoid')
+        ])
+        model_nn.compile(optimizer='Adam', loss='binary_crossentropy', metrics=['accuracy'])
+        start = time.perf_counter()
+        model_nn.fit(X_train, y_train, epochs=params['epochs'], batch_size=params['batch_size'], verbose=0)
+        fit_seconds = time.perf_counter() - start
+        return model_nn.predict(X_test, verbose=0).ravel(), fit_seconds
+
+    model = build_model(family, params, y_train, threads)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    return model.predict_proba(X_test)[:, 1], fit_seconds
+
+
+def run_fold(task):
+
+    """
+    Scale, select, fit and score one configuration on one fold.
+
+    Args:
+      task: (family, params, fold, train positions, test positions)
+
+    Return:
+      dict: one record of the results file
+    """
+
+    family, params, fold, train_index, test_index = task
+    X, y, threads = _data['X'], _data['y'], _data['threads']
+
+    start = time.perf_counter()
+    with threadpool_limits(limits=threads):
+        scaler = StandardScaler()
+        X_train = scaler.fit_transform(X[train_index])
+        X_test = scaler.transform(X[test_index])
+        selector = SelectKBest(f_classif, k=min(_data['k'], X.shape[1]))
+        X_train = selector.fit_transform(X_train, y[train_index])
+        X_test = selector.transform(X_test)
+
+        probabilities, fit_seconds = _fit_predict(family, params, X_train, y[train_index], X_test, threads)
+
+    y_test = y[test_index]
+    predictions = (probabilities >= params['threshold']).astype(int)
+    return {'family': family,
+            'params': params,
+            'fold': fold,
+            'n_train': len(train_index),
+            'n_test': len(test_index),
+            'f1': f1_score(y_test, predictions),
+            'precision': precision_score(y_test, predictions, zero_division=0),
+            'recall': recall_score(y_test, predictions),
+            'accuracy': accuracy_score(y_test, predictions),
+            'roc_auc': roc_auc_score(y_test, probabilities) if len(set(y_test)) > 1 else None,
+            'fit_seconds': fit_seconds,
+            'wall_clock_seconds': time.perf_counter() - start,
+            'pid': os.getpid()
+            }
+
+
+METRICS = ['f1', 'precision', 'recall', 'accuracy', 'roc_auc']
+
+
+def summarize(runs):
+
+    """ Mean and standard deviation over folds of every configuration. """
+
+    configurations = {}
+    for run in runs:
+        key = (run['family'], json.dumps(run['params'], sort_keys=True))
+        configurations.setdefault(key, []).append(run)
+
+    summary = []
+    for (family, params), folds in configurations.items():
+        entry = {'family': family, 'params': json.loads(params), 'folds': len(folds)}
+        for metric in METRICS:
+            values = [fold[metric] for fold in folds if fold[metric] is not None]
+            entry[metric + '_mean'] = float(np.mean(values)) if values else None
+            entry[metric + '_std'] = float(np.std(values)) if values else None
+        entry['fit_seconds_total'] = sum(fold['fit_seconds'] for fold in folds)
+        entry['wall_clock_seconds_total'] = sum(fold['wall_clock_seconds'] for fold in folds)
+        summary.append(entry)
+    return sorted(summary, key=lambda entry: -(entry['roc_auc_mean'] or 0))
+
+
+def run_experiments(X, y, groups, configurations, folds=5, jobs=1, threads_per_job=1, k=22):
+
+    """
+    Grouped k-fold cross-validation of every configuration. Sessions never
+    span train and test folds. Folds and configurations run concurrently in
+    `jobs` processes, each limited to `threads_per_job` threads, so
+    jobs * threads_per_job should not exceed the number of cores.
+
+    Return:
+      list[dict]: one record per configuration and fold
+    """
+
+    splits = list(GroupKFold(n_splits=folds).split(X, y, groups))
+    tasks = [(family, params, fold, train_index, test_index)
+             for family, params in configurations
+             for fold, (train_index, test_index) in enumerate(splits)]
+
+    if jobs <= 1:
+        # in this process, so its environment is left as it is
+        _data.update(X=X, y=y, threads=threads_per_job, k=k)
+        try:
+            return [run_fold(task) for task in tasks]
+        finally:
+            _data.clear()
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(X, y, threads_per_job, k)) as executor:
+        return list(executor.map(run_fold, tasks))
+
+
+def main(args):
+
+    sweep = {}
+    if args.sweep:
+        with open(args.sweep, 'r') as file:
+            sweep = json.load(file)
+    families = args.families.split(',')
+    configurations = expand_sweep(families, sweep)
+
+    threads_per_job = args.threads_per_job
+    jobs = args.jobs or max(1, (os.cpu_count() or 1) // threads_per_job)
+
+    start = time.perf_counter()
+    X, y, groups, feature_columns = load_training_data(args.dataset_path, args.feature_cache)
+    print(f"{len(X)} rows, {len(feature_columns)} features, {len(set(groups))} sessions; "
+          f"{len(configurations)} configurations x {args.folds} folds on {jobs} jobs x {threads_per_job} threads")
+
+    runs = run_experiments(X, y, groups, configurations, args.folds, jobs, threads_per_job, args.k)
+    summary = summarize(runs)
+    wall_clock = time.perf_counter() - start
+
+    results = {'dataset_path': args.dataset_path,
+               'n_rows': len(X),
+               'feature_columns': feature_columns,
+               'k': args.k,
+               'folds': args.folds,
+               'group_by': 'activityId',
+               'jobs': jobs,
+               'threads_per_job': threads_per_job,
+               'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(time.time() - wall_clock)),
+               'wall_clock_seconds': wall_clock,
+               'summary': summary,
+               'runs': runs
+               }
+    with open(args.results_path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    for entry in summary:
+        print(f"{entry['family']:4s} {json.dumps(entry['params'], sort_keys=True)}: "
+              f"f1 {entry['f1_mean']:.3f} +- {entry['f1_std']:.3f}, roc_auc {entry['roc_auc_mean'] or 0:.3f}, "
+              f"fit {entry['fit_seconds_total']:.1f}s")
+    print(f"Results saved to {args.results_path} ({wall_clock:.1f}s).")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Grouped k-fold experiments over model families and hyperparameter sweeps.')
+    parser.add_argument('--dataset_path', type=str, default="data.csv", help='path to dataset, a CSV file or a Parquet dataset directory')
+    parser.add_argument('--results_path', type=str, default="results.json", help='path to save the results')
+    parser.add_argument('--families', type=str, default="rf,xgb", help=f"comma separated model families, from {','.join(MODEL_FAMILIES)}")
+    parser.add_argument('--sweep', type=str, default=None, help='JSON file {family: {param: [values]}} with the hyperparameter grids')
+    parser.add_argument('--feature_cache', type=str, default=None, help='directory caching engineered features by dataset fingerprint')
+    parser.add_argument('--folds', type=int, default=5, help='number of folds, grouped by activityId')
+    parser.add_argument('--k', type=int, default=22, help='number of features kept by SelectKBest')
+    parser.add_argument('--jobs', type=int, default=0, help='concurrent fold fits, default cores / threads_per_job')
+    parser.add_argument('--threads_per_job', type=int, default=1, help='threads of each fit (n_jobs, BLAS, OpenMP)')
+    args = parser.parse_args()
+
+    main(args)
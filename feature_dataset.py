@@ -0,0 +1,181 @@
+import glob
+import os
+import shutil
+import zlib
+
+import pandas as pd
+
+# Typed layout of the processed word-level dataset (data_prep.py output).
+# Correct/substituted/deleted flags are missing when an engine deleted the
+# word or matched it, they are stored as int8 with 0 for missing, the same
+# value model.py fills them with.
+KEY_COLUMNS = ['activityId', 'phraseIndex', 'word_index']
+TEXT_COLUMNS = ['expected_text_x', 'expected_text_y', 'ref_phoneme', 'hypo_phoneme']
+ENGINE_PREFIXES = ['amazon', 'kaldi', 'kaldina']
+FLAG_COLUMNS = [prefix + flag for prefix in ENGINE_PREFIXES for flag in ('_correct', '_substituted', '_deleted')]
+FLOAT_COLUMNS = ([prefix + value for prefix in ENGINE_PREFIXES for value in ('_lapse', '_confidence')]
+                 + ['phoneme_correct_rate', 'syllables_counts'])
+COLUMN_TYPES = {'phraseIndex': 'int32',
+                'word_index': 'int32',
+                'label': 'int8',
+                'word_length': 'int16',
+                'ortho_complexity': 'int8',
+                'pos_tags': 'category',
+                **{column: 'int8' for column in FLAG_COLUMNS},
+                **{column: 'float32' for column in FLOAT_COLUMNS}
+                }
+# cross-engine features of data_prep.py --lattice_features, typed when present
+LATTICE_COLUMN_TYPES = {'asr_agreement': 'float32',
+                        'timing_overlap': 'float32',
+                        'inserted_before': 'float32',
+                        'inserted_after': 'float32',
+                        'phoneme_inserted': 'int16',
+                        'phoneme_deleted': 'int16'
+                        }
+
+# activityId hash bucket, the hive partition column of the Parquet dataset
+BUCKET_COLUMN = 'bucket'
+
+
+def activity_bucket(activity_id, n_buckets):
+
+    """ Stable bucket of an activityId, the same in every process and run. """
+
+    return zlib.crc32(str(activity_id).encode('utf-8')) % n_buckets
+
+
+def typed_frame(df):
+
+    """
+    Cast a processed dataframe to the types in COLUMN_TYPES. Columns missing
+    from df are added as missing values so every part has the same schema.
+    Lattice columns are only cast, a run writes them to every part or none.
+
+    Args:
+      df: processed dataframe as written to processed_data.csv
+
+    Return:
+      pd.DataFrame: typed copy of df
+    """
+
+    df = df.copy()
+    for column, dtype in COLUMN_TYPES.items():
+        if column not in df:
+            df[column] = None
+        if column in FLAG_COLUMNS:
+            df[column] = df[column].fillna(0)
+        df[column] = df[column].astype(dtype)
+    for column, dtype in LATTICE_COLUMN_TYPES.items():
+        if column in df:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _write_buckets(df, path, n_buckets, part):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    df = typed_frame(df)
+    df[BUCKET_COLUMN] = [activity_bucket(activity_id, n_buckets) for activity_id in df['activityId']]
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(table, path, format='parquet',
+                     partitioning=ds.partitioning(pa.schema([(BUCKET_COLUMN, pa.int32())]), flavor='hive'),
+                     basename_template=f'part-{part}-{{i}}.parquet',
+                     existing_data_behavior='overwrite_or_ignore')
+
+
+def _bucket_dir(path, bucket):
+    return os.path.join(path, f'{BUCKET_COLUMN}={bucket}')
+
+
+def write_parquet(df, path, n_buckets=16, part=0):
+
+    """
+    Write processed rows into a Parquet dataset directory partitioned by
+    activityId hash (path/bucket=N/part-{part}-0.parquet). part 0 starts a
+    new dataset and removes the buckets of a previous one, later parts are
+    added next to it, ex. one per chunk in streaming mode.
+
+    Args:
+      df: processed dataframe
+      path: dataset directory
+      n_buckets: number of activityId hash buckets
+      part: index of this write
+    """
+
+    if part == 0:
+        for bucket_dir in glob.glob(_bucket_dir(path, '*')):
+            shutil.rmtree(bucket_dir)
+    _write_buckets(df, path, n_buckets, part)
+
+
+def rewrite_buckets(df, path, n_buckets, drop_keys):
+
+    """
+    Update a dataset from write_parquet in place: rows of the phrases in
+    drop_keys are removed and the rows of df are added. Only the buckets of
+    those phrases are read and rewritten.
+
+    Args:
+      df: processed dataframe of new or changed phrases, or None
+      path: dataset directory
+      n_buckets: number of activityId hash buckets the dataset was written with
+      drop_keys: set of (activityId, phraseIndex) to remove
+    """
+
+    buckets = {activity_bucket(activity_id, n_buckets) for activity_id, phrase_index in drop_keys}
+    if df is not None:
+        buckets.update(activity_bucket(activity_id, n_buckets) for activity_id in df['activityId'].unique())
+    if not buckets:
+        return
+
+    existing = read_parquet(path, buckets=sorted(buckets))
+    keep = [(str(activity_id), int(phrase_index)) not in drop_keys
+            for activity_id, phrase_index in zip(existing['activityId'], existing['phraseIndex'])]
+    combined = pd.concat([existing[keep]] + ([df] if df is not None else []), ignore_index=True)
+
+    for bucket in buckets:
+        shutil.rmtree(_bucket_dir(path, bucket), ignore_errors=True)
+    if len(combined):
+        _write_buckets(combined, path, n_buckets, 0)
+
+
+def dataset_format(path):
+
+    """ 'parquet' for a dataset directory from write_parquet, 'csv' otherwise. """
+
+    return 'parquet' if os.path.isdir(path) else 'csv'
+
+
+def dataset_columns(path):
+
+    """ Column names of a Parquet dataset, without the partition column. """
+
+    import pyarrow.dataset as ds
+
+    return [name for name in ds.dataset(path, format='parquet', partitioning='hive').schema.names
+            if name != BUCKET_COLUMN]
+
+
+def read_parquet(path, columns=None, buckets=None):
+
+    """
+    Read a Parquet dataset written by write_parquet. Only the requested
+    columns are decoded.
+
+    Args:
+      path: dataset directory
+      columns: optional list of columns to read
+      buckets: optional list of buckets to read
+
+    Return:
+      pd.DataFrame
+    """
+
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != BUCKET_COLUMN]
+    row_filter = ds.field(BUCKET_COLUMN).isin(buckets) if buckets is not None else None
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+# Bump when the layout of bundle.json or the model file changes
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE = 'bundle.json'
+MODEL_FILE = 'xgboost.ubj'
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_bundle(path, feature_columns, scaler, selector, model_xgb, metadata=None):
+
+    """
+    Save everything needed to predict without retraining: the feature
+    column order, the StandardScaler parameters, the SelectKBest mask and
+    the XGBoost model in its binary UBJ format.
+
+    Args:
+      path: bundle directory
+      feature_columns: columns of the training matrix, in order
+      scaler: fitted StandardScaler
+      selector: fitted SelectKBest
+      model_xgb: fitted XGBClassifier
+      metadata: optional JSON serializable dict stored with the bundle
+    """
+
+    import xgboost as xgb
+
+    os.makedirs(path, exist_ok=True)
+    model_path = os.path.join(path, MODEL_FILE)
+    model_xgb.get_booster().save_model(model_path)
+
+    manifest = {'format_version': BUNDLE_FORMAT_VERSION,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'xgboost_version': xgb.__version__,
+                'feature_columns': list(feature_columns),
+                'scaler_mean': scaler.mean_.tolist(),
+                'scaler_scale': scaler.scale_.tolist(),
+                'selected': selector.get_support().tolist(),
+                'model_file': MODEL_FILE,
+                'model_sha256': _file_sha256(model_path),
+                'metadata': metadata or {}
+                }
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
+class InferenceBundle:
+
+    """
+    A bundle from save_bundle, loaded once and applied to engineered
+    feature frames (the output of model.feature_engineering).
+
+    Args:
+      path: bundle directory
+    """
+
+    def __init__(self, path):
+        import xgboost as xgb
+
+        with open(os.path.join(path, MANIFEST_FILE), 'r') as file:
+            manifest = json.load(file)
+        if manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"{path} has bundle format {manifest.get('format_version')}, "
+                             f"expected {BUNDLE_FORMAT_VERSION}")
+
+        model_path = os.path.join(path, manifest['model_file'])
+        if _file_sha256(model_path) != manifest['model_sha256']:
+            raise ValueError(f"{model_path} does not match the checksum in {MANIFEST_FILE}")
+
+        self.path = path
+        self.manifest = manifest
+        self.feature_columns = manifest['feature_columns']
+        self.mean = np.asarray(manifest['scaler_mean'], dtype=np.float64)
+        self.scale = np.asarray(manifest['scaler_scale'], dtype=np.float64)
+        self.selected = np.asarray(manifest['selected'], dtype=bool)
+        self.booster = xgb.Booster()
+        self.booster.load_model(model_path)
+
+    def matrix(self, features_df):
+
+        """ Scaled and selected model input; feature columns missing from features_df are 0. """
+
+        X = features_df.reindex(columns=self.feature_columns, fill_value=0).to_numpy(dtype=np.float64)
+        return ((X - self.mean) / self.scale)[:, self.selected]
+
+    def predict_proba(self, features_df):
+
+        """ Probability of label 1 (word read correctly) for every row. """
+
+        return self.booster.inplace_predict(self.matrix(features_df))
+
+    def predict(self, features_df, threshold=0.5):
+        return (self.predict_proba(features_df) >= threshold).astype(np.int8)
@@ -0,0 +1,174 @@
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+FAILURE_FIELDS = ['activityId', 'phrase_index', 'stage', 'engine', 'error', 'message']
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PipelineMetrics:
+
+    """
+    Instrumentation of a data_prep run: wall-clock time and calls per
+    pipeline stage, event counters, and dropped rows counted by stage,
+    exception type and ASR engine. A few failing (activityId, phrase_index)
+    keys are kept per kind of failure for the side file.
+
+    Worker processes keep their own instance; snapshot() of a worker is
+    merged into the parent's with merge().
+
+    Args:
+      samples_per_failure: failing keys kept for each (stage, error, engine)
+    """
+
+    def __init__(self, samples_per_failure=20):
+        self.samples_per_failure = samples_per_failure
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self.failures = {}
+        self.samples = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as exc:
+            # the innermost stage names where a row failed, see record_failure
+            if not hasattr(exc, 'pipeline_stage'):
+                exc.pipeline_stage = name
+            raise
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_failure(self, exc, key, engine=None):
+
+        """
+        Count a dropped row.
+
+        Args:
+          exc: the exception, a PayloadError is counted under the error that
+            caused it (its error_type), whatever the input format
+          key: (activityId, phrase_index) of the row
+          engine: ASR engine being processed when the row failed, if any
+        """
+
+        cause = exc.__cause__ if exc.__cause__ is not None else exc
+        engine = getattr(exc, 'engine', engine) or '-'
+        error_type = getattr(exc, 'error_type', None) or type(cause).__name__
+        failure = (getattr(exc, 'pipeline_stage', '-'), error_type, engine)
+
+        self.failures[failure] = self.failures.get(failure, 0) + 1
+        samples = self.samples.setdefault(failure, [])
+        if len(samples) < self.samples_per_failure:
+            samples.append((key[0], key[1], str(cause)[:200]))
+
+    @property
+    def dropped_rows(self):
+        return sum(self.failures.values())
+
+    def snapshot(self):
+
+        """ Picklable state, for returning from a worker process. """
+
+        return {'seconds': self.seconds, 'calls': self.calls, 'counters': self.counters,
+                'failures': self.failures, 'samples': self.samples}
+
+    def merge(self, snapshot):
+        for name, elapsed in snapshot['seconds'].items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+        for name, calls in snapshot['calls'].items():
+            self.calls[name] = self.calls.get(name, 0) + calls
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+        for failure, rows in snapshot['failures'].items():
+            self.failures[failure] = self.failures.get(failure, 0) + rows
+        for failure, samples in snapshot['samples'].items():
+            kept = self.samples.setdefault(failure, [])
+            kept.extend(samples[:self.samples_per_failure - len(kept)])
+
+    def report(self):
+
+        """ Print the stage profile and the dropped rows. """
+
+        total = sum(self.seconds.values())
+        print("Stage profile:")
+        for name, elapsed in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            print(f"  {name:<20}{elapsed:10.2f}s {100 * elapsed / max(total, 1e-9):6.1f}%")
+        self.report_failures()
+
+    def report_failures(self):
+        if not self.failures:
+            return
+        rows = self.counters.get('rows', 0)
+        print(f"Dropped rows: {self.dropped_rows} of {rows} ({100 * self.dropped_rows / max(rows, 1):.2f}%)")
+        for (stage, error, engine), count in sorted(self.failures.items(), key=lambda item: -item[1]):
+            print(f"  {count:8d}  {stage:<18}{error:<22}{engine}")
+
+    def to_dict(self, info=None):
+
+        """ JSON serializable run report, info is stored as is. """
+
+        return {'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started)),
+                'wall_clock_seconds': time.time() - self.started,
+                'info': info or {},
+                'stages': {name: {'seconds': self.seconds[name], 'calls': self.calls.get(name, 0)}
+                           for name in sorted(self.seconds, key=lambda name: -self.seconds[name])},
+                'counters': dict(sorted(self.counters.items())),
+                'dropped_rows': self.dropped_rows,
+                'failures': [{'stage': stage, 'error': error, 'engine': engine, 'rows': rows}
+                             for (stage, error, engine), rows in sorted(self.failures.items(), key=lambda item: -item[1])]
+                }
+
+    def write_json(self, path, info=None):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(info), file, indent=2)
+
+    def prometheus_text(self, prefix='data_prep'):
+
+        """ The metrics in the Prometheus text exposition format, ex. for the node exporter textfile collector. """
+
+        lines = [f'# HELP {prefix}_stage_seconds_total Wall-clock seconds spent in a pipeline stage.',
+                 f'# TYPE {prefix}_stage_seconds_total counter']
+        lines += [f'{prefix}_stage_seconds_total{{stage="{_escape_label(name)}"}} {elapsed:.6f}'
+                  for name, elapsed in sorted(self.seconds.items())]
+        lines += [f'# HELP {prefix}_stage_calls_total Times a pipeline stage was entered.',
+                  f'# TYPE {prefix}_stage_calls_total counter']
+        lines += [f'{prefix}_stage_calls_total{{stage="{_escape_label(name)}"}} {calls}'
+                  for name, calls in sorted(self.calls.items())]
+        for name, value in sorted(self.counters.items()):
+            lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {value}']
+        lines += [f'# HELP {prefix}_dropped_rows_total Rows dropped by stage, exception type and ASR engine.',
+                  f'# TYPE {prefix}_dropped_rows_total counter']
+        lines += [f'{prefix}_dropped_rows_total{{stage="{_escape_label(stage)}",error="{_escape_label(error)}",'
+                  f'engine="{_escape_label(engine)}"}} {rows}'
+                  for (stage, error, engine), rows in sorted(self.failures.items())]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='data_prep'):
+        with open(path, 'w') as file:
+            file.write(self.prometheus_text(prefix))
+
+    def write_failures(self, path):
+
+        """ CSV of the sampled failing keys with the stage, engine and error they failed with. """
+
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(FAILURE_FIELDS)
+            for (stage, error, engine), samples in sorted(self.samples.items()):
+                for activity_id, phrase_index, message in samples:
+                    writer.writerow([activity_id, phrase_index, stage, engine, error, message])
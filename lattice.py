@@ -0,0 +1,287 @@
+import math
+import struct
+from functools import lru_cache
+
+import numpy as np
+
+from alignment import STATUS_PAD, WORD_STATUSES
+
+# Per-word features of a PhraseLattice, see PhraseLattice.cross_engine_features
+CROSS_ENGINE_COLUMNS = ['asr_agreement', 'timing_overlap', 'inserted_before', 'inserted_after',
+                        'phoneme_inserted', 'phoneme_deleted']
+
+STATUS_CODES = {status: code for code, status in enumerate(WORD_STATUSES)}
+
+# gap character of the aligned phoneme strings
+GAP = ord('*')
+
+LATTICE_MAGIC = b'PLT1'
+
+# magic, engines, reference words, hypothesis vocabulary, aligned phonemes,
+# bytes of the text block, phrase_index
+_HEADER = struct.Struct('<4sIIIIIq')
+_RECORD_LENGTH = struct.Struct('<Q')
+
+
+def _layout(n_engines, n_words, n_phonemes):
+
+    """ Arrays of a serialized lattice in storage order: name, little-endian dtype, shape. """
+
+    # widest types first, so every array starts aligned to its item size
+    return [('confidence', '<f4', (n_engines, n_words)),
+            ('duration', '<f4', (n_engines, n_words)),
+            ('start', '<f4', (n_engines, n_words)),
+            ('hypo_index', '<i4', (n_engines, n_words)),
+            ('token', '<i4', (n_engines, n_words)),
+            ('hyp_lengths', '<i4', (n_engines,)),
+            ('phoneme_offsets', '<i4', (n_words + 1,)),
+            ('phoneme_ref', '<u4', (n_phonemes,)),
+            ('phoneme_hyp', '<u4', (n_phonemes,)),
+            ('inserted', '<i2', (n_engines, n_words + 1)),
+            ('status', 'i1', (n_engines, n_words))]
+
+
+ARRAY_FIELDS = [name for name, dtype, shape in _layout(0, 0, 0)]
+
+
+def _codepoints(text):
+    return np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+
+
+@lru_cache(maxsize=None)
+def _engine_pairs(n_engines):
+    return np.triu_indices(n_engines, 1)
+
+
+class PhraseLattice:
+
+    """
+    Every ASR engine's alignment of one phrase and its wav2vec phoneme
+    alignment on one reference-word axis. Engine values are (engines, words)
+    arrays in the order of engines:
+
+      status: codes of WORD_STATUSES, STATUS_PAD where an engine has no entry
+      hypo_index: HypoIndex of the word, -1 when deleted
+      token: index of the recognized word into vocabulary, -1 when deleted
+      confidence: the engine's confidence of the recognized word, NaN when deleted
+      start, duration: time span of the recognized word, NaN when deleted or the engine has no timing
+      inserted: (engines, words + 1) hypothesis words inserted before each
+        reference word; the last column counts those after the last word
+      hyp_lengths: number of hypothesis words of each engine
+
+    The wav2vec alignment is kept as the aligned reference and hypothesis
+    phonemes (code points, "*" marks a gap) of all words concatenated, word
+    i spanning phoneme_offsets[i]:phoneme_offsets[i + 1].
+
+    Build one with PhraseLattice.build from the outputs of process_row;
+    to_bytes/from_bytes store it in a compact binary form.
+    """
+
+    __slots__ = ['activity_id', 'phrase_index', 'engines', 'ref_words', 'vocabulary'] + ARRAY_FIELDS
+
+    def __init__(self, activity_id, phrase_index, engines, ref_words, vocabulary, arrays):
+        self.activity_id = activity_id
+        self.phrase_index = phrase_index
+        self.engines = tuple(engines)
+        self.ref_words = tuple(ref_words)
+        self.vocabulary = tuple(vocabulary)
+        for name in ARRAY_FIELDS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def build(cls, activity_id, phrase_index, ref_words, asr_outputs, word_alignments, phoneme_alignment):
+
+        """
+        Lattice of one phrase, in one pass over its alignments.
+
+        Args:
+          activity_id, phrase_index: key of the phrase
+          ref_words: reference word tokens
+          asr_outputs: engine name -> ParsedASR, from parse_row
+          word_alignments: engine name -> word_level_alignment of the engine
+          phoneme_alignment: phoneme_level_alignment of the wav2vec phonemes
+
+        Return:
+          PhraseLattice
+        """
+
+        engines = tuple(asr_outputs)
+        n_engines, n_words = len(engines), len(ref_words)
+        status = np.full((n_engines, n_words), STATUS_PAD, dtype=np.int8)
+        hypo_index = np.full((n_engines, n_words), -1, dtype=np.int32)
+        token = np.full((n_engines, n_words), -1, dtype=np.int32)
+        vocabulary = {}
+        for e, engine in enumerate(engines):
+            for i, word_alignment in enumerate(word_alignments[engine][:n_words]):
+                status[e, i] = STATUS_CODES[word_alignment['Status']]
+                if word_alignment['HypoIndex'] is not None:
+                    hypo_index[e, i] = word_alignment['HypoIndex']
+                    token[e, i] = vocabulary.setdefault(word_alignment['Hypothesis Word'], len(vocabulary))
+
+        aligned = hypo_index >= 0
+        hyp_lengths = np.array([len(asr_outputs[engine].tokens) for engine in engines], dtype=np.int32)
+        values = {name: np.full((n_engines, n_words), np.nan, dtype=np.float32)
+                  for name in ('confidence', 'duration', 'start')}
+        for e, engine in enumerate(engines):
+            asr_output = asr_outputs[engine]
+            positions = hypo_index[e, aligned[e]]
+            values['confidence'][e, aligned[e]] = asr_output.confidences[positions]
+            # lapses are word durations only for engines with timings (Kaldi), not for Amazon
+            if asr_output.starts is not None:
+                values['duration'][e, aligned[e]] = asr_output.lapses[positions]
+                values['start'][e, aligned[e]] = asr_output.starts[positions]
+
+        # the gap before an aligned word is counted there, whatever is left
+        # after the last aligned word in the last column. Counts follow
+        # HypoIndex, which does not advance over insertions before the first
+        # reference word, so those land in the last column as well.
+        previous = np.maximum.accumulate(np.where(aligned, hypo_index, -1), axis=1)
+        before = np.hstack([np.full((n_engines, 1), -1, dtype=np.int32), previous[:, :-1]])
+        inserted = np.zeros((n_engines, n_words + 1), dtype=np.int16)
+        inserted[:, :n_words] = np.where(aligned, hypo_index - before - 1, 0)
+        last = previous[:, -1] if n_words else np.full(n_engines, -1)
+        inserted[:, n_words] = np.maximum(hyp_lengths - 1 - last, 0)
+
+        # phoneme words past the reference words are dropped, missing ones are empty
+        phoneme_words = phoneme_alignment[:n_words]
+        phoneme_offsets = np.zeros(n_words + 1, dtype=np.int32)
+        np.cumsum([len(word['ref_phoneme']) for word in phoneme_words], out=phoneme_offsets[1:len(phoneme_words) + 1])
+        phoneme_offsets[len(phoneme_words) + 1:] = phoneme_offsets[len(phoneme_words)]
+
+        return cls(activity_id, phrase_index, engines, ref_words, vocabulary,
+                   {'status': status,
+                    'hypo_index': hypo_index,
+                    'token': token,
+                    'inserted': inserted,
+                    'hyp_lengths': hyp_lengths,
+                    'phoneme_offsets': phoneme_offsets,
+                    'phoneme_ref': _codepoints(''.join(word['ref_phoneme'] for word in phoneme_words)),
+                    'phoneme_hyp': _codepoints(''.join(word['hypo_phoneme'] for word in phoneme_words)),
+                    **values})
+
+    def cross_engine_features(self):
+
+        """
+        Per-word features across the engines, computed on the lattice arrays:
+
+          asr_agreement: share of engine pairs that recognized the same word,
+            two deletions agree
+          timing_overlap: mean intersection over union of the recognized
+            words' time spans over the engine pairs that both have one, NaN
+            when no pair has
+          inserted_before, inserted_after: hypothesis words inserted right
+            before and after the word, averaged over the engines
+          phoneme_inserted, phoneme_deleted: wav2vec phonemes inserted and
+            deleted within the word
+
+        Return:
+          dict: CROSS_ENGINE_COLUMNS -> array with one value per reference word
+        """
+
+        first, second = _engine_pairs(len(self.engines))
+
+        end = self.start + self.duration
+        timed = np.isfinite(end[first]) & np.isfinite(end[second])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            overlap = np.minimum(end[first], end[second]) - np.maximum(self.start[first], self.start[second])
+            union = np.maximum(end[first], end[second]) - np.minimum(self.start[first], self.start[second])
+            # two zero-length spans at the same time overlap fully
+            iou = np.where(union > 0, np.maximum(overlap, 0) / union, 1)
+            timing_overlap = np.where(timed, iou, 0).sum(axis=0) / timed.sum(axis=0)
+
+        inserted = self.inserted.sum(axis=0) / max(len(self.engines), 1)
+
+        # phoneme gaps per word from the running count over the phrase
+        gaps = np.zeros((2, len(self.phoneme_ref) + 1), dtype=np.int32)
+        np.cumsum(np.stack([self.phoneme_ref == GAP, self.phoneme_hyp == GAP]), axis=1, out=gaps[:, 1:])
+        word_gaps = gaps[:, self.phoneme_offsets[1:]] - gaps[:, self.phoneme_offsets[:-1]]
+
+        return {'asr_agreement': (self.token[first] == self.token[second]).sum(axis=0) / max(len(first), 1),
+                'timing_overlap': timing_overlap,
+                'inserted_before': inserted[:-1],
+                'inserted_after': inserted[1:],
+                'phoneme_inserted': word_gaps[0],
+                'phoneme_deleted': word_gaps[1]
+                }
+
+    def to_bytes(self):
+
+        """ Binary form: a fixed header, the strings, then the raw arrays in _layout order, padded to 8 bytes. """
+
+        text = '\x00'.join([str(self.activity_id), *self.engines, *self.ref_words, *self.vocabulary]).encode('utf-8')
+        layout = _layout(len(self.engines), len(self.ref_words), len(self.phoneme_ref))
+        parts = [_HEADER.pack(LATTICE_MAGIC, len(self.engines), len(self.ref_words), len(self.vocabulary),
+                              len(self.phoneme_ref), len(text), int(self.phrase_index)),
+                 text, b'\x00' * (-len(text) % 4)]
+        parts += [np.ascontiguousarray(getattr(self, name), dtype=dtype).tobytes() for name, dtype, shape in layout]
+        # records written back to back stay aligned
+        size = sum(len(part) for part in parts)
+        parts.append(b'\x00' * (-size % 8))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+
+        """
+        Lattice stored by to_bytes at offset of data. The arrays are read-only
+        views into data; activity_id comes back as a string.
+        """
+
+        magic, n_engines, n_words, n_vocabulary, n_phonemes, text_length, phrase_index = _HEADER.unpack_from(data, offset)
+        if magic != LATTICE_MAGIC:
+            raise ValueError(f"not a phrase lattice, magic {magic!r}")
+        offset += _HEADER.size
+        text = bytes(data[offset:offset + text_length]).decode('utf-8').split('\x00')
+        offset += text_length + (-text_length % 4)
+
+        arrays = {}
+        for name, dtype, shape in _layout(n_engines, n_words, n_phonemes):
+            count = math.prod(shape)
+            arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape)
+            offset += count * np.dtype(dtype).itemsize
+
+        engines = text[1:1 + n_engines]
+        ref_words = text[1 + n_engines:1 + n_engines + n_words]
+        vocabulary = text[1 + n_engines + n_words:]
+        if len(vocabulary) != n_vocabulary:
+            raise ValueError(f"lattice text holds {len(vocabulary)} hypothesis words, the header says {n_vocabulary}")
+        return cls(text[0], phrase_index, engines, ref_words, vocabulary, arrays)
+
+    def __reduce__(self):
+        return _from_bytes, (self.to_bytes(),)
+
+    def __repr__(self):
+        return (f"PhraseLattice(activity_id={self.activity_id!r}, phrase_index={self.phrase_index}, "
+                f"engines={self.engines}, words={len(self.ref_words)})")
+
+
+def _from_bytes(data):
+    return PhraseLattice.from_bytes(data)
+
+
+def write_lattices(path, lattices):
+
+    """ Write lattices to a file, each record prefixed with its length. Return the number written. """
+
+    n_lattices = 0
+    with open(path, 'wb') as file:
+        for lattice in lattices:
+            record = lattice.to_bytes()
+            file.write(_RECORD_LENGTH.pack(len(record)))
+            file.write(record)
+            n_lattices += 1
+    return n_lattices
+
+
+def read_lattices(path):
+
+    """ Iterate over the lattices of a file from write_lattices. """
+
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset < len(data):
+        (length,) = _RECORD_LENGTH.unpack_from(data, offset)
+        offset += _RECORD_LENGTH.size
+        yield PhraseLattice.from_bytes(data, offset)
+        offset += length
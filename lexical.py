@@ -1,20 +1,73 @@
-import nltk
+import argparse
 
-nltk.download('punkt')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('cmudict')
-nltk.download('wordnet')
+from cache import LRUCache
 
-from nltk import word_tokenize
-from nltk.corpus import cmudict, wordnet
+# NLTK data used by this module and by alignment.py. Nothing is downloaded
+# at import time, run `python lexical.py --download` once on a machine with
+# network access (or ship nltk_data to the workers).
+NLTK_RESOURCES = {'punkt': 'tokenizers/punkt',
+                  'averaged_perceptron_tagger': 'taggers/averaged_perceptron_tagger',
+                  'cmudict': 'corpora/cmudict',
+                  'wordnet': 'corpora/wordnet'
+                  }
 
-import spacy
+SPACY_MODEL = "en_core_web_sm"
 
-# Load Spacy for Part of Speech
-en_nlp = spacy.load("en_core_web_sm")
+# spaCy pipeline and CMU dictionary, loaded on first use or by init()
+_en_nlp = None
+_cmu_dict = None
 
-# Load CMU Pronouncing Dictionary for syllable counting
-d = cmudict.dict()
+
+def get_nlp():
+
+    """ spaCy pipeline for Part of Speech, loaded once per process. """
+
+    global _en_nlp
+    if _en_nlp is None:
+        import spacy
+        _en_nlp = spacy.load(SPACY_MODEL)
+    return _en_nlp
+
+
+def get_cmudict():
+
+    """ CMU Pronouncing Dictionary for syllable counting, resolved from local nltk_data only. """
+
+    global _cmu_dict
+    if _cmu_dict is None:
+        import nltk
+        try:
+            nltk.data.find(NLTK_RESOURCES['cmudict'])
+        except LookupError:
+            raise LookupError("NLTK resource 'cmudict' is not installed, run `python lexical.py --download` "
+                              "on a machine with network access") from None
+        from nltk.corpus import cmudict
+        _cmu_dict = cmudict.dict()
+    return _cmu_dict
+
+
+def init():
+
+    """
+    Load the spaCy pipeline and the CMU dictionary now instead of on first
+    use, ex. in a worker initializer. Safe to call more than once.
+    """
+
+    get_nlp()
+    get_cmudict()
+
+
+def download_resources():
+
+    """ Download the NLTK data this repository needs. Never called implicitly. """
+
+    import nltk
+    for resource in NLTK_RESOURCES:
+        nltk.download(resource)
+
+
+# Bump when any feature below changes so on-disk caches are not reused
+LEXICAL_FEATURES_VERSION = 1
 
 def nsyl(word):
 
@@ -28,6 +81,7 @@ def nsyl(word):
       int: the number of the syllabels
     """
     
+    d = get_cmudict()
     if word.lower() in d:
         return [len(list(y for y in x if y[-1].isdigit())) for x in d[word.lower()]][0]
     else:
@@ -49,7 +103,7 @@ def morphological_pos(word):
 
     """
     
-    doc  = en_nlp(word)
+    doc  = get_nlp()(word)
     results = []
     for token in doc:
 
@@ -62,6 +116,50 @@ def morphological_pos(word):
     
     return pos
 
+# Pipeline components that produce POS and morphology, the rest is
+# disabled when tagging whole phrases
+POS_COMPONENTS = ['tok2vec', 'tagger', 'morphologizer', 'attribute_ruler']
+
+def token_pos(token):
+
+    """
+    morphological_pos of a token tagged in context. Falls back to the bare
+    POS when the Number/VerbForm feature is missing.
+    """
+
+    pos = token.pos_
+    if pos == "NOUN":
+        form = token.morph.get("Number")
+    elif pos == "VERB":
+        form = token.morph.get("VerbForm")
+    else:
+        return pos
+    return pos + "_" + form[0] if form else pos
+
+def phrase_pos_tags(phrases, batch_size=256, n_process=1):
+
+    """
+    POS of every word of every phrase in one batched spaCy pass, with the
+    words tagged in their sentence context. Phrases are given as word
+    lists and are not re-tokenized, so the tags line up with word_index.
+
+    Args:
+      phrases: list of word lists, ex. the ref_words of the story phrases
+      batch_size: phrases per spaCy batch
+      n_process: spaCy worker processes
+
+    Return:
+      list[list[str]]: per phrase, the POS of each word as in morphological_pos
+    """
+
+    from spacy.tokens import Doc
+
+    nlp = get_nlp()
+    disable = [name for name in nlp.pipe_names if name not in POS_COMPONENTS]
+    docs = (Doc(nlp.vocab, words=list(words)) for words in phrases)
+    return [[token_pos(token) for token in doc]
+            for doc in nlp.pipe(docs, batch_size=batch_size, n_process=n_process, disable=disable)]
+
 def orthographic_complexity(word):
 
     """
@@ -95,6 +193,12 @@ def orthographic_complexity(word):
 
     return complexity_score
 
+def normalize_word(word):
+
+    """ Normalize a word into the key used by the lexical feature store. """
+
+    return word.strip().lower()
+
 def get_lexical_features(word):
 
     """
@@ -117,3 +221,69 @@ def get_lexical_features(word):
     return {'word_length': word_length, 'syllables_counts': syllables_counts,\
             'pos_tags': pos_tags, 'ortho_complexity': ortho
             }
+
+
+def get_phrase_lexical_features(words, pos_tags):
+
+    """
+    get_lexical_features for the words of a phrase, with POS tags from
+    phrase_pos_tags instead of one spaCy call per word.
+
+    Return:
+      list[dict]: same keys as get_lexical_features, one dict per word
+    """
+
+    return [{'word_length': len(word), 'syllables_counts': nsyl(word),
+             'pos_tags': pos, 'ortho_complexity': orthographic_complexity(word)
+             } for word, pos in zip(words, pos_tags)]
+
+
+class LexicalFeatureStore:
+
+    """
+    Lexical features keyed by normalized word. Story vocabularies are small
+    and closed, so after the first pass nearly every lookup is a cache hit
+    and spaCy is not invoked again. Pass a path to keep the features in a
+    SQLite file between runs.
+
+    Args:
+      maxsize: number of words kept in the in-memory LRU
+      path: optional SQLite file for the on-disk cache
+    """
+
+    def __init__(self, maxsize=50000, path=None):
+        self.cache = LRUCache(maxsize=maxsize, path=path, table=f'lexical_features_v{LEXICAL_FEATURES_VERSION}')
+
+    def get(self, word):
+
+        """
+        Args:
+          word: the word to process
+        
+        Return:
+          dict: same as get_lexical_features
+        """
+
+        word = normalize_word(word)
+        return dict(self.cache.get_or_compute(word, lambda: get_lexical_features(word)))
+
+    def stats(self):
+        return self.cache.stats()
+
+    def reset_stats(self):
+        self.cache.reset_stats()
+
+    def close(self):
+        self.cache.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Manage the resources used for lexical features.')
+    parser.add_argument('--download', action='store_true', help='download the required NLTK data')
+    args = parser.parse_args()
+
+    if args.download:
+        download_resources()
+    init()
+    print("Lexical resources are available.")
@@ -0,0 +1,76 @@
+import sqlite3
+
+import numpy as np
+
+
+def value_digest(digest, value):
+
+    """ Feed one cell into a sha1, arrays by their bytes so nothing is truncated. """
+
+    if isinstance(value, np.ndarray):
+        digest.update(str(value.dtype).encode('utf-8'))
+        digest.update(value.tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            value_digest(digest, item)
+            digest.update(b',')
+        digest.update(b']')
+    else:
+        digest.update(repr(value).encode('utf-8'))
+        digest.update(b'\x1f')
+
+
+class Manifest:
+
+    """
+    Record of what an incremental build has written: a content hash per
+    (activityId, phrase_index) and the version of the pipeline that produced
+    it. Stored in a SQLite file next to the output.
+
+    Args:
+      path: SQLite file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS phrases (activity_id TEXT, phrase_index INTEGER, digest TEXT, '
+                           'PRIMARY KEY (activity_id, phrase_index))')
+        self._conn.commit()
+
+    def version(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row is not None else None
+
+    def load(self, version):
+
+        """
+        Return:
+          dict: (activityId, phrase_index) -> digest, empty if the manifest
+          was written by another version and everything must be rebuilt
+        """
+
+        if self.version() != version:
+            return {}
+        return {(activity_id, phrase_index): digest for activity_id, phrase_index, digest
+                in self._conn.execute('SELECT activity_id, phrase_index, digest FROM phrases')}
+
+    def invalidate(self):
+
+        """ Forget the version before the output is modified, so an interrupted build is redone in full. """
+
+        self._conn.execute("DELETE FROM meta WHERE key = 'version'")
+        self._conn.commit()
+
+    def save(self, version, digests):
+        with self._conn:
+            self._conn.execute('DELETE FROM phrases')
+            self._conn.executemany('INSERT INTO phrases (activity_id, phrase_index, digest) VALUES (?, ?, ?)',
+                                   [(activity_id, phrase_index, digest)
+                                    for (activity_id, phrase_index), digest in digests.items()])
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+
+    def close(self):
+        self._conn.close()
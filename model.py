@@ -1,3 +1,6 @@
+import os
+import hashlib
+import numpy as np
 import pandas as pd
 import argparse
 from sklearn.preprocessing import StandardScaler
@@ -7,47 +10,186 @@ from sklearn.feature_selection import SelectKBest, f_classif
 from sklearn.model_selection import train_test_split
 
 import xgboost as xgb
-from keras.models import Sequential
-from keras.layers import Dense
 from collections import Counter
 
+from feature_dataset import TEXT_COLUMNS, dataset_columns, dataset_format, read_parquet
+from inference_bundle import save_bundle
+
+def _training_columns(path):
+    if dataset_format(path) == 'parquet':
+        columns = dataset_columns(path)
+    else:
+        columns = pd.read_csv(path, nrows=0).columns
+    return [column for column in columns if column not in TEXT_COLUMNS]
+
+def load_dataset(path):
+
+    """
+    Read the processed dataset, either processed_data.csv or the Parquet
+    dataset directory from `data_prep.py --output_format parquet`. Only the
+    columns used for training are read.
+    """
+
+    if dataset_format(path) == 'parquet':
+        return read_parquet(path, _training_columns(path))
+    return pd.read_csv(path, usecols=_training_columns(path))
+
+def iter_dataset(path, chunksize):
+
+    """ load_dataset in chunks of about chunksize rows. """
+
+    if dataset_format(path) == 'parquet':
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(path, format='parquet', partitioning='hive')
+        # files hold one bucket of one write each, batches are coalesced up to chunksize
+        batches, n_rows = [], 0
+        for batch in dataset.to_batches(columns=_training_columns(path), batch_size=chunksize):
+            batches.append(batch)
+            n_rows += batch.num_rows
+            if n_rows >= chunksize:
+                yield pa.Table.from_batches(batches).to_pandas()
+                batches, n_rows = [], 0
+        if batches:
+            yield pa.Table.from_batches(batches).to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=_training_columns(path))
+
+# Bump when feature_engineering output changes, invalidates the feature cache
+FEATURE_ENGINEERING_VERSION = 2
+
+# POS tags flagged by the pos_tags feature
+FLAGGED_POS = ['PROPN', 'X', 'NOUN_Plur', 'VERB_Fin']
+
+PHRASE_KEYS = ['activityId', 'phraseIndex']
+
+def _mean_of_three(a, b, c):
+    return ((a + b + c) / 3).astype('float32')
+
 def feature_engineering(df):
 
+    """
+    Phrase-level and cross-engine features. Vectorized: the phrase length
+    is a groupby transform and POS tags are flagged through their
+    categorical codes; derived columns are float32. The input is not
+    modified.
+
+    Args:
+      df: processed dataset, missing values already filled
+
+    Return:
+      pd.DataFrame: df with the engineered columns, index reset
+    """
+
+    df = df.copy(deep=False)
+
     # get word position percentage
-    max_indices = df.groupby(['activityId', 'phraseIndex'])['word_index'].max().reset_index()
-    max_indices.rename(columns={'word_index': 'phrase_length'}, inplace=True)
-    df = pd.merge(df, max_indices, how='left', on=['activityId', 'phraseIndex'])
-    df['phrase_length'] = df['phrase_length'] + 1
-    df['word_index'] = (df['word_index']/ df['phrase_length'])
+    df['phrase_length'] = df.groupby(PHRASE_KEYS, sort=False)['word_index'].transform('max') + 1
+    df['word_index'] = (df['word_index'] / df['phrase_length']).astype('float32')
 
     # correct score rate
-    df['overall_correct_score'] = (df['amazon_correct'] + df['kaldi_correct'] + df['kaldina_correct']) / 3
+    df['overall_correct_score'] = _mean_of_three(df['amazon_correct'], df['kaldi_correct'], df['kaldina_correct'])
 
     # correct score rate with confidence
-    df['overall_correct_score_confidence'] = (df['amazon_correct'] * df['amazon_confidence'] \
-                                            + df['kaldi_correct'] * df['kaldi_confidence'] \
-                                            + df['kaldina_correct'] * df['kaldina_confidence']) / 3
+    df['overall_correct_score_confidence'] = _mean_of_three(df['amazon_correct'] * df['amazon_confidence'],
+                                                            df['kaldi_correct'] * df['kaldi_confidence'],
+                                                            df['kaldina_correct'] * df['kaldina_confidence'])
     
     # substitute score rate
-    df['overall_substituted_score'] = (df['amazon_substituted'] + df['kaldi_substituted'] + df['kaldina_substituted']) / 3
+    df['overall_substituted_score'] = _mean_of_three(df['amazon_substituted'], df['kaldi_substituted'], df['kaldina_substituted'])
 
     # substitute score rate
-    df['overall_deleted_score'] = (df['amazon_deleted'] + df['kaldi_deleted'] + df['kaldina_deleted']) / 3
+    df['overall_deleted_score'] = _mean_of_three(df['amazon_deleted'], df['kaldi_deleted'], df['kaldina_deleted'])
 
     # substitute lapse rate
-    df['overall_lapse'] = (df['amazon_lapse'] + df['kaldi_lapse'] + df['kaldina_lapse']) / 3
-
-    # pos
-    df['pos_tags'] = df['pos_tags'].apply(lambda x: 1 if x in ['PROPN', 'X', 'NOUN_Plur', 'VERB_Fin'] else 0)
-
-    return df
+    df['overall_lapse'] = _mean_of_three(df['amazon_lapse'], df['kaldi_lapse'], df['kaldina_lapse'])
+
+    # pos, looked up once per category instead of once per row
+    pos_tags = df['pos_tags'].astype('category').cat
+    flagged = np.append(pos_tags.categories.isin(FLAGGED_POS), False).astype('int8')
+    df['pos_tags'] = flagged[pos_tags.codes.to_numpy()]
+
+    return df.reset_index(drop=True)
+
+def iter_phrase_chunks(chunks):
+
+    """
+    Re-chunk so that no phrase is split between two chunks, which
+    feature_engineering needs for the phrase length. The rows of the last
+    phrase of a chunk are carried over to the next one; the rows of a
+    phrase are expected to be contiguous, as data_prep.py writes them.
+    """
+
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+        last_phrase = (chunk['activityId'] == chunk['activityId'].iloc[-1]) & (chunk['phraseIndex'] == chunk['phraseIndex'].iloc[-1])
+        carry = chunk[last_phrase]
+        if not last_phrase.all():
+            yield chunk[~last_phrase]
+    if carry is not None and len(carry):
+        yield carry
+
+def iter_features(chunks):
+
+    """ feature_engineering over a stream of dataset chunks, see iter_phrase_chunks. """
+
+    for chunk in iter_phrase_chunks(chunks):
+        yield feature_engineering(chunk.fillna(0))
+
+def dataset_fingerprint(path):
+
+    """ sha1 over the contents of a CSV file or of the files of a Parquet dataset directory. """
+
+    if dataset_format(path) == 'parquet':
+        files = sorted(os.path.relpath(os.path.join(root, name), path)
+                       for root, dirs, names in os.walk(path) for name in names
+                       if not name.startswith(('_', '.')))
+    else:
+        files = [os.path.basename(path)]
+        path = os.path.dirname(path)
+
+    digest = hashlib.sha1(f'feature_engineering-{FEATURE_ENGINEERING_VERSION}'.encode('utf-8'))
+    for name in files:
+        digest.update(name.encode('utf-8'))
+        with open(os.path.join(path, name), 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def load_features(path, cache_dir=None, chunksize=None):
+
+    """
+    load_dataset, fillna(0) and feature_engineering, in chunks when
+    chunksize is given. With cache_dir the result is stored as Parquet
+    under the dataset fingerprint and reused while the input is unchanged.
+    """
+
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f'features-{dataset_fingerprint(path)}.parquet')
+        if os.path.exists(cache_path):
+            return pd.read_parquet(cache_path)
+
+    if chunksize:
+        data_df = pd.concat(iter_features(iter_dataset(path, chunksize)), ignore_index=True)
+    else:
+        data_df = feature_engineering(load_dataset(path).fillna(0))
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        data_df.to_parquet(cache_path, index=False)
+    return data_df
 
 def feature_selection(X_train, y_train, X_test, k=22):
     selector = SelectKBest(f_classif, k=k)
     X_train_selected = selector.fit_transform(X_train, y_train)
     X_test_selected = selector.transform(X_test)
     
-    return X_train_selected, X_test_selected
+    return X_train_selected, X_test_selected, selector
 
 
 def run_experiment(X_train_selected, y_train):
@@ -64,7 +206,10 @@ def run_experiment(X_train_selected, y_train):
     model_xgb = xgb.XGBClassifier(scale_pos_weight=estimate, use_label_encoder=False, eval_metric='logloss', alpha=0.5)
     model_xgb.fit(X_train_selected, y_train)
 
-    # Deep Neural Network
+    # Deep Neural Network, keras is only imported when a network is trained
+    from keras.models import Sequential
+    from keras.layers import Dense
+
     model_nn = Sequential([
         Dense(128, activation='relu', input_shape=(X_train_selected.shape[1],)),
         Dense(64, activation='relu'),
@@ -85,9 +230,7 @@ def evaluate_model(model, X_test, y_test):
 
 def main(args):
 
-    data_df = pd.read_csv(args.dataset_path)
-    data_df = data_df.fillna(0)
-    data_df = feature_engineering(data_df)
+    data_df = load_features(args.dataset_path, args.feature_cache, args.chunksize)
     data = data_df.select_dtypes(include='number')
 
     X = data.drop('label', axis=1)
@@ -100,10 +243,17 @@ def main(args):
     X_train = scaler.fit_transform(X_train)
     X_test = scaler.transform(X_test)
 
-    X_train_selected, X_test_selected = feature_selection(X_train, y_train, X_test)
+    X_train_selected, X_test_selected, selector = feature_selection(X_train, y_train, X_test)
 
     # experiment
     model_rf, model_xgb, model_nn = run_experiment(X_train_selected, y_train)
+    if args.save_dir:
+        save_bundle(args.save_dir, X.columns, scaler, selector, model_xgb,
+                    metadata={'dataset_path': args.dataset_path,
+                              'dataset_format': dataset_format(args.dataset_path),
+                              'train_rows': len(X_train),
+                              'phrase_pos': args.phrase_pos,
+                              'feature_engineering_version': FEATURE_ENGINEERING_VERSION})
 
     print("Evaluation:\n")
 
@@ -128,7 +278,11 @@ def main(args):
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('--dataset_path', type=str, default="data.csv",help='path to dataset')
+    parser.add_argument('--dataset_path', type=str, default="data.csv",help='path to dataset, a CSV file or a Parquet dataset directory')
+    parser.add_argument('--feature_cache', type=str, default=None, help='directory caching engineered features by dataset fingerprint')
+    parser.add_argument('--chunksize', type=int, default=None, help='read and engineer the dataset in chunks of this many rows')
+    parser.add_argument('--phrase_pos', action='store_true', help='the dataset was prepared with data_prep.py --phrase_pos, scoring.py then tags POS the same way')
+    parser.add_argument('--save_dir', type=str, default=None, help='directory to save the inference bundle (scaler, feature mask, XGBoost model) for predict.py and scoring.py')
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,48 @@
+import argparse
+
+import time
+
+import numpy as np
+
+from feature_dataset import KEY_COLUMNS, dataset_format
+from inference_bundle import InferenceBundle
+from model import feature_engineering, iter_dataset, iter_phrase_chunks
+
+
+def main(args):
+
+    bundle = InferenceBundle(args.bundle_path)
+    print(f"Bundle: {len(bundle.feature_columns)} features, {int(bundle.selected.sum())} selected, created {bundle.manifest['created']}")
+
+    # float32 Parquet features round differently from CSV ones, and trees split exactly on training values
+    trained_on = bundle.manifest['metadata'].get('dataset_format')
+    predicting_on = dataset_format(args.dataset_path)
+    if trained_on and trained_on != predicting_on:
+        print(f"Warning: the bundle was trained on {trained_on} data, predicting on {predicting_on}; "
+              f"predictions near split thresholds may differ")
+
+    start = time.perf_counter()
+    n_rows = 0
+    for chunk in iter_phrase_chunks(iter_dataset(args.dataset_path, args.chunksize)):
+        predictions_df = chunk[KEY_COLUMNS + (['label'] if 'label' in chunk else [])].reset_index(drop=True)
+        probabilities = bundle.predict_proba(feature_engineering(chunk.fillna(0)))
+        predictions_df['probability'] = probabilities
+        predictions_df['prediction'] = (probabilities >= args.threshold).astype(np.int8)
+        predictions_df.to_csv(args.save_path, mode='w' if n_rows == 0 else 'a', header=n_rows == 0, index=False)
+        n_rows += len(chunk)
+
+    elapsed = time.perf_counter() - start
+    print(f"{n_rows} rows in {elapsed:.2f}s ({n_rows / max(elapsed, 1e-9):.0f} rows/sec)")
+    print("Predictions saved.")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Predict word labels of a processed dataset with an inference bundle.')
+    parser.add_argument('--bundle_path', type=str, default="model", help='inference bundle saved by model.py --save_dir')
+    parser.add_argument('--dataset_path', type=str, default="processed_data.csv", help='processed dataset, a CSV file or a Parquet dataset directory')
+    parser.add_argument('--save_path', type=str, default="predictions.csv", help='path to save the predictions')
+    parser.add_argument('--chunksize', type=int, default=100000, help='rows read at a time')
+    parser.add_argument('--threshold', type=float, default=0.5, help='probability from which a word is labelled as read correctly')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,187 @@
+import argparse
+
+import hashlib
+import json
+import mmap
+import struct
+import zlib
+
+
+# File layout, little endian:
+#   header: magic, format version, number of words, number of hash slots,
+#           sha1 of the source .dic and mapping files
+#   slots:  n_slots x (word offset, word length, pronunciation offset, pronunciation length),
+#           open addressing on crc32(word) with linear probing, empty slots have word length 0
+#   blob:   UTF-8 words and AMIRABET pronunciations, offsets are relative to the blob
+MAGIC = b'AMPD'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sIII20s')
+SLOT = struct.Struct('<IIII')
+
+
+def iter_dic(dic_path):
+
+    """ Yield (word, ARPABET phonemes) from a CMU style "WORD PH1 PH2 ..." file. """
+
+    with open(dic_path, 'r') as file:
+        for line in file:
+            parts = line.strip().split()
+            word = parts[0]
+            phonemes = parts[1:]
+            yield word, phonemes
+
+
+def read_dic(dic_path):
+
+    """
+    Parse a pronunciation dictionary. A word listed twice keeps its last
+    pronunciation.
+
+    Return:
+      dict: word -> list of ARPABET phonemes
+    """
+
+    return dict(iter_dic(dic_path))
+
+
+def to_amirabet(arpabet_phonemes, arpabet_to_amirabet):
+
+    """ ARPABET phonemes to an AMIRABET string, unmapped symbols are dropped. """
+
+    return ''.join(arpabet_to_amirabet[ph] for ph in arpabet_phonemes if ph in arpabet_to_amirabet)
+
+
+def load_pronunciations(dic_path, json_path):
+
+    """
+    Read the dictionary and convert every pronunciation to AMIRABET once.
+
+    Return:
+      dict: word -> AMIRABET string
+    """
+
+    with open(json_path, 'r') as file:
+        arpabet_to_amirabet = json.load(file)
+    return {word: to_amirabet(phonemes, arpabet_to_amirabet) for word, phonemes in iter_dic(dic_path)}
+
+
+def dictionary_fingerprint(dic_path, json_path):
+
+    """ sha1 over the contents of the pronunciation dictionary and the mapping. """
+
+    digest = hashlib.sha1()
+    for path in (dic_path, json_path):
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+    return digest.digest()
+
+
+def _slot(key, n_slots):
+    return zlib.crc32(key) % n_slots
+
+
+def compile_dictionary(dic_path, json_path, save_path):
+
+    """
+    Compile the .dic file and the ARPABET to AMIRABET mapping into the
+    binary format read by PronunciationDict.
+
+    Return:
+      int: number of words written
+    """
+
+    pronunciations = load_pronunciations(dic_path, json_path)
+    n_slots = max(2 * len(pronunciations), 1)
+
+    slots = [(0, 0, 0, 0)] * n_slots
+    blob = bytearray()
+    for word, phonemes in pronunciations.items():
+        key = word.encode('utf-8')
+        value = phonemes.encode('utf-8')
+        position = _slot(key, n_slots)
+        while slots[position][1]:
+            position = (position + 1) % n_slots
+        slots[position] = (len(blob), len(key), len(blob) + len(key), len(value))
+        blob += key + value
+
+    with open(save_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(pronunciations), n_slots,
+                               dictionary_fingerprint(dic_path, json_path)))
+        for slot in slots:
+            file.write(SLOT.pack(*slot))
+        file.write(blob)
+    return len(pronunciations)
+
+
+class PronunciationDict:
+
+    """
+    Read-only word -> AMIRABET mapping backed by a file from
+    compile_dictionary. The file is memory-mapped, so processes on the same
+    machine share its pages and nothing is parsed at load time.
+
+    Args:
+      path: compiled dictionary file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._n_words, self._n_slots, self.fingerprint = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a compiled pronunciation dictionary (version {FORMAT_VERSION})")
+        self._slots_offset = HEADER.size
+        self._blob_offset = HEADER.size + self._n_slots * SLOT.size
+
+    def get(self, word, default=None):
+        key = word.encode('utf-8')
+        mm = self._mm
+        blob = self._blob_offset
+        position = _slot(key, self._n_slots)
+        while True:
+            word_offset, word_length, value_offset, value_length = SLOT.unpack_from(mm, self._slots_offset + position * SLOT.size)
+            if not word_length:
+                return default
+            if word_length == len(key) and mm[blob + word_offset:blob + word_offset + word_length] == key:
+                return mm[blob + value_offset:blob + value_offset + value_length].decode('utf-8')
+            position = (position + 1) % self._n_slots
+
+    def __getitem__(self, word):
+        value = self.get(word)
+        if value is None:
+            raise KeyError(word)
+        return value
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __len__(self):
+        return self._n_words
+
+    def close(self):
+        self._mm.close()
+
+    def __getstate__(self):
+        # reopen the mapping in the receiving process instead of copying it
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+def main(args):
+
+    n_words = compile_dictionary(args.dic_path, args.mapping_path, args.save_path)
+    print(f"Compiled {n_words} words into {args.save_path}.")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compile the pronunciation dictionary into a memory-mappable file.')
+    parser.add_argument('--dic_path', type=str, default="all_story_words.dic", help='path to the ARPABET pronunciation dictionary')
+    parser.add_argument('--mapping_path', type=str, default="arpabet_to_amirabet.json", help='path to the ARPABET to AMIRABET mapping')
+    parser.add_argument('--save_path', type=str, default="all_story_words.ampd", help='path to save the compiled dictionary')
+    args = parser.parse_args()
+
+    main(args)
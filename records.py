@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+# Column kinds of WordRecords: float64 with NaN for missing values, int64
+# with a mask of missing values, or Python objects (text) with None
+FLOAT, INT, OBJECT = 'float', 'int', 'object'
+
+
+class WordRecords:
+
+    """
+    Columnar builder of word feature records, used instead of one dict per
+    word. Numeric columns are preallocated NumPy arrays grown by doubling:
+    FLOAT columns start as NaN, so a value that is never set (ex. the
+    confidence of an engine that deleted the word) stays missing, INT
+    columns keep a mask of missing values. OBJECT columns are lists of
+    references to the row's strings. Rows are added a phrase at a time.
+
+    to_frame hands the numeric arrays to pandas without copying them.
+
+    Args:
+      schema: dict column -> FLOAT, INT or OBJECT, in output order
+      capacity: rows to preallocate
+    """
+
+    __slots__ = ('schema', 'size', 'capacity', '_values', '_missing')
+
+    def __init__(self, schema, capacity=1024):
+        self.schema = dict(schema)
+        self.size = 0
+        self.capacity = max(capacity, 1)
+        self._values = {}
+        self._missing = {}
+        for column, kind in self.schema.items():
+            if kind == FLOAT:
+                self._values[column] = np.full(self.capacity, np.nan)
+            elif kind == INT:
+                self._values[column] = np.zeros(self.capacity, dtype=np.int64)
+                self._missing[column] = np.ones(self.capacity, dtype=bool)
+            else:
+                self._values[column] = []
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, n_rows):
+        if self.size + n_rows <= self.capacity:
+            return
+        capacity = max(2 * self.capacity, self.size + n_rows)
+        for column, kind in self.schema.items():
+            if kind == OBJECT:
+                continue
+            grown = np.full(capacity, np.nan) if kind == FLOAT else np.zeros(capacity, dtype=np.int64)
+            grown[:self.size] = self._values[column][:self.size]
+            self._values[column] = grown
+            if kind == INT:
+                missing = np.ones(capacity, dtype=bool)
+                missing[:self.size] = self._missing[column][:self.size]
+                self._missing[column] = missing
+        self.capacity = capacity
+
+    def append(self, n_rows, columns):
+
+        """
+        Add n_rows rows. Every column is converted before any is stored, so
+        a value that does not fit its column (ex. NaN in an INT column)
+        raises without adding anything.
+
+        Args:
+          n_rows: number of rows added
+          columns: dict column -> sequence of n_rows values or a single value
+            for all of them; columns left out stay missing, None is missing
+            in INT columns
+        """
+
+        converted = {}
+        for column, values in columns.items():
+            kind = self.schema[column]
+            if kind == OBJECT:
+                values = list(values) if isinstance(values, (list, tuple)) else [values] * n_rows
+                if len(values) != n_rows:
+                    raise ValueError(f"{column}: {len(values)} values for {n_rows} rows")
+                converted[column] = values, None
+            elif kind == INT:
+                missing = np.zeros(n_rows, dtype=bool)
+                if isinstance(values, (list, tuple)) and None in values:
+                    missing[:] = [value is None for value in values]
+                    values = [0 if value is None else value for value in values]
+                converted_values = np.empty(n_rows, dtype=np.int64)
+                converted_values[:] = values
+                converted[column] = converted_values, missing
+            else:
+                converted_values = np.empty(n_rows, dtype=np.float64)
+                converted_values[:] = values
+                converted[column] = converted_values, None
+
+        self._reserve(n_rows)
+        start, end = self.size, self.size + n_rows
+        for column, kind in self.schema.items():
+            if kind == OBJECT:
+                self._values[column].extend(converted[column][0] if column in converted else [None] * n_rows)
+            elif column in converted:
+                values, missing = converted[column]
+                self._values[column][start:end] = values
+                if kind == INT:
+                    self._missing[column][start:end] = missing
+        self.size = end
+
+    def column(self, name):
+
+        """ Values of a column: a view of the array, or an IntegerArray when an INT column has missing values. """
+
+        kind = self.schema[name]
+        values = self._values[name][:self.size]
+        if kind == INT:
+            missing = self._missing[name][:self.size]
+            if missing.any():
+                return pd.arrays.IntegerArray(values, missing)
+        return values
+
+    def to_frame(self, columns=None):
+
+        """ DataFrame of the records, columns in schema order or in the given order. """
+
+        columns = list(self.schema) if columns is None else columns
+        return pd.DataFrame({column: self.column(column) for column in columns}, copy=False)
+
+    def take(self, positions):
+
+        """ New records with the rows at positions, in that order. """
+
+        taken = WordRecords(self.schema, len(positions))
+        for column, kind in self.schema.items():
+            if kind == OBJECT:
+                taken._values[column] = [self._values[column][position] for position in positions]
+            else:
+                taken._values[column] = self._values[column][:self.size][positions]
+                if kind == INT:
+                    taken._missing[column] = self._missing[column][:self.size][positions]
+        taken.size = taken.capacity = len(positions)
+        return taken
+
+    @classmethod
+    def concat(cls, records, schema):
+
+        """ Records of several builders with the same schema, one after the other. """
+
+        combined = cls(schema, sum(len(part) for part in records))
+        for column, kind in combined.schema.items():
+            if kind == OBJECT:
+                combined._values[column] = [value for part in records for value in part._values[column]]
+            else:
+                combined._values[column] = np.concatenate([part._values[column][:part.size] for part in records]
+                                                          + [combined._values[column][:0]])
+                if kind == INT:
+                    combined._missing[column] = np.concatenate([part._missing[column][:part.size] for part in records]
+                                                               + [combined._missing[column][:0]])
+        combined.size = combined.capacity = sum(len(part) for part in records)
+        return combined
+
+    def __getstate__(self):
+        # the unused capacity is not sent to other processes
+        values = {column: values[:self.size] for column, values in self._values.items()}
+        missing = {column: missing[:self.size] for column, missing in self._missing.items()}
+        return self.schema, self.size, values, missing
+
+    def __setstate__(self, state):
+        self.schema, self.size, self._values, self._missing = state
+        self.capacity = self.size
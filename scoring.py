@@ -0,0 +1,358 @@
+import argparse
+
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import data_prep
+from cache import LRUCache
+from inference_bundle import InferenceBundle
+from model import feature_engineering
+
+# Fields of a phrase request, the same as the asr_data.csv columns
+PHRASE_FIELDS = ['story_text', 'phrase_index', 'amazon_data', 'kaldi_data', 'kaldiNa_data', 'wav2vec_transcript_phonemes']
+
+
+class PhraseScorer:
+
+    """
+    Per-word predictions for single phrases, with the inference bundle saved
+    by `model.py --save_dir`. The bundle is loaded once; each phrase goes through data_prep.process_row and
+    model.feature_engineering in memory, exactly like the training data.
+
+    Args:
+      bundle_path: directory written by inference_bundle.save_bundle
+      pron_dict: optional compiled dictionary from pron_dict.py
+      dic_path, mapping_path: pronunciation dictionary used when pron_dict is not given
+      lexical_cache: optional SQLite file of the lexical feature store
+      threshold: probability from which a word is labelled 1 (read correctly)
+      story_cache_size: story phrases kept prepared, least recently used first out
+    """
+
+    def __init__(self, bundle_path, pron_dict=None, dic_path=data_prep.dic_file_path,
+                 mapping_path=data_prep.json_file_path, lexical_cache=None, threshold=0.5, story_cache_size=10000):
+        self.bundle = InferenceBundle(bundle_path)
+        self.threshold = threshold
+
+        data_prep.init_dictionaries(mapping_path, dic_path, pron_dict)
+        data_prep.init_lexical_store(lexical_cache)
+        # requests can carry any story_text, so prepared phrases are bounded
+        data_prep.set_story_index(LRUCache(maxsize=story_cache_size))
+        # bundles trained with data_prep.py --lattice_features need them at scoring time too
+        data_prep.set_lattice_features(any(column in self.bundle.feature_columns
+                                           for column in data_prep.CROSS_ENGINE_COLUMNS))
+        # and POS tagged over whole phrases if it was prepared with --phrase_pos
+        self.phrase_pos = bool(self.bundle.manifest['metadata'].get('phrase_pos', False))
+
+    def warmup(self, stories_df):
+
+        """
+        Prepare story phrases and their lexical features before serving, so
+        the first reader of a story does not pay for them.
+
+        Args:
+          stories_df: dataframe with story_text and phrase_index, ex. asr_data.csv
+        """
+
+        data_prep.build_story_index(stories_df, data_prep.story_index, phrase_pos=self.phrase_pos)
+        return len(data_prep.story_index)
+
+    def _row(self, phrase, position):
+        row = {field: phrase[field] for field in PHRASE_FIELDS}
+        # payloads may be sent as JSON objects instead of the CSV text
+        for name, column, prefix, parser in data_prep.ASR_ENGINES:
+            if not isinstance(row[column], str):
+                row[column] = json.dumps(row[column])
+        # phrases of one batch are told apart by their position
+        row['activityId'] = position
+        return row
+
+    def score_batch(self, phrases):
+
+        """
+        Score several phrases with one feature_engineering pass and one
+        booster call.
+
+        Args:
+          phrases: list of dicts with the PHRASE_FIELDS of a phrase
+
+        Return:
+          list: per phrase, a list of {'word_index', 'expected_text',
+          'probability', 'label'}, or None if the phrase could not be processed
+        """
+
+        rows = []
+        for position, phrase in enumerate(phrases):
+            try:
+                rows.append(self._row(phrase, position))
+            except Exception:
+                continue
+
+        # new story phrases are prepared together, as in training, and kept for later requests
+        if rows:
+            data_prep.build_story_index(pd.DataFrame(rows, columns=PHRASE_FIELDS), data_prep.story_index,
+                                        phrase_pos=self.phrase_pos)
+
+        records = data_prep.word_records(capacity=8 * len(phrases))
+        for row in rows:
+            try:
+                data_prep.process_row(row, records)
+            except Exception:
+                continue
+
+        scored = [None] * len(phrases)
+        if not len(records):
+            return scored
+
+        words_df = data_prep.word_frame(records)
+        positions = words_df['activityId'].to_numpy()
+        word_indices = words_df['word_index'].to_numpy()
+        expected_texts = words_df['expected_text'].to_numpy()
+
+        features_df = feature_engineering(words_df.fillna(0))
+        probabilities = self.bundle.predict_proba(features_df)
+
+        for position, word_index, expected_text, probability in zip(positions, word_indices, expected_texts, probabilities):
+            if scored[position] is None:
+                scored[position] = []
+            scored[position].append({'word_index': int(word_index),
+                                     'expected_text': expected_text,
+                                     'probability': float(probability),
+                                     'label': int(probability >= self.threshold)
+                                     })
+        return scored
+
+    def score(self, phrase):
+
+        """ Score one phrase, see score_batch. Raises ValueError if it cannot be processed. """
+
+        scored = self.score_batch([phrase])[0]
+        if scored is None:
+            raise ValueError("phrase could not be processed")
+        return scored
+
+
+class LatencyTracker:
+
+    """
+    Request latencies over a sliding window, checked against a p99 target.
+
+    Args:
+      p99_target_ms: latency budget of the 99th percentile
+      window: number of most recent requests kept
+    """
+
+    def __init__(self, p99_target_ms=50.0, window=10000):
+        self.p99_target_ms = p99_target_ms
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, seconds):
+        self.latencies.append(seconds * 1000)
+        self.requests += 1
+
+    def stats(self):
+        if not self.latencies:
+            return {'requests': 0, 'p99_target_ms': self.p99_target_ms}
+        p50, p95, p99 = np.percentile(np.fromiter(self.latencies, dtype=np.float64), [50, 95, 99])
+        return {'requests': self.requests,
+                'p50_ms': round(float(p50), 3),
+                'p95_ms': round(float(p95), 3),
+                'p99_ms': round(float(p99), 3),
+                'p99_target_ms': self.p99_target_ms,
+                'within_target': bool(p99 <= self.p99_target_ms)
+                }
+
+
+class MicroBatcher:
+
+    """
+    Groups concurrent requests into one score_batch call: the first request
+    waits at most max_wait_ms for others to join, up to max_batch_size.
+    Scoring runs in a single background thread so the event loop keeps
+    accepting requests meanwhile.
+
+    Args:
+      scorer: PhraseScorer
+      max_batch_size: maximum number of phrases per batch
+      max_wait_ms: time the first phrase of a batch waits for others
+    """
+
+    def __init__(self, scorer, max_batch_size=32, max_wait_ms=2.0):
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.phrases = 0
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, phrase):
+        if self._queue is None:
+            raise RuntimeError("MicroBatcher.run() is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((phrase, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                scored = await loop.run_in_executor(self._executor, self.scorer.score_batch, [phrase for phrase, future in batch])
+            except Exception as exc:
+                for phrase, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            self.batches += 1
+            self.phrases += len(batch)
+            for (phrase, future), words in zip(batch, scored):
+                if not future.done():
+                    future.set_result(words)
+
+    def stats(self):
+        return {'batches': self.batches, 'mean_batch_size': self.phrases / self.batches if self.batches else 0.0}
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 422: 'Unprocessable Entity', 500: 'Internal Server Error'}
+
+
+class ScoringServer:
+
+    """
+    Minimal HTTP/1.1 JSON server on asyncio, keep-alive supported.
+
+      POST /score  one phrase -> {"words": [...]}, or {"phrases": [...]} -> {"results": [...]}
+      GET  /stats  latency percentiles and batching stats
+      GET  /health
+
+    Args:
+      batcher: MicroBatcher
+      latency: LatencyTracker
+    """
+
+    def __init__(self, batcher, latency):
+        self.batcher = batcher
+        self.latency = latency
+
+    async def _score(self, body):
+        request = json.loads(body)
+        if not isinstance(request, dict):
+            raise ValueError("request body must be a JSON object")
+        if 'phrases' in request:
+            scored = await asyncio.gather(*[self.batcher.submit(phrase) for phrase in request['phrases']])
+            return 200, {'results': [{'words': words} if words is not None else {'error': "phrase could not be processed"}
+                                     for words in scored]}
+        words = await self.batcher.submit(request)
+        if words is None:
+            return 422, {'error': "phrase could not be processed"}
+        return 200, {'words': words}
+
+    async def route(self, method, target, body):
+        if method == 'POST' and target == '/score':
+            start = time.perf_counter()
+            try:
+                status, payload = await self._score(body)
+            except ValueError as exc:
+                return 400, {'error': str(exc)}
+            self.latency.record(time.perf_counter() - start)
+            return status, payload
+        if method == 'GET' and target == '/stats':
+            return 200, {**self.latency.stats(), **self.batcher.stats()}
+        if method == 'GET' and target == '/health':
+            return 200, {'status': 'ok'}
+        return 404, {'error': f"no route {method} {target}"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, payload = await self.route(method, target, body)
+                except Exception as exc:
+                    status, payload = 500, {'error': f"{type(exc).__name__}: {exc}"}
+
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(scorer, host='127.0.0.1', port=8080, max_batch_size=32, max_wait_ms=2.0, p99_target_ms=50.0):
+    batcher = MicroBatcher(scorer, max_batch_size, max_wait_ms)
+    server = ScoringServer(batcher, LatencyTracker(p99_target_ms))
+    batch_task = asyncio.create_task(batcher.run())
+    tcp_server = await asyncio.start_server(server.handle, host, port)
+    print(f"Scoring on http://{host}:{port}/score")
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        batch_task.cancel()
+
+
+def main(args):
+
+    scorer = PhraseScorer(args.bundle_path, args.pron_dict, args.dic_path, args.mapping_path, args.lexical_cache, args.threshold,
+                          args.story_cache_size)
+    if args.warmup_path:
+        stories_df = pd.read_csv(args.warmup_path, usecols=['story_text', 'phrase_index'])
+        print(f"Warm-up: {scorer.warmup(stories_df)} story phrases prepared")
+    asyncio.run(serve(scorer, args.host, args.port, args.max_batch_size, args.max_wait_ms, args.p99_target_ms))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Serve per-word predictions for single phrases.')
+    parser.add_argument('--bundle_path', type=str, default="model", help='inference bundle saved by model.py --save_dir')
+    parser.add_argument('--dic_path', type=str, default=data_prep.dic_file_path, help='path to the ARPABET pronunciation dictionary')
+    parser.add_argument('--mapping_path', type=str, default=data_prep.json_file_path, help='path to the ARPABET to AMIRABET mapping')
+    parser.add_argument('--pron_dict', type=str, default=None, help='compiled dictionary from pron_dict.py')
+    parser.add_argument('--lexical_cache', type=str, default=None, help='SQLite file of the lexical feature store')
+    parser.add_argument('--warmup_path', type=str, default=None, help='CSV with story_text and phrase_index columns to prepare before serving, ex. asr_data.csv')
+    parser.add_argument('--story_cache_size', type=int, default=10000, help='story phrases kept prepared between requests')
+    parser.add_argument('--threshold', type=float, default=0.5, help='probability from which a word is labelled as read correctly')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max_batch_size', type=int, default=32, help='maximum phrases scored together')
+    parser.add_argument('--max_wait_ms', type=float, default=2.0, help='time a request waits for others to batch with')
+    parser.add_argument('--p99_target_ms', type=float, default=50.0, help='p99 latency target reported by /stats')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,295 @@
+import argparse
+
+import json
+import os
+import random
+
+import pandas as pd
+
+# Words of early-reader stories, extended with made-up words when a larger vocabulary is asked for
+BASE_VOCABULARY = ("the a and to was he she it they said you of in on at his her I is with for had went "
+                   "big little red blue green dog cat bird fish frog duck hen pig cow horse mouse bear "
+                   "ran jumped saw looked played ate sat walked found liked wanted came got made took "
+                   "sun tree house park school ball book box bed hat car boat rain snow water garden "
+                   "mom dad friend teacher children family happy sad fast slow quick lazy brown happy "
+                   "over under up down into out away home day night morning every then when after "
+                   "because could would there where what who this that one two three many some all "
+                   "river mountain forest picnic basket rabbit turtle squirrel butterfly elephant "
+                   "beautiful wonderful suddenly carefully together something everyone tomorrow").split()
+
+SYLLABLES = ['ba', 'ko', 'mi', 'tar', 'len', 'shu', 'pi', 'dra', 'vo', 'nix', 'gle', 'rum', 'sa', 'thi', 'wen']
+
+# Rough letter to ARPABET rules, enough for pronunciations that share phonemes between similar spellings
+LETTER_SOUNDS = [('tion', ['SH', 'AH', 'N']), ('ing', ['IH', 'NG']), ('ch', ['CH']), ('sh', ['SH']),
+                 ('th', ['TH']), ('ph', ['F']), ('ck', ['K']), ('ee', ['IY']), ('oo', ['UW']),
+                 ('ou', ['AW']), ('ow', ['OW']), ('ai', ['EY']), ('ay', ['EY']), ('ea', ['IY']),
+                 ('a', ['AE']), ('b', ['B']), ('c', ['K']), ('d', ['D']), ('e', ['EH']), ('f', ['F']),
+                 ('g', ['G']), ('h', ['HH']), ('i', ['IH']), ('j', ['JH']), ('k', ['K']), ('l', ['L']),
+                 ('m', ['M']), ('n', ['N']), ('o', ['AA']), ('p', ['P']), ('q', ['K']), ('r', ['R']),
+                 ('s', ['S']), ('t', ['T']), ('u', ['AH']), ('v', ['V']), ('w', ['W']), ('x', ['K', 'S']),
+                 ('y', ['Y']), ('z', ['Z'])]
+
+FILLERS = ['um', 'uh', 'the', 'a']
+
+# Word recognition error rate of each engine on a correctly read word
+ENGINE_ERROR_RATES = {'amazon_data': 0.04, 'kaldi_data': 0.08, 'kaldiNa_data': 0.12}
+
+LABEL_COLUMNS = ['activityId', 'phraseIndex', 'word_index', 'expected_text', 'label']
+ASR_COLUMNS = ['activityId', 'phrase_index', 'story_text', 'amazon_data', 'kaldi_data', 'kaldiNa_data',
+               'wav2vec_transcript_words', 'wav2vec_transcript_phonemes']
+
+
+def make_vocabulary(size, rng):
+
+    """ size words, BASE_VOCABULARY first, then made-up words of two or three syllables. """
+
+    vocabulary = list(dict.fromkeys(word.lower() for word in BASE_VOCABULARY))
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary[:size]
+
+
+def pronounce(word):
+
+    """ ARPABET pronunciation of a word from LETTER_SOUNDS, repeated phonemes merged. """
+
+    word = word.lower()
+    phonemes = []
+    i = 0
+    while i < len(word):
+        for letters, sounds in LETTER_SOUNDS:
+            if word.startswith(letters, i):
+                for sound in sounds:
+                    if not phonemes or phonemes[-1] != sound:
+                        phonemes.append(sound)
+                i += len(letters)
+                break
+        else:
+            i += 1
+    return phonemes or ['AH']
+
+
+def make_stories(n_stories, phrases_per_story, vocabulary, rng, words_per_phrase=(3, 10)):
+
+    """ Stories as lists of phrase texts, capitalized and punctuated like the story_text column. """
+
+    stories = []
+    for _ in range(n_stories):
+        phrases = []
+        for _ in range(phrases_per_story):
+            words = [rng.choice(vocabulary) for _ in range(rng.randint(*words_per_phrase))]
+            if len(words) > 4 and rng.random() < 0.3:
+                words[rng.randint(1, len(words) - 3)] += ','
+            words[0] = words[0].capitalize()
+            phrases.append(' '.join(words) + rng.choice('..!?'))
+        stories.append(phrases)
+    return stories
+
+
+def misread(word, vocabulary, rng):
+
+    """ A plausible substitution: a close spelling or another word. """
+
+    if len(word) > 2 and rng.random() < 0.6:
+        position = rng.randrange(len(word))
+        return word[:position] + rng.choice('aeioustnrl') + word[position + 1:]
+    return rng.choice(vocabulary)
+
+
+def read_phrase(words, error_rate, insertion_rate, vocabulary, rng):
+
+    """
+    Simulate a student reading a phrase.
+
+    Return:
+      tuple: labels, one per expected word (1 read correctly), and the spoken
+      words as (word, correct) pairs, insertions included
+    """
+
+    labels = []
+    spoken = []
+    for word in words:
+        if rng.random() < insertion_rate:
+            spoken.append((rng.choice(FILLERS), False))
+        draw = rng.random()
+        if draw >= error_rate:
+            labels.append(1)
+            spoken.append((word, True))
+        else:
+            labels.append(0)
+            # deletions are rarer than substitutions
+            if draw < error_rate * 0.35:
+                continue
+            spoken.append((misread(word, vocabulary, rng), False))
+    return labels, spoken
+
+
+def recognize(spoken, engine_error_rate, vocabulary, rng):
+
+    """ An engine's view of the spoken words: (word, confidence, hesitation) for each recognized word. """
+
+    recognized = []
+    for word, correct in spoken:
+        draw = rng.random()
+        if draw < engine_error_rate / 3:
+            continue
+        if draw < engine_error_rate:
+            word, correct = rng.choice(vocabulary), False
+        confidence = rng.betavariate(8, 1.5) if correct else rng.betavariate(2, 2.5)
+        hesitation = rng.expovariate(8) if correct else rng.expovariate(2)
+        recognized.append((word, round(confidence, 3), round(hesitation, 2)))
+    return recognized
+
+
+def amazon_payload(recognized):
+    return {'text': ' '.join(word for word, confidence, hesitation in recognized),
+            'confidence': [[word, confidence] for word, confidence, hesitation in recognized],
+            'lapse': [[word, hesitation] for word, confidence, hesitation in recognized]
+            }
+
+
+def kaldi_payload(recognized, rng):
+    transcription = []
+    time = round(rng.uniform(0.2, 1.0), 2)
+    for word, confidence, hesitation in recognized:
+        start_time = round(time + hesitation, 2)
+        end_time = round(start_time + 0.08 * len(word) + rng.uniform(0.05, 0.2), 2)
+        transcription.append({'word': word, 'confidence': confidence, 'start_time': start_time, 'end_time': end_time})
+        time = end_time
+    return {'text': ' '.join(word for word, confidence, hesitation in recognized), 'transcription': transcription}
+
+
+def phoneme_transcript(spoken, arpabet_to_amirabet, phoneme_error_rate, rng):
+
+    """ wav2vec phoneme transcript of the spoken words in AMIRABET, one space separated word each. """
+
+    symbols = list(arpabet_to_amirabet.values())
+    words = []
+    for word, correct in spoken:
+        phonemes = []
+        for phoneme in pronounce(word):
+            draw = rng.random()
+            if draw < phoneme_error_rate / 3:
+                continue
+            phonemes.append(rng.choice(symbols) if draw < phoneme_error_rate else arpabet_to_amirabet[phoneme])
+        if phonemes:
+            words.append(''.join(phonemes))
+    return ' '.join(words)
+
+
+def generate(n_sessions=100, n_stories=10, phrases_per_story=8, vocabulary_size=300, error_rate=0.1,
+             insertion_rate=0.03, phoneme_error_rate=0.1, failure_rate=0.005,
+             mapping_path='arpabet_to_amirabet.json', seed=0):
+
+    """
+    Synthetic labels.csv / asr_data.csv rows in the layout of the challenge
+    data. Every session reads one story; each student gets an own error
+    rate around error_rate, errors are labelled 0 and show up in all three
+    engines and in the wav2vec phonemes, with lower confidences and longer
+    lapses than correctly read words.
+
+    Args:
+      n_sessions: number of activities
+      n_stories: number of distinct stories the sessions read
+      phrases_per_story: phrases of each story
+      vocabulary_size: number of distinct story words
+      error_rate: mean share of words read incorrectly (deleted or substituted)
+      insertion_rate: chance of an extra word before each expected word
+      phoneme_error_rate: share of wav2vec phonemes dropped or substituted
+      failure_rate: share of rows with an unparsable ASR payload
+      mapping_path: ARPABET to AMIRABET mapping
+      seed: random seed, the same arguments give the same data
+
+    Return:
+      tuple: labels dataframe, asr_data dataframe (payloads as python
+      literals, like the CSV), pronunciations dict word -> ARPABET list
+    """
+
+    rng = random.Random(seed)
+    with open(mapping_path, 'r', encoding='utf-8') as file:
+        arpabet_to_amirabet = json.load(file)
+
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    stories = make_stories(n_stories, phrases_per_story, vocabulary, rng)
+
+    labels = []
+    asr_rows = []
+    for session in range(n_sessions):
+        activity_id = f'{rng.getrandbits(48):012x}{session:06d}'
+        story = rng.choice(stories)
+        reader_error_rate = min(0.9, rng.betavariate(2, 2 / error_rate - 2) if 0 < error_rate < 1 else error_rate)
+        for phrase_index, story_text in enumerate(story):
+            expected_words = story_text.split()
+            words = [word.strip('.,!?').lower() for word in expected_words]
+            phrase_labels, spoken = read_phrase(words, reader_error_rate, insertion_rate, vocabulary, rng)
+            for word_index, (expected_text, label) in enumerate(zip(expected_words, phrase_labels)):
+                labels.append((activity_id, phrase_index, word_index, expected_text, label))
+
+            payloads = {}
+            for column, engine_error_rate in ENGINE_ERROR_RATES.items():
+                recognized = recognize(spoken, engine_error_rate, vocabulary, rng)
+                payload = amazon_payload(recognized) if column == 'amazon_data' else kaldi_payload(recognized, rng)
+                payloads[column] = repr(payload)
+            if rng.random() < failure_rate:
+                payloads[rng.choice(list(ENGINE_ERROR_RATES))] = "{'text': 'broken"
+
+            asr_rows.append((activity_id, phrase_index, story_text, payloads['amazon_data'], payloads['kaldi_data'],
+                             payloads['kaldiNa_data'], ' '.join(word for word, correct in spoken),
+                             phoneme_transcript(spoken, arpabet_to_amirabet, phoneme_error_rate, rng)))
+
+    pronunciations = {word: pronounce(word) for word in vocabulary}
+    return (pd.DataFrame(labels, columns=LABEL_COLUMNS),
+            pd.DataFrame(asr_rows, columns=ASR_COLUMNS),
+            pronunciations)
+
+
+def write_dic(pronunciations, path):
+
+    """ Write pronunciations in the all_story_words.dic format, upper case words. """
+
+    with open(path, 'w', encoding='utf-8') as file:
+        for word, phonemes in pronunciations.items():
+            file.write(word.upper() + ' ' + ' '.join(phonemes) + '\n')
+
+
+def write_dataset(save_dir, labels_df, asr_data_df, pronunciations):
+
+    """ labels.csv, asr_data.csv and all_story_words.dic in save_dir, ready for data_prep.py. """
+
+    os.makedirs(save_dir, exist_ok=True)
+    labels_df.to_csv(os.path.join(save_dir, 'labels.csv'), index=False)
+    asr_data_df.to_csv(os.path.join(save_dir, 'asr_data.csv'), index=False)
+    write_dic(pronunciations, os.path.join(save_dir, 'all_story_words.dic'))
+
+
+def main(args):
+
+    labels_df, asr_data_df, pronunciations = generate(args.sessions, args.stories, args.phrases_per_story,
+                                                      args.vocabulary_size, args.error_rate, args.insertion_rate,
+                                                      args.phoneme_error_rate, args.failure_rate,
+                                                      args.mapping_path, args.seed)
+    write_dataset(args.save_dir, labels_df, asr_data_df, pronunciations)
+    print(f"{len(asr_data_df)} phrases, {len(labels_df)} labelled words "
+          f"({1 - labels_df['label'].mean():.1%} errors), {len(pronunciations)} dictionary words saved to {args.save_dir}")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic labels.csv, asr_data.csv and all_story_words.dic.')
+    parser.add_argument('--save_dir', type=str, default="synthetic", help='directory to write the dataset to')
+    parser.add_argument('--sessions', type=int, default=100, help='number of activities')
+    parser.add_argument('--stories', type=int, default=10, help='number of distinct stories')
+    parser.add_argument('--phrases_per_story', type=int, default=8)
+    parser.add_argument('--vocabulary_size', type=int, default=300, help='number of distinct story words')
+    parser.add_argument('--error_rate', type=float, default=0.1, help='mean share of words read incorrectly')
+    parser.add_argument('--insertion_rate', type=float, default=0.03, help='chance of an inserted word before each word')
+    parser.add_argument('--phoneme_error_rate', type=float, default=0.1, help='share of noisy wav2vec phonemes')
+    parser.add_argument('--failure_rate', type=float, default=0.005, help='share of rows with an unparsable ASR payload')
+    parser.add_argument('--mapping_path', type=str, default="arpabet_to_amirabet.json", help='path to the ARPABET to AMIRABET mapping')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args)
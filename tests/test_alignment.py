@@ -0,0 +1,26 @@
+import json
+import os
+
+from alignment import align_phonemes_weighted_batch, phoneme_costs, phoneme_level_alignment
+
+MAPPING_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'arpabet_to_amirabet.json')
+
+
+def costs():
+    with open(MAPPING_PATH, 'r') as file:
+        return phoneme_costs(json.load(file))
+
+
+def test_weighted_batch_empty_word_fails_only_its_pair():
+    references = ['kæt dɔg', 'kæt  dɔg', ' kæt', '', 'kæt']
+    hypotheses = ['kæt dɔg', 'kæt dɔg', 'kæt', 'kæt', '']
+    results = align_phonemes_weighted_batch(references, hypotheses, costs())
+
+    assert results[0].words == phoneme_level_alignment(references[0], hypotheses[0])
+    assert results[0].distance == 0.0
+    # empty reference words: no per-word output, the distance is still aligned
+    assert results[1].words is None and results[1].distance == 1.0
+    assert results[2].words is None and results[2].distance == 1.0
+    # empty sequences: only insertions or deletions
+    assert results[3].words == [] and results[3].distance == 3.0
+    assert results[4].words == phoneme_level_alignment('kæt', '') and results[4].distance == 3.0
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from records import FLOAT, INT, OBJECT, WordRecords
+
+SCHEMA = {'activityId': OBJECT, 'phraseIndex': INT, 'expected_text': OBJECT, 'confidence': FLOAT}
+
+
+def test_bad_row_between_good_rows_adds_nothing():
+    records = WordRecords(SCHEMA, capacity=2)
+    records.append(2, {'activityId': 'a', 'phraseIndex': 0, 'expected_text': ['the', 'cat'], 'confidence': [0.5, 0.9]})
+    with pytest.raises(ValueError):
+        records.append(2, {'activityId': 'b', 'phraseIndex': np.nan, 'expected_text': ['a', 'dog'], 'confidence': 1.0})
+    records.append(1, {'activityId': 'c', 'phraseIndex': 2, 'expected_text': ['sat']})
+
+    frame = records.to_frame()
+    assert len(records) == 3
+    assert frame['activityId'].tolist() == ['a', 'a', 'c']
+    assert frame['phraseIndex'].tolist() == [0, 0, 2]
+    assert frame['expected_text'].tolist() == ['the', 'cat', 'sat']
+    np.testing.assert_array_equal(frame['confidence'], [0.5, 0.9, np.nan])
+
+
+def test_missing_int_values():
+    records = WordRecords(SCHEMA)
+    records.append(2, {'activityId': 'a', 'phraseIndex': [1, None], 'expected_text': ['the', 'cat']})
+    assert records.column('phraseIndex').tolist() == [1, pd.NA]